@@ -0,0 +1,235 @@
+"""
+Measure the authentication hot path and the key endpoints.
+The results are written as JSON, and compared with a baseline written before.
+
+    python -m benchmarks.auth --users 1000000 --iterations 10000 --output results.json
+    python -m benchmarks.auth --users 1000000 --iterations 10000 --baseline results.json --tolerance 0.2
+"""
+import sys
+import json
+import random
+import sqlite3
+import argparse
+import platform
+from uuid import uuid4
+from time import perf_counter
+from datetime import timedelta
+from contextlib import contextmanager
+
+from benchmarks import environment, fixtures
+
+# Create your benchmarks here.
+
+# Compared with the baseline, more queries per call are always a regression.
+METRICS = ('ops_per_sec', 'p50_us', 'p99_us', 'queries_per_call')
+
+
+@contextmanager
+def count_queries(counter):
+    """
+    Count the queries executed on the default database into counter[0].
+    """
+    from django.db import connection
+
+    def wrapper(execute, sql, params, many, context):
+        counter[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield counter
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+def measure(call, arguments, warmup=0):
+    """
+    Return the throughput, the latency percentiles and the queries of calling the function with each argument.
+
+    :param call: Benchmarked function.
+    :param list arguments: Argument of each call.
+    :param int warmup: Number of calls that are not measured.
+    """
+    for argument in arguments[:warmup]:
+        call(argument)
+
+    arguments = arguments[warmup:]
+    latencies = []
+    counter = [0]
+
+    with count_queries(counter):
+        started = perf_counter()
+
+        for argument in arguments:
+            called = perf_counter()
+            call(argument)
+            latencies.append(perf_counter() - called)
+
+        elapsed = perf_counter() - started
+
+    latencies.sort()
+    return {
+        'iterations': len(arguments),
+        'ops_per_sec': round(len(arguments) / elapsed, 1),
+        'p50_us': round(percentile(latencies, 0.5) * 1000000, 1),
+        'p99_us': round(percentile(latencies, 0.99) * 1000000, 1),
+        'queries_per_call': round(counter[0] / len(arguments), 3),
+    }
+
+
+def get_benchmarks(iterations):
+    """
+    Return the benchmarks as (name, function, arguments) on a random sample of the keys.
+
+    :param int iterations: Number of calls per benchmark.
+    """
+    from django.contrib.auth import get_user_model
+
+    from rest_framework.test import APIRequestFactory
+
+    from rest_framework_jk import compat, models, views
+    from rest_framework_jk.settings import api_settings
+    from rest_framework_jk.authentication import AuthKeyAuthentication, AccessKeyAuthentication
+
+    factory = APIRequestFactory()
+
+    def sample(model, field):
+        values = list(model.objects.values_list(field, flat=True).order_by('?')[:iterations])
+        return [random.choice(values) for i in range(iterations)] if values else []
+
+    auth_keys = [key.hex for key in sample(models.AuthKey, 'key')]
+    refresh_keys = [key.hex for key in sample(models.RefreshKey, 'key')]
+    access_keys = [key.hex for key in sample(models.AccessKey, 'key')]
+    unknown_keys = [uuid4().hex for i in range(iterations)]
+    usernames = sample(get_user_model(), 'username')
+
+    def header(prefix, keys):
+        return [factory.get('/', HTTP_AUTHORIZATION='%s %s' % (prefix, key)) for key in keys]
+
+    auth_requests = header(api_settings.AUTH_HEADER_PREFIX, auth_keys)
+    access_requests = header(api_settings.ACCESS_HEADER_PREFIX, access_keys)
+
+    obtain_view = views.AuthKeyViewSet.as_view({'post': 'create'})
+    refresh_view = views.AuthKeyViewSet.as_view({'put': 'refresh'})
+
+    def obtain(username):
+        request = factory.post('/', {'username': username, 'password': fixtures.PASSWORD}, format='json')
+        response = obtain_view(request)
+        assert response.status_code == 200, response.data
+        return response.data
+
+    # Every refresh replaces the keys, so the refresh benchmark runs on the keys of its own users.
+    refresh_users = sorted(set(usernames))[:100]
+    current_keys = {username: obtain(username) for username in refresh_users}
+
+    def refresh(username):
+        request = factory.put('/', current_keys[username], format='json')
+        response = refresh_view(request)
+        assert response.status_code == 200, response.data
+        current_keys[username] = response.data
+
+    return [
+        ('parse_auth_header', AuthKeyAuthentication().get_key, auth_requests),
+        ('parse_access_header', AccessKeyAuthentication().get_key, access_requests),
+        ('verify_auth_key', compat.verify_auth_key, auth_keys),
+        ('verify_refresh_key', compat.verify_refresh_key, refresh_keys),
+        ('verify_access_key', compat.verify_access_key, access_keys),
+        ('verify_unknown_access_key', compat.verify_access_key, unknown_keys),
+        ('authenticate_auth_key', AuthKeyAuthentication().authenticate, auth_requests),
+        ('authenticate_access_key', AccessKeyAuthentication().authenticate, access_requests),
+        ('obtain', obtain, usernames),
+        ('refresh', refresh, [refresh_users[i % len(refresh_users)] for i in range(iterations)]),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of the results against the baseline.
+
+    :param dict results: Benchmark results.
+    :param dict baseline: Benchmark results written before.
+    :param float tolerance: Allowed relative slowdown, e.g. 0.2 for 20%.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        before = baseline.get(name)
+
+        if before is None:
+            continue
+
+        if result['queries_per_call'] > before['queries_per_call']:
+            regressions.append('%s: queries_per_call %s -> %s' % (
+                name, before['queries_per_call'], result['queries_per_call']))
+
+        if result['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance):
+            regressions.append('%s: ops_per_sec %s -> %s' % (name, before['ops_per_sec'], result['ops_per_sec']))
+
+        if result['p99_us'] > before['p99_us'] * (1 + tolerance):
+            regressions.append('%s: p99_us %s -> %s' % (name, before['p99_us'], result['p99_us']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=None)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--access-keys', type=int, default=1, help='Number of access keys per user.')
+    parser.add_argument('--iterations', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--cache', action='store_true', help='Enable the key cache.')
+    parser.add_argument('--output', default=None, help='Path of the JSON results, standard output by default.')
+    parser.add_argument('--baseline', default=None, help='Path of the JSON results to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    options = parser.parse_args()
+
+    jk_settings = {'KEY_CACHE_TIMEOUT': timedelta(minutes=1)} if options.cache else {}
+    environment.setup(options.database, **jk_settings)
+
+    import django
+
+    from rest_framework_jk import models
+
+    fixtures.generate(options.users, access_keys=options.access_keys)
+    results = {}
+
+    for name, call, arguments in get_benchmarks(options.iterations + options.warmup):
+        results[name] = measure(call, arguments, options.warmup)
+        print('%-26s %10.0f ops/sec %8.1f us p50 %8.1f us p99 %6.2f queries' % (
+            name, *(results[name][metric] for metric in METRICS)), file=sys.stderr)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cache': options.cache,
+            'auth_keys': models.AuthKey.objects.count(),
+            'refresh_keys': models.RefreshKey.objects.count(),
+            'access_keys': models.AccessKey.objects.count(),
+        },
+        'results': results,
+    }
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], options.tolerance)
+
+        for regression in regressions:
+            print('regression: %s' % regression, file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+# Create your benchmark environments here.
+
+
+def setup(database=None, **jk_settings):
+    """
+    Configure a standalone Django project on a SQLite database and migrate it.
+
+    :param str database: Path of the SQLite database, a temporary file by default.
+    :param jk_settings: REST_FRAMEWORK_JK settings overriding the benchmark defaults.
+    """
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(prefix='jk-benchmark-'), 'db.sqlite3')
+
+    settings.configure(
+        SECRET_KEY='benchmark',
+        USE_TZ=True,
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'rest_framework_jk',
+        ],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': database,
+            },
+        },
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        },
+        PASSWORD_HASHERS=[
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ],
+        REST_FRAMEWORK_JK=dict({
+            # Measure the database, not the key cache.
+            'KEY_CACHE_TIMEOUT': None,
+        }, **jk_settings),
+    )
+    django.setup()
+    call_command('migrate', verbosity=0)
+    return database
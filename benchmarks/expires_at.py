@@ -0,0 +1,67 @@
+"""
+Compare the lookup cost of the authentication key before and after the stored expiration date.
+
+    python -m benchmarks.expires_at --keys 1000000 --lookups 10000
+"""
+import random
+import argparse
+from time import perf_counter
+
+from benchmarks import environment, fixtures
+
+# Create your benchmarks here.
+
+
+def measure(lookup, keys):
+    started = perf_counter()
+
+    for key in keys:
+        lookup(key)
+
+    elapsed = perf_counter() - started
+    return len(keys) / elapsed, elapsed / len(keys) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--database', default=None)
+    options = parser.parse_args()
+
+    environment.setup(options.database)
+
+    from django.db import connection
+    from django.utils.timezone import now
+
+    from rest_framework_jk import models
+    from rest_framework_jk.settings import api_settings
+
+    fixtures.generate(options.keys, refresh_keys=0, access_keys=0)
+    keys = list(models.AuthKey.objects.values_list('key', flat=True).order_by('?')[:options.lookups])
+    random.shuffle(keys)
+    queryset = models.AuthKey.objects.select_related('owner')
+
+    def before(key):
+        return queryset.get(key=key, updated_at__gte=now() - api_settings.AUTH_EXPIRATION_DELTA)
+
+    def after(key):
+        return queryset.get(key=key, expires_at__gte=now())
+
+    print('%d auth keys, %d lookups' % (models.AuthKey.objects.count(), len(keys)))
+
+    for name, lookup, condition in (('before', before, 'updated_at'), ('after', after, 'expires_at')):
+        ops, latency = measure(lookup, keys)
+        print('%-6s %10.0f ops/sec %8.1f us/lookup' % (name, ops, latency))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'EXPLAIN QUERY PLAN SELECT id FROM jk_auth_keys WHERE key = %%s AND %s >= %%s' % condition,
+                [keys[0].hex, now()],
+            )
+            for row in cursor.fetchall():
+                print('       plan: %s' % row[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Generate benchmark users with their authentication, refresh and access keys.
+
+    python -m benchmarks.fixtures --database /tmp/jk.sqlite3 --users 1000000 --access-keys 2
+"""
+import argparse
+from time import perf_counter
+
+from benchmarks import environment
+
+# Create your fixtures here.
+
+USERNAME = 'benchmark-%d'
+PASSWORD = 'benchmark'
+
+
+def generate(users, auth_keys=None, refresh_keys=None, access_keys=1, batch_size=10000, password=PASSWORD):
+    """
+    Create the users and their keys with bulk_create, continuing after the users created before.
+    Every user has the same password.
+
+    :param int users: Number of users.
+    :param int auth_keys: Number of users with an authentication key, all users by default.
+    :param int refresh_keys: Number of users with a refresh key, all users by default.
+    :param int access_keys: Number of access keys per user.
+    :param int batch_size: Number of users per batch.
+    :param str password: Password of the users.
+    """
+    from django.utils.timezone import now
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+
+    from rest_framework_jk import models
+    from rest_framework_jk.settings import api_settings
+
+    UserModel = get_user_model()
+    auth_keys = users if auth_keys is None else auth_keys
+    refresh_keys = users if refresh_keys is None else refresh_keys
+    # Hash the password once, the hasher is the slowest part of creating a user.
+    hashed_password = make_password(password)
+    current = now()
+    offset = UserModel.objects.filter(username__startswith=USERNAME.split('%')[0]).count()
+
+    for start in range(offset, users, batch_size):
+        stop = min(start + batch_size, users)
+        usernames = [USERNAME % i for i in range(start, stop)]
+        UserModel.objects.bulk_create(UserModel(username=username, password=hashed_password) for username in usernames)
+        # SQLite does not return the primary keys of bulk_create on Django 2.x.
+        owners = list(UserModel.objects.filter(username__in=usernames).values_list('pk', flat=True).order_by('pk'))
+
+        models.AuthKey.objects.bulk_create(
+            models.AuthKey(owner_id=pk, updated_at=current, expires_at=current + api_settings.AUTH_EXPIRATION_DELTA)
+            for pk in owners[:max(auth_keys - start, 0)]
+        )
+        models.RefreshKey.objects.bulk_create(
+            models.RefreshKey(owner_id=pk, updated_at=current,
+                              expires_at=current + api_settings.REFRESH_EXPIRATION_DELTA)
+            for pk in owners[:max(refresh_keys - start, 0)]
+        )
+        models.AccessKey.objects.bulk_create(
+            models.AccessKey(owner_id=pk, name='benchmark', updated_at=current)
+            for pk in owners for i in range(access_keys)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--auth-keys', type=int, default=None)
+    parser.add_argument('--refresh-keys', type=int, default=None)
+    parser.add_argument('--access-keys', type=int, default=1, help='Number of access keys per user.')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    options = parser.parse_args()
+
+    environment.setup(options.database)
+
+    from rest_framework_jk import models
+
+    started = perf_counter()
+    generate(options.users, options.auth_keys, options.refresh_keys, options.access_keys, options.batch_size)
+    print('%d auth keys, %d refresh keys, %d access keys in %.1f s' % (
+        models.AuthKey.objects.count(),
+        models.RefreshKey.objects.count(),
+        models.AccessKey.objects.count(),
+        perf_counter() - started,
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare JKAuthentication with AuthKeyAuthentication and AccessKeyAuthentication listed one after the other.
+The header parsing is measured alone, and with the key lookups on the warm key cache.
+
+    python -m benchmarks.header --users 100 --iterations 100000
+"""
+import sys
+import json
+import random
+import argparse
+from datetime import timedelta
+
+from benchmarks import environment, fixtures
+from benchmarks.auth import METRICS, measure
+
+# Create your benchmarks here.
+
+
+def authenticate_with(authentications):
+    """
+    Return the function authenticating the request like DRF does with the authentication classes.
+
+    :param list authentications: Authentication instances.
+    """
+
+    def authenticate(request):
+        for authentication in authentications:
+            user_auth = authentication.authenticate(request)
+
+            if user_auth is not None:
+                return user_auth
+
+    return authenticate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=None)
+    # All keys should fit the per-process cache and the 300 entries of the local memory cache.
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--warmup', type=int, default=1000)
+    options = parser.parse_args()
+
+    environment.setup(options.database, KEY_CACHE_TIMEOUT=timedelta(minutes=1))
+
+    from rest_framework.test import APIRequestFactory
+
+    from rest_framework_jk import models
+    from rest_framework_jk.settings import api_settings
+    from rest_framework_jk.authentication import AuthKeyAuthentication, AccessKeyAuthentication, JKAuthentication
+
+    fixtures.generate(options.users)
+    factory = APIRequestFactory()
+    count = options.iterations + options.warmup
+
+    def requests(prefix, model):
+        keys = list(model.objects.values_list('key', flat=True).order_by('?')[:count])
+        return [factory.get('/', HTTP_AUTHORIZATION='%s %s' % (prefix, random.choice(keys))) for i in range(count)]
+
+    # The keys are hyphenated, the form that UUID() parses the slowest.
+    auth_requests = requests(api_settings.AUTH_HEADER_PREFIX, models.AuthKey)
+    access_requests = requests(api_settings.ACCESS_HEADER_PREFIX, models.AccessKey)
+
+    separate = authenticate_with([AuthKeyAuthentication(), AccessKeyAuthentication()])
+    unified = JKAuthentication()
+
+    def parse_with(authentications):
+        def parse(request):
+            for authentication in authentications:
+                key = authentication.get_key(request)
+
+                if key is not None:
+                    return key
+
+        return parse
+
+    def parse_unified(request):
+        authentication, credentials = unified.get_scheme(request)
+        return authentication.parse_credentials(credentials)
+
+    benchmarks = [
+        ('separate_parse_auth', parse_with([AuthKeyAuthentication(), AccessKeyAuthentication()]), auth_requests),
+        ('unified_parse_auth', parse_unified, auth_requests),
+        ('separate_parse_access', parse_with([AuthKeyAuthentication(), AccessKeyAuthentication()]), access_requests),
+        ('unified_parse_access', parse_unified, access_requests),
+        ('separate_authenticate_auth', separate, auth_requests),
+        ('unified_authenticate_auth', unified.authenticate, auth_requests),
+        ('separate_authenticate_access', separate, access_requests),
+        ('unified_authenticate_access', unified.authenticate, access_requests),
+    ]
+    results = {}
+
+    # Fill the key cache with every key of the requests.
+    for request in auth_requests + access_requests:
+        separate(request)
+
+    for name, call, arguments in benchmarks:
+        results[name] = measure(call, arguments, options.warmup)
+        print('%-30s %10.0f ops/sec %8.1f us p50 %8.1f us p99 %6.2f queries' % (
+            name, *(results[name][metric] for metric in METRICS)), file=sys.stderr)
+
+    json.dump({'results': results}, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == '__main__':
+    main()
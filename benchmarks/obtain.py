@@ -0,0 +1,66 @@
+"""
+Compare the logins per second of the obtain endpoint with update_or_create and with the upsert.
+The upsert requires Django 4.1+ and SQLite 3.24+, otherwise only update_or_create is measured.
+
+    python -m benchmarks.obtain --users 100000 --iterations 10000
+"""
+import sys
+import json
+import argparse
+
+from benchmarks import environment, fixtures
+from benchmarks.auth import METRICS, measure
+
+# Create your benchmarks here.
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=None)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=100)
+    options = parser.parse_args()
+
+    environment.setup(options.database)
+
+    import random
+    from unittest.mock import patch
+
+    from django.contrib.auth import get_user_model
+
+    from rest_framework.test import APIRequestFactory
+
+    from rest_framework_jk import compat, views
+
+    fixtures.generate(options.users, access_keys=0)
+    factory = APIRequestFactory()
+    view = views.AuthKeyViewSet.as_view({'post': 'create'})
+    usernames = list(get_user_model().objects.values_list('username', flat=True).order_by('?')[:options.iterations])
+    usernames = [random.choice(usernames) for i in range(options.iterations + options.warmup)]
+
+    def obtain(username):
+        request = factory.post('/', {'username': username, 'password': fixtures.PASSWORD}, format='json')
+        response = view(request)
+        assert response.status_code == 200, response.data
+
+    strategies = [('update_or_create', compat.update_or_create_keys)]
+
+    if compat.supports_upsert(compat.models.AuthKey):
+        strategies.append(('upsert', compat.upsert_keys))
+
+    results = {}
+
+    for name, obtain_keys in strategies:
+        with patch.object(compat, 'obtain_keys', obtain_keys):
+            results[name] = measure(obtain, usernames, options.warmup)
+
+        print('%-18s %10.0f logins/sec %8.1f us p50 %8.1f us p99 %6.2f queries' % (
+            name, *(results[name][metric] for metric in METRICS)), file=sys.stderr)
+
+    json.dump({'results': results}, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == '__main__':
+    main()
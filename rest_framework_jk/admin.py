@@ -7,3 +7,5 @@ from rest_framework_jk import models
 admin.site.register(models.AuthKey)
 admin.site.register(models.RefreshKey)
 admin.site.register(models.AccessKey)
+admin.site.register(models.RevokedKey)
+admin.site.register(models.KeyGeneration)
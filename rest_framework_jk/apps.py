@@ -1,8 +1,47 @@
+import logging
+
+from django.db import DatabaseError
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 # Create your configs here.
 
 
 class RestFrameworkJkConfig(AppConfig):
     name = 'rest_framework_jk'
     verbose_name = 'REST framework JSON key'
+
+    def ready(self):
+        # Connect the cache invalidation signals.
+        from rest_framework_jk import compat, signals  # noqa: F401
+        from rest_framework_jk.bloom import access_key_filter
+        from rest_framework_jk.settings import api_settings
+
+        # Reject the settings that conflict before the first request.
+        compat.get_grace_period()
+        access_key_filter.get_interval()
+
+        if api_settings.WARM_CACHE_ON_STARTUP:
+            self.warm_cache()
+
+    def warm_cache(self):
+        """
+        Prefill the key caches of this process within WARM_CACHE_MAX_ENTRIES and WARM_CACHE_TIME_LIMIT.
+        """
+        from rest_framework_jk import compat
+        from rest_framework_jk.settings import api_settings
+
+        time_limit = api_settings.WARM_CACHE_TIME_LIMIT
+
+        try:
+            counts = compat.warm_key_caches(
+                api_settings.WARM_CACHE_MAX_ENTRIES,
+                time_limit=time_limit.total_seconds() if time_limit else None,
+            )
+        except DatabaseError:
+            # E.g. manage.py migrate before the tables are created.
+            logger.warning('The key caches were not warmed.', exc_info=True)
+            return
+
+        logger.info('The key caches were warmed: %s', counts)
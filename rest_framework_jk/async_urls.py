@@ -0,0 +1,11 @@
+from adrf import routers
+
+from rest_framework_jk import views, async_views
+
+# Create your async urls here.
+
+router = routers.DefaultRouter(trailing_slash=False)
+router.register('auth', async_views.AsyncAuthKeyViewSet, basename='auth')
+router.register('access', views.AccessKeyViewSet, basename='access')
+router.register('introspect', views.IntrospectionViewSet, basename='introspect')
+urlpatterns = router.urls
@@ -0,0 +1,57 @@
+from django.utils.translation import gettext as _
+
+from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import AllowAny
+
+from adrf.viewsets import GenericViewSet
+
+from rest_framework_jk import serializers
+from rest_framework_jk.timing import timed
+from rest_framework_jk.stores import get_key_store
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.signing import issue_auth_key
+
+# Create your async views here.
+# The async views require Django 4.2+ and adrf.
+
+
+class AsyncAuthKeyViewSet(GenericViewSet):
+    """
+    Asynchronous viewset of authentication key.
+    """
+    permission_classes = (AllowAny,)
+
+    def get_serializer_class(self):
+        if self.action == 'acreate':
+            return serializers.ObtainAuthKeySerializer
+        elif self.action == 'arefresh':
+            return serializers.RefreshAuthKeySerializer
+        return serializers.AuthKeySerializer
+
+    @metrics.endpoint('obtain')
+    @timed('jk-obtain')
+    async def acreate(self, request):
+        serializer = self.get_serializer(data=request.data, context={'request': request})
+        await serializer.ais_valid(raise_exception=True)
+        user = serializer.validated_data.get('user')
+        auth_key, refresh_key = await get_key_store().aobtain(user)
+        return Response({'auth_key': issue_auth_key(auth_key), 'refresh_key': refresh_key.key})
+
+    @action(detail=False, methods=['put', 'patch'], url_path='refresh', url_name='refresh')
+    @metrics.endpoint('refresh')
+    @timed('jk-refresh')
+    async def arefresh(self, request):
+        serializer = self.get_serializer(data=request.data)
+        await serializer.ais_valid(raise_exception=True)
+        auth_key = serializer.validated_data.get('auth_key')
+        refresh_key = serializer.validated_data.get('refresh_key')
+        refreshed = await get_key_store().arefresh(auth_key, refresh_key)
+
+        if refreshed is None:
+            message = _('Invalid in with provided credentials.')
+            raise PermissionDenied(message, code='verify_refresh_key')
+
+        auth_key, refresh_key = refreshed
+        return Response({'auth_key': issue_auth_key(auth_key), 'refresh_key': refresh_key.key})
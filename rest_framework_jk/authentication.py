@@ -1,12 +1,19 @@
-from uuid import UUID
+from time import perf_counter
 
-from django.utils.translation import ugettext as _
+from django.utils.translation import gettext as _
 
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
 
+from rest_framework_jk import models
+from rest_framework_jk.cache import normalize_key
+from rest_framework_jk.timing import timed
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.signing import is_signed_key
+from rest_framework_jk.snapshot import access_key_snapshot
+from rest_framework_jk.stores import get_key_store
 from rest_framework_jk.settings import api_settings
-from rest_framework_jk.compat import verify_auth_key, verify_access_key
+from rest_framework_jk.compat import verify_signed_auth_key, averify_signed_auth_key
 
 # Create your authentications here.
 
@@ -16,8 +23,39 @@ class BaseJKAuthentication(BaseAuthentication):
     Simple key based authentication.
     Clients should authenticate by passing the key in the "Authorization".
     """
+    accepts_signed_keys = False
+    usage_field = None
 
     def authenticate(self, request):
+        started = perf_counter()
+
+        try:
+            key = self.get_key(request)
+
+            if key is None:
+                return None
+
+            user_auth = self.authenticate_credentials(key)
+        except AuthenticationFailed as exc:
+            self.record(started, exc.get_codes())
+            raise
+
+        self.record(started, 'success')
+        return user_auth
+
+    def record(self, started, result):
+        """
+        Record the authentication attempt of this scheme in the metrics.
+        """
+        if metrics.enabled:
+            metrics.inc('jk_authentication_total', scheme=self.keyword, result=result)
+            metrics.observe('jk_authentication_seconds', perf_counter() - started, scheme=self.keyword)
+
+    @timed('jk-parse')
+    def get_key(self, request):
+        """
+        Return the key string in the authorization header, or None if the header is for another scheme.
+        """
         auth = get_authorization_header(request).split()
 
         if not auth:
@@ -25,32 +63,54 @@ class BaseJKAuthentication(BaseAuthentication):
         elif not auth[0].lower() == self.keyword.lower().encode():
             return None
 
+        try:
+            credentials = [credential.decode() for credential in auth[1:]]
+        except UnicodeError:
+            message = _('Invalid %s header. Key string should not contain invalid characters.' % self.keyword)
+            raise AuthenticationFailed(message, code='invalid_key')
+
+        return self.parse_credentials(credentials)
+
+    def parse_credentials(self, credentials):
+        """
+        Return the key string of the credentials that follow the prefix in the authorization header.
+
+        :param list credentials: Strings that follow the prefix.
+        """
         # Confirm the number of fields in the authorization header.
-        if len(auth) == 1:
+        if len(credentials) == 0:
             message = _('Invalid %s header. No credentials provided.' % self.keyword)
-            raise AuthenticationFailed(message)
-        elif len(auth) > 2:
+            raise AuthenticationFailed(message, code='no_credentials')
+        elif len(credentials) > 1:
             message = _('Invalid %s header. Key string should not contain spaces.' % self.keyword)
-            raise AuthenticationFailed(message)
+            raise AuthenticationFailed(message, code='invalid_header')
+
+        # Signed keys are verified as they are.
+        if self.accepts_signed_keys and is_signed_key(credentials[0]):
+            return credentials[0]
 
         # Confirm the key is UUID.
-        try:
-            key = UUID(auth[1].decode()).hex
-        except ValueError:
+        key = normalize_key(credentials[0])
+
+        if key is None:
             message = _('Invalid %s header. Key string is not a valid UUID.' % self.keyword)
-            raise AuthenticationFailed(message)
+            raise AuthenticationFailed(message, code='invalid_key')
 
-        return self.authenticate_credentials(key)
+        return key
 
     def authenticate_credentials(self, key):
 
         if not key:
             message = _('Invalid key.')
-            raise AuthenticationFailed(message)
+            raise AuthenticationFailed(message, code='unknown_key')
 
         if not key.owner.is_active:
             message = _('This key is disabled.')
-            raise AuthenticationFailed(message)
+            raise AuthenticationFailed(message, code='disabled_owner')
+
+        # Record the usage of the key, it is written behind.
+        if self.usage_field:
+            get_key_store().touch(key, self.usage_field)
 
         return (key.owner, key)
 
@@ -61,8 +121,20 @@ class AuthKeyAuthentication(BaseJKAuthentication):
     """
     keyword = api_settings.AUTH_HEADER_PREFIX
 
+    @property
+    def accepts_signed_keys(self):
+        return api_settings.SIGNED_AUTH_KEYS
+
+    @property
+    def usage_field(self):
+        # Slide the expiration of the key that has been used.
+        return 'updated_at' if api_settings.AUTH_SLIDING_EXPIRATION else None
+
     def authenticate_credentials(self, key):
-        auth_key = verify_auth_key(key)
+        if is_signed_key(key):
+            auth_key = verify_signed_auth_key(key)
+        else:
+            auth_key = get_key_store().verify(models.AuthKey, key)
         return super().authenticate_credentials(auth_key)
 
 
@@ -71,7 +143,164 @@ class AccessKeyAuthentication(BaseJKAuthentication):
     It authenticates using the access key.
     """
     keyword = api_settings.ACCESS_HEADER_PREFIX
+    usage_field = 'last_used_at'
+
+    def authenticate_credentials(self, key):
+        access_key = get_key_store().verify(models.AccessKey, key)
+        return super().authenticate_credentials(access_key)
+
+
+class SnapshotAccessKeyAuthentication(BaseJKAuthentication):
+    """
+    It authenticates using the access key, verified in the snapshot of SNAPSHOT_PATH without the database.
+    The keys issued or revoked after the snapshot was exported are not known, and usages are not recorded.
+    """
+    keyword = api_settings.ACCESS_HEADER_PREFIX
 
     def authenticate_credentials(self, key):
-        access_key = verify_access_key(key)
+        access_key = access_key_snapshot.verify(key)
         return super().authenticate_credentials(access_key)
+
+
+class BaseAsyncJKAuthentication(BaseJKAuthentication):
+    """
+    Asynchronous key based authentication for async views, such as the views of adrf.
+    The key is verified with the async ORM and never blocks the event loop.
+    """
+
+    async def authenticate(self, request):
+        started = perf_counter()
+
+        try:
+            key = self.get_key(request)
+
+            if key is None:
+                return None
+
+            user_auth = await self.authenticate_credentials(key)
+        except AuthenticationFailed as exc:
+            self.record(started, exc.get_codes())
+            raise
+
+        self.record(started, 'success')
+        return user_auth
+
+
+class AsyncAuthKeyAuthentication(BaseAsyncJKAuthentication):
+    """
+    It authenticates using the authentication key asynchronously.
+    """
+    keyword = api_settings.AUTH_HEADER_PREFIX
+
+    @property
+    def accepts_signed_keys(self):
+        return api_settings.SIGNED_AUTH_KEYS
+
+    @property
+    def usage_field(self):
+        # Slide the expiration of the key that has been used.
+        return 'updated_at' if api_settings.AUTH_SLIDING_EXPIRATION else None
+
+    async def authenticate_credentials(self, key):
+        if is_signed_key(key):
+            auth_key = await averify_signed_auth_key(key)
+        else:
+            auth_key = await get_key_store().averify(models.AuthKey, key)
+        return super().authenticate_credentials(auth_key)
+
+
+class AsyncAccessKeyAuthentication(BaseAsyncJKAuthentication):
+    """
+    It authenticates using the access key asynchronously.
+    """
+    keyword = api_settings.ACCESS_HEADER_PREFIX
+    usage_field = 'last_used_at'
+
+    async def authenticate_credentials(self, key):
+        access_key = await get_key_store().averify(models.AccessKey, key)
+        return super().authenticate_credentials(access_key)
+
+
+class JKAuthentication(BaseJKAuthentication):
+    """
+    It authenticates using the authentication key or the access key.
+    The authorization header is parsed once, and dispatched on its prefix.
+    """
+    authentication_classes = (AuthKeyAuthentication, AccessKeyAuthentication)
+    schemes = None
+
+    @classmethod
+    def get_schemes(cls):
+        """
+        Return the table of the lowercase prefixes and the authentications that verify their keys.
+        """
+        if cls.schemes is None:
+            authentications = [authentication_class() for authentication_class in cls.authentication_classes]
+            cls.schemes = {authentication.keyword.lower(): authentication for authentication in authentications}
+
+        return cls.schemes
+
+    @timed('jk-parse')
+    def get_scheme(self, request):
+        """
+        Return the authentication of the prefix and the credentials that follow it,
+        or None if the header is for another scheme.
+        """
+        header = request.META.get('HTTP_AUTHORIZATION')
+
+        if not header:
+            return None
+
+        auth = header.split()
+        authentication = self.get_schemes().get(auth[0].lower()) if auth else None
+
+        if authentication is None:
+            return None
+
+        return authentication, auth[1:]
+
+    def authenticate(self, request):
+        started = perf_counter()
+        scheme = self.get_scheme(request)
+
+        if scheme is None:
+            return None
+
+        authentication, credentials = scheme
+
+        try:
+            key = authentication.parse_credentials(credentials)
+            user_auth = authentication.authenticate_credentials(key)
+        except AuthenticationFailed as exc:
+            authentication.record(started, exc.get_codes())
+            raise
+
+        authentication.record(started, 'success')
+        return user_auth
+
+
+class AsyncJKAuthentication(JKAuthentication):
+    """
+    It authenticates using the authentication key or the access key asynchronously.
+    """
+    authentication_classes = (AsyncAuthKeyAuthentication, AsyncAccessKeyAuthentication)
+    schemes = None
+
+    async def authenticate(self, request):
+        started = perf_counter()
+        scheme = self.get_scheme(request)
+
+        if scheme is None:
+            return None
+
+        authentication, credentials = scheme
+
+        try:
+            key = authentication.parse_credentials(credentials)
+            user_auth = await authentication.authenticate_credentials(key)
+        except AuthenticationFailed as exc:
+            authentication.record(started, exc.get_codes())
+            raise
+
+        authentication.record(started, 'success')
+        return user_auth
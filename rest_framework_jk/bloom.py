@@ -0,0 +1,285 @@
+import logging
+from os import urandom
+from math import ceil, log
+from time import monotonic
+from random import randrange
+from hashlib import blake2b
+from threading import Lock, Thread
+from collections import Counter, namedtuple
+
+from django.db import connections
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+from rest_framework_jk import models
+from rest_framework_jk.cache import auth_key_cache, access_key_cache, normalize_key
+from rest_framework_jk.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+# Create your filters here.
+
+FilterState = namedtuple('FilterState', ('bloom', 'version', 'built_at'))
+
+
+class BloomFilter:
+    """
+    Probabilistic set of keys.
+    It may report a key that was never added, but never misses a key that was added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(int(ceil(-capacity * log(error_rate) / log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / capacity * log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        # Keys are chosen by the clients, so the hashes are salted per filter.
+        self.salt = urandom(16)
+
+    def positions(self, value):
+        digest = blake2b(value, digest_size=16, key=self.salt).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+class AccessKeyFilter:
+    """
+    Per-process Bloom filter of all access keys, rebuilt periodically in a background thread.
+    A version number in the Django cache tells the filters of all processes that keys have been issued,
+    so the filter requires KEY_CACHE_ALIAS. A stale filter is not trusted until it is rebuilt.
+    """
+    version_key = 'jk:access:version'
+
+    def __init__(self):
+        self.state = None
+        self.started_at = None
+        self.lock = Lock()
+        self.stats = Counter()
+
+    @property
+    def shared(self):
+        return access_key_cache.shared
+
+    @property
+    def enabled(self):
+        return bool(self.get_interval())
+
+    def get_interval(self):
+        """
+        Return ACCESS_KEY_FILTER_INTERVAL, the filter is disabled if it is None.
+        """
+        interval = api_settings.ACCESS_KEY_FILTER_INTERVAL
+
+        # Without the Django cache, the keys issued by the other processes would be rejected until the rebuild.
+        if interval and self.shared is None:
+            raise ImproperlyConfigured('ACCESS_KEY_FILTER_INTERVAL requires KEY_CACHE_ALIAS.')
+
+        return interval
+
+    def get_version(self):
+        version = self.shared.get(self.version_key)
+
+        if version is None:
+            # Start from a random number so that an evicted version is not mistaken for the current one.
+            self.shared.add(self.version_key, randrange(1 << 30), None)
+            version = self.shared.get(self.version_key)
+
+        return version
+
+    async def aget_version(self):
+        version = await self.shared.aget(self.version_key)
+
+        if version is None:
+            version = await sync_to_async(self.get_version)()
+
+        return version
+
+    def bump_version(self):
+        try:
+            return self.shared.incr(self.version_key)
+        except ValueError:
+            self.get_version()
+            return self.shared.incr(self.version_key)
+
+    def rebuild(self):
+        """
+        Load all access keys into a new filter.
+        """
+        # Read the version first, so that keys issued during the scan make the new filter stale.
+        version = self.get_version()
+        queryset = models.AccessKey.objects.values_list('key', flat=True)
+        bloom = BloomFilter(max(queryset.count() * 2, 1024), api_settings.ACCESS_KEY_FILTER_ERROR_RATE)
+
+        for key in queryset.iterator(chunk_size=10000):
+            bloom.add(key.bytes)
+
+        self.state = FilterState(bloom, version, monotonic())
+        self.stats['rebuilds'] += 1
+
+    def rebuild_due(self):
+        state = self.state
+        interval = self.get_interval().total_seconds()
+        # A failed rebuild is not retried before the interval either.
+        started_at = max(self.started_at or 0, state.built_at if state else 0)
+        return not started_at or monotonic() - started_at >= interval
+
+    def try_rebuild(self):
+        """
+        Start the rebuild in a background thread, so that no lookup waits on the scan of the access keys.
+        The lookups fall back to the database until the filter is built.
+        """
+        # Only one thread rebuilds the filter.
+        if not self.lock.acquire(blocking=False):
+            return
+
+        self.started_at = monotonic()
+
+        try:
+            Thread(target=self.run_rebuild, name='jk-access-key-filter', daemon=True).start()
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.warning('The access key filter was not rebuilt.', exc_info=True)
+        finally:
+            self.lock.release()
+            # The connections of the thread are not reused.
+            connections.close_all()
+
+    def check(self, key, version):
+        state = self.state
+
+        if state is None or state.version != version:
+            self.stats['stale'] += 1
+            return True
+
+        if bytes.fromhex(key) in state.bloom:
+            self.stats['misses'] += 1
+            return True
+
+        self.stats['hits'] += 1
+        return False
+
+    def might_contain(self, key):
+        """
+        Return False only if the access key definitely does not exist.
+
+        :param key: Access key string or UUID instance.
+        """
+        if not self.enabled:
+            return True
+
+        key = normalize_key(key)
+
+        if key is None:
+            return True
+
+        if self.rebuild_due():
+            self.try_rebuild()
+
+        return self.check(key, self.get_version())
+
+    async def amight_contain(self, key):
+        """
+        Asynchronous version of might_contain().
+
+        :param key: Access key string or UUID instance.
+        """
+        if not self.enabled:
+            return True
+
+        key = normalize_key(key)
+
+        if key is None:
+            return True
+
+        if self.rebuild_due():
+            self.try_rebuild()
+
+        return self.check(key, await self.aget_version())
+
+    def add(self, *keys):
+        """
+        Add the issued access keys and announce them to the filters of the other processes.
+
+        :param keys: Access key strings or UUID instances.
+        """
+        if not self.enabled or not keys:
+            return
+
+        version = self.bump_version()
+        state = self.state
+
+        if state is None:
+            return
+
+        for key in map(normalize_key, keys):
+            if key is not None:
+                state.bloom.add(bytes.fromhex(key))
+
+        # The filter is still current if no other process issued keys since its last update.
+        if state.version == version - 1:
+            self.state = state._replace(version=version)
+
+    def is_false_positive(self, key, version):
+        state = self.state
+        key = normalize_key(key)
+
+        # The keys that passed a stale filter were not checked against it.
+        if state is None or key is None or state.version != version:
+            return False
+
+        return bytes.fromhex(key) in state.bloom
+
+    def false_positive(self, key):
+        """
+        Count the access key that passed the current filter but does not exist.
+
+        :param key: Access key string or UUID instance.
+        """
+        if self.enabled and self.is_false_positive(key, self.get_version()):
+            self.stats['false_positives'] += 1
+
+    async def afalse_positive(self, key):
+        """
+        Asynchronous version of false_positive().
+
+        :param key: Access key string or UUID instance.
+        """
+        if self.enabled and self.is_false_positive(key, await self.aget_version()):
+            self.stats['false_positives'] += 1
+
+    def clear(self):
+        self.state = None
+        self.started_at = None
+        self.stats.clear()
+
+
+access_key_filter = AccessKeyFilter()
+
+
+def get_negative_stats():
+    """
+    Return the counters of the negative lookup path.
+    """
+    return {
+        'auth': dict(auth_key_cache.stats),
+        'access': dict(access_key_cache.stats),
+        'access_filter': dict(access_key_filter.stats),
+    }
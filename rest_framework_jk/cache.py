@@ -0,0 +1,591 @@
+from uuid import UUID
+from time import time, monotonic
+from hashlib import sha256
+from threading import Lock
+from collections import Counter, OrderedDict, namedtuple
+
+from django.apps import apps
+from django.core.cache import caches
+
+from rest_framework_jk.settings import api_settings
+
+# Create your caches here.
+
+# Entry stored in the caches, the values of KEY_FIELDS of the key and the is_active flag of the owner.
+# The entries written before cached_at of a tombstone are no longer valid.
+KeyEntry = namedtuple('KeyEntry', ('values', 'owner_id', 'is_active', 'expires_at', 'cached_at'))
+OwnerEntry = namedtuple('OwnerEntry', ('owner_id', 'is_active', 'cached_at'))
+# Entry of the keys issued by a refresh, without their owner.
+RefreshEntry = namedtuple('RefreshEntry', (
+    'auth_key', 'refresh_key', 'owner_id', 'updated_at', 'auth_expires_at', 'refresh_expires_at',
+))
+
+# Key instance rebuilt from the entry.
+CachedKey = namedtuple('CachedKey', ('key', 'owner_id', 'is_active', 'expires_at'))
+
+# Entry of the key that is known not to be valid.
+MISSING = CachedKey(None, None, False, None)
+
+# Fields of the keys stored in the entries, the other fields are queried on access.
+KEY_FIELDS = ('id', 'key', 'updated_at', 'generation', 'expires_at', 'owner_id', 'last_used_at', 'scopes')
+
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+
+def normalize_key(key):
+    """
+    Convert the key into the hex form used as the cache key.
+    Return None if the key is not a valid UUID.
+    The hex and the hyphenated forms are checked by their length and digits, without building a UUID.
+
+    :param key: Key string or UUID instance.
+    """
+    if isinstance(key, UUID):
+        return key.hex
+
+    key = str(key)
+
+    if len(key) == 36 and key[8] == key[13] == key[18] == key[23] == '-':
+        key = key.replace('-', '')
+
+    if len(key) == 32:
+        return key.lower() if HEX_DIGITS.issuperset(key) else None
+
+    # The other forms accepted by UUID, such as braces or the URN prefix.
+    try:
+        return UUID(key).hex
+    except ValueError:
+        return None
+
+
+def get_timeout(name='KEY_CACHE_TIMEOUT'):
+    """
+    Return the cache timeout in seconds, or None if the cache is disabled.
+
+    :param str name: Name of the timeout setting.
+    """
+    timeout = getattr(api_settings, name)
+
+    if not timeout:
+        return None
+
+    return timeout.total_seconds()
+
+
+def get_owner_model():
+    return apps.get_model('rest_framework_jk', 'AuthKey')._meta.get_field('owner').related_model
+
+
+def build_owner(owner_id, is_active):
+    """
+    Return the owner instance with only the primary key and is_active, the other fields are queried on access.
+
+    :param owner_id: Owner ID.
+    :param bool is_active: Whether the owner is active.
+    """
+    owner_model = get_owner_model()
+    return owner_model.from_db(None, [owner_model._meta.pk.attname, 'is_active'], [owner_id, is_active])
+
+
+def make_tombstone(*parts):
+    return 'jk:tombstone:%s' % ':'.join(map(str, parts))
+
+
+def is_invalidated(entry, tombstones):
+    """
+    Return True if one of the tombstones has been written after the entry was cached.
+
+    :param entry: KeyEntry or OwnerEntry.
+    :param dict tombstones: Timestamps of the invalidations by tombstone key.
+    """
+    return any(invalidated_at >= entry.cached_at for invalidated_at in tombstones.values())
+
+
+class LocalCache:
+    """
+    Bounded per-process LRU cache whose entries expire after a timeout.
+    """
+
+    def __init__(self, size_setting='KEY_CACHE_SIZE'):
+        self.size_setting = size_setting
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+
+            if item is None:
+                return None
+
+            value, deadline = item
+
+            if deadline < monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        size = getattr(api_settings, self.size_setting)
+
+        if not size:
+            return
+
+        with self.lock:
+            self.entries[key] = (value, monotonic() + timeout)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_matching(self, predicate):
+        with self.lock:
+            for key in [key for key, (value, deadline) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class KeyCache:
+    """
+    Two-tier cache of verified keys.
+    The first tier is a per-process LRU cache and the second tier is the Django cache.
+    Only KEY_FIELDS of the key and the is_active flag of its owner are cached, the instances are rebuilt on hits.
+
+    The invalidated keys are deleted from the Django cache and marked with a tombstone in it,
+    which the hits of both tiers are checked against, so the other processes do not accept them either.
+    The entries are stamped with the time before the key was read, so an entry read before an invalidation
+    is rejected even if it was written after the tombstone.
+    Without the Django cache, the other processes keep the invalidated keys until KEY_CACHE_TIMEOUT.
+    """
+
+    def __init__(self, prefix, model_name):
+        self.prefix = prefix
+        self.model_name = model_name
+        self.local = LocalCache()
+        self.stats = Counter()
+
+    @property
+    def model(self):
+        return apps.get_model('rest_framework_jk', self.model_name)
+
+    @property
+    def fields(self):
+        return [field.attname for field in self.model._meta.concrete_fields if field.attname in KEY_FIELDS]
+
+    @property
+    def shared(self):
+        alias = api_settings.KEY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def make_key(self, key):
+        return 'jk:%s:%s' % (self.prefix, key)
+
+    def get(self, key):
+        """
+        Return the cached entry of the key, or None.
+        The entry of the key known not to be valid is MISSING.
+
+        :param key: Key string or UUID instance.
+        """
+        timeout = get_timeout()
+        key = normalize_key(key)
+
+        if timeout is None or key is None:
+            return None
+
+        entry = self.local.get(key)
+
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(self.make_key(key))
+
+            if entry is not None:
+                self.local.set(key, entry, timeout)
+
+        if entry is not None and self.shared is not None:
+            if is_invalidated(entry, self.shared.get_many(self.get_tombstones(key, entry))):
+                self.local.delete(key)
+                self.shared.delete(self.make_key(key))
+                entry = None
+
+        return self.check_entry(entry)
+
+    async def aget(self, key):
+        """
+        Asynchronous version of get().
+
+        :param key: Key string or UUID instance.
+        """
+        timeout = get_timeout()
+        key = normalize_key(key)
+
+        if timeout is None or key is None:
+            return None
+
+        entry = self.local.get(key)
+
+        if entry is None and self.shared is not None:
+            entry = await self.shared.aget(self.make_key(key))
+
+            if entry is not None:
+                self.local.set(key, entry, timeout)
+
+        if entry is not None and self.shared is not None:
+            if is_invalidated(entry, await self.shared.aget_many(self.get_tombstones(key, entry))):
+                self.local.delete(key)
+                await self.shared.adelete(self.make_key(key))
+                entry = None
+
+        return self.check_entry(entry)
+
+    def get_tombstones(self, key, entry):
+        tombstones = [make_tombstone(self.prefix, key)]
+
+        if entry.owner_id is not None:
+            tombstones.append(make_tombstone('owner', entry.owner_id))
+
+        return tombstones
+
+    def get_tombstone_timeout(self):
+        # The tombstones outlive the entries of the per-process tier, including the ones of the grace period.
+        return max(get_timeout() or 0, get_timeout('REFRESH_GRACE_PERIOD') or 0) or None
+
+    def check_entry(self, entry):
+        if entry is None:
+            return None
+
+        if entry.values is None:
+            self.stats['negative_hits'] += 1
+            return MISSING
+
+        return CachedKey(self.build(entry), entry.owner_id, entry.is_active, entry.expires_at)
+
+    def build(self, entry):
+        """
+        Return the key instance of the entry, with its owner built from the cached is_active flag.
+        """
+        instance = self.model.from_db(None, self.fields, entry.values)
+        instance.owner = build_owner(entry.owner_id, entry.is_active)
+        return instance
+
+    def make_entry(self, instance, expires_at, cached_at=None):
+        values = tuple(getattr(instance, name) for name in self.fields)
+        return KeyEntry(values, instance.owner_id, instance.owner.is_active, expires_at, cached_at or time())
+
+    def set(self, instance, expires_at=None, key=None, timeout=None, cached_at=None):
+        """
+        Store the verified key instance. The owner must already be loaded.
+
+        :param instance: Key model instance.
+        :param float expires_at: Expiration timestamp, or None if the key does not expire.
+        :param key: Key string or UUID instance the entry is stored for, the key of the instance by default.
+        :param float timeout: Seconds the entry is kept, KEY_CACHE_TIMEOUT by default.
+        :param float cached_at: Timestamp taken before the key was read, now by default.
+        """
+        key = normalize_key(instance.key if key is None else key)
+
+        if get_timeout() is None or key is None:
+            return
+
+        timeout = timeout or get_timeout()
+
+        entry = self.make_entry(instance, expires_at, cached_at)
+        self.local.set(key, entry, timeout)
+
+        if self.shared is not None:
+            self.shared.set(self.make_key(key), entry, timeout)
+
+    def set_many(self, entries, local=True, cached_at=None):
+        """
+        Store the verified key instances with one write to the Django cache.
+
+        :param list entries: Pairs of the key model instance, whose owner must already be loaded,
+            and its expiration timestamp or None.
+        :param bool local: Also store them in the per-process tier.
+        :param float cached_at: Timestamp taken before the keys were read, now by default.
+        """
+        timeout = get_timeout()
+
+        if timeout is None:
+            return
+
+        items = {}
+
+        for instance, expires_at in entries:
+            key = normalize_key(instance.key)
+
+            if key is None:
+                continue
+
+            entry = self.make_entry(instance, expires_at, cached_at)
+            items[self.make_key(key)] = entry
+
+            if local:
+                self.local.set(key, entry, timeout)
+
+        if items and self.shared is not None:
+            self.shared.set_many(items, timeout)
+
+    async def aset(self, instance, expires_at=None, cached_at=None):
+        """
+        Asynchronous version of set().
+
+        :param instance: Key model instance.
+        :param float expires_at: Expiration timestamp, or None if the key does not expire.
+        :param float cached_at: Timestamp taken before the key was read, now by default.
+        """
+        timeout = get_timeout()
+        key = normalize_key(instance.key)
+
+        if timeout is None or key is None:
+            return
+
+        entry = self.make_entry(instance, expires_at, cached_at)
+        self.local.set(key, entry, timeout)
+
+        if self.shared is not None:
+            await self.shared.aset(self.make_key(key), entry, timeout)
+
+    def set_missing(self, key, cached_at=None):
+        """
+        Store the key known not to be valid for a short time.
+
+        :param key: Key string or UUID instance.
+        :param float cached_at: Timestamp taken before the key was read, now by default.
+        """
+        timeout = get_timeout('NEGATIVE_KEY_CACHE_TIMEOUT')
+        key = normalize_key(key)
+
+        if timeout is None or key is None or get_timeout() is None:
+            return
+
+        self.stats['negative_misses'] += 1
+        entry = KeyEntry(None, None, False, None, cached_at or time())
+        self.local.set(key, entry, timeout)
+
+        if self.shared is not None:
+            self.shared.set(self.make_key(key), entry, timeout)
+
+    async def aset_missing(self, key, cached_at=None):
+        """
+        Asynchronous version of set_missing().
+
+        :param key: Key string or UUID instance.
+        :param float cached_at: Timestamp taken before the key was read, now by default.
+        """
+        timeout = get_timeout('NEGATIVE_KEY_CACHE_TIMEOUT')
+        key = normalize_key(key)
+
+        if timeout is None or key is None or get_timeout() is None:
+            return
+
+        self.stats['negative_misses'] += 1
+        entry = KeyEntry(None, None, False, None, cached_at or time())
+        self.local.set(key, entry, timeout)
+
+        if self.shared is not None:
+            await self.shared.aset(self.make_key(key), entry, timeout)
+
+    def delete(self, *keys):
+        """
+        Invalidate the cached entries of the keys.
+
+        :param keys: Key strings or UUID instances.
+        """
+        keys = [key for key in map(normalize_key, keys) if key is not None]
+
+        for key in keys:
+            self.local.delete(key)
+
+        if keys and self.shared is not None:
+            self.shared.delete_many([self.make_key(key) for key in keys])
+            self.write_tombstones([make_tombstone(self.prefix, key) for key in keys])
+
+    def delete_owner(self, owner_id, keys=()):
+        """
+        Invalidate the cached entries that belong to the owner.
+
+        :param int owner_id: Owner ID.
+        :param keys: Key strings of the owner, they are removed from the Django cache.
+        """
+        self.local.delete_matching(lambda entry: entry.owner_id == owner_id)
+        self.delete(*keys)
+
+        if self.shared is not None:
+            self.write_tombstones([make_tombstone('owner', owner_id)])
+
+    def write_tombstones(self, tombstones):
+        timeout = self.get_tombstone_timeout()
+
+        if timeout is not None:
+            invalidated_at = time()
+            self.shared.set_many({tombstone: invalidated_at for tombstone in tombstones}, timeout)
+
+    def clear(self):
+        """
+        Clear the per-process tier and the counters.
+        """
+        self.local.clear()
+        self.stats.clear()
+
+
+class OwnerCache:
+    """
+    Two-tier cache of key owners, used by the keys that are verified without a query.
+    Only the is_active flag is cached, the owners are rebuilt on hits and their other fields are queried on access.
+    The hits of both tiers are checked against the tombstone of the owner, as the ones of KeyCache.
+    """
+
+    def __init__(self):
+        self.local = LocalCache()
+
+    @property
+    def shared(self):
+        alias = api_settings.KEY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def make_key(self, owner_id):
+        return 'jk:owner:%s' % owner_id
+
+    def get(self, owner_id):
+        timeout = get_timeout()
+
+        if timeout is None:
+            return None
+
+        entry = self.local.get(owner_id)
+
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(self.make_key(owner_id))
+
+            if entry is not None:
+                self.local.set(owner_id, entry, timeout)
+
+        if entry is not None and self.shared is not None:
+            if is_invalidated(entry, self.shared.get_many([make_tombstone('owner', owner_id)])):
+                self.local.delete(owner_id)
+                self.shared.delete(self.make_key(owner_id))
+                entry = None
+
+        return None if entry is None else build_owner(entry.owner_id, entry.is_active)
+
+    def set(self, owner, cached_at=None):
+        timeout = get_timeout()
+
+        if timeout is None:
+            return
+
+        entry = OwnerEntry(owner.pk, owner.is_active, cached_at or time())
+        self.local.set(owner.pk, entry, timeout)
+
+        if self.shared is not None:
+            self.shared.set(self.make_key(owner.pk), entry, timeout)
+
+    def delete(self, owner_id):
+        self.local.delete(owner_id)
+
+        if self.shared is not None:
+            self.shared.delete(self.make_key(owner_id))
+
+            if get_timeout() is not None:
+                self.shared.set(make_tombstone('owner', owner_id), time(), get_timeout())
+
+    def clear(self):
+        self.local.clear()
+
+
+class RefreshCache:
+    """
+    Two-tier cache of the keys issued by the recent refreshes, stored for the pair of the replaced keys.
+    Only the keys, their owner ID and their expiration are cached, the instances are rebuilt on hits.
+    """
+
+    def __init__(self):
+        self.local = LocalCache()
+
+    @property
+    def shared(self):
+        alias = api_settings.KEY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def make_key(self, auth_key, refresh_key):
+        # The replaced keys are still secrets, only their digest is stored.
+        pair = '%s:%s' % (normalize_key(auth_key), normalize_key(refresh_key))
+        return 'jk:refresh:%s' % sha256(pair.encode()).hexdigest()
+
+    def get(self, auth_key, refresh_key):
+        """
+        Return the (auth_key, refresh_key) instances issued for the replaced keys, or None.
+
+        :param auth_key: Replaced authentication key string or UUID instance.
+        :param refresh_key: Replaced refresh key string or UUID instance.
+        """
+        if get_timeout('REFRESH_COALESCE_WINDOW') is None:
+            return None
+
+        key = self.make_key(auth_key, refresh_key)
+        entry = self.local.get(key)
+
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+
+        return None if entry is None else self.build(entry)
+
+    def build(self, entry):
+        """
+        Return the (auth_key, refresh_key) instances of the entry.
+        """
+        # In the order of the concrete fields, as from_db() expects.
+        fields = ['key', 'updated_at', 'expires_at', 'owner_id']
+        auth_key = apps.get_model('rest_framework_jk', 'AuthKey').from_db(
+            None, fields, [entry.auth_key, entry.updated_at, entry.auth_expires_at, entry.owner_id],
+        )
+        refresh_key = apps.get_model('rest_framework_jk', 'RefreshKey').from_db(
+            None, fields, [entry.refresh_key, entry.updated_at, entry.refresh_expires_at, entry.owner_id],
+        )
+        return auth_key, refresh_key
+
+    def set(self, auth_key, refresh_key, refreshed):
+        """
+        Store the instances issued for the replaced keys for REFRESH_COALESCE_WINDOW.
+
+        :param auth_key: Replaced authentication key string or UUID instance.
+        :param refresh_key: Replaced refresh key string or UUID instance.
+        :param tuple refreshed: New authentication key and refresh key instances.
+        """
+        timeout = get_timeout('REFRESH_COALESCE_WINDOW')
+
+        if timeout is None:
+            return
+
+        new_auth_key, new_refresh_key = refreshed
+        entry = RefreshEntry(
+            new_auth_key.key,
+            new_refresh_key.key,
+            new_auth_key.owner_id,
+            new_auth_key.updated_at,
+            new_auth_key.expires_at,
+            new_refresh_key.expires_at,
+        )
+        key = self.make_key(auth_key, refresh_key)
+        self.local.set(key, entry, timeout)
+
+        if self.shared is not None:
+            self.shared.set(key, entry, timeout)
+
+    def clear(self):
+        self.local.clear()
+
+
+auth_key_cache = KeyCache('auth', 'AuthKey')
+access_key_cache = KeyCache('access', 'AccessKey')
+owner_cache = OwnerCache()
+refresh_cache = RefreshCache()
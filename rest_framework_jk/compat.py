@@ -1,57 +1,639 @@
+from time import time, monotonic
+
+from django.db import connections, router, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
+from django.core.exceptions import ImproperlyConfigured
 
 from rest_framework_jk import models
+from rest_framework_jk.bloom import access_key_filter
+from rest_framework_jk.routers import recent_keys, verification_reads
+from rest_framework_jk.timing import timed
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.generations import key_generations
+from rest_framework_jk.cache import auth_key_cache, access_key_cache, owner_cache, refresh_cache, get_timeout
 from rest_framework_jk.settings import api_settings
+from rest_framework_jk.signing import revocation_list, verify_signed_key
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
 
 # Create your methods here.
 
 
+@metrics.timed('jk_verify_seconds', key_type='auth')
+@timed('jk-lookup')
 def verify_auth_key(key, precise=True):
     """
     Confirm that the authentication key is valid.
 
     :param str key: Authentication key string.
-    :param bool precise: Precise check mode.
+    :param bool precise: Precise check mode. Only the precise check uses the cache.
     """
-    expiration = now() - api_settings.AUTH_EXPIRATION_DELTA
+    if precise:
+        cached = auth_key_cache.get(key)
+
+        # The entries stamped with a previous generation of the owner are verified again.
+        if cached is not None and cached.key and not key_generations.is_current(cached.key):
+            cached = None
+
+        if cached is not None:
+            if cached.key and cached.expires_at >= time():
+                metrics.inc('jk_key_lookups_total', key_type='auth', result='cache_hit')
+                return cached.key
+
+            result = 'negative_cache_hit' if cached.key is None else 'expired'
+            metrics.inc('jk_key_lookups_total', key_type='auth', result=result)
+            return None
+
+    # Load the owner in the same query, it is checked by the authentication.
+    queryset = models.AuthKey.objects.select_related('owner')
+    # Taken before the query, so that the entry is rejected by the invalidations during the query.
+    cached_at = time()
 
     try:
-        if precise:
-            auth_key = models.AuthKey.objects.get(key=key, updated_at__gte=expiration)
-        else:
-            auth_key = models.AuthKey.objects.get(key=key)
+        with verification_reads(recent_keys.get_database(models.AuthKey, key)):
+            if precise:
+                # The stored expiration date is verified with one probe of the (key, expires_at) index.
+                auth_key = queryset.get(key=key, expires_at__gte=now())
+            else:
+                auth_key = queryset.get(key=key)
     except models.AuthKey.DoesNotExist:
+        metrics.inc('jk_key_lookups_total', key_type='auth', result='miss')
+
+        if precise:
+            auth_key_cache.set_missing(key, cached_at)
+        return None
+
+    if precise and auth_key.is_expired():
+        metrics.inc('jk_key_lookups_total', key_type='auth', result='expired')
+        auth_key_cache.set_missing(key, cached_at)
         return None
 
+    if not key_generations.is_current(auth_key):
+        metrics.inc('jk_key_lookups_total', key_type='auth', result='revoked')
+
+        if precise:
+            auth_key_cache.set_missing(key, cached_at)
+        return None
+
+    metrics.inc('jk_key_lookups_total', key_type='auth', result='hit')
+
+    if precise:
+        auth_key_cache.set(auth_key, auth_key.get_expiration().timestamp(), cached_at=cached_at)
+
     return auth_key
 
 
+@metrics.timed('jk_verify_seconds', key_type='signed_auth')
+@timed('jk-lookup')
+def verify_signed_auth_key(value):
+    """
+    Confirm that the signed authentication key is valid without querying the keys.
+    The owner is loaded from the cache, or queried by the primary key.
+
+    :param str value: Signed authentication key string.
+    """
+    if revocation_list.sync_due():
+        revocation_list.try_sync()
+
+    signed_key = verify_signed_key(value)
+
+    if signed_key is None:
+        metrics.inc('jk_key_lookups_total', key_type='signed_auth', result='rejected')
+        return None
+
+    owner = owner_cache.get(signed_key.owner_id)
+
+    if owner is None:
+        owner_model = models.AuthKey._meta.get_field('owner').related_model
+        cached_at = time()
+
+        try:
+            owner = owner_model.objects.get(pk=signed_key.owner_id)
+        except owner_model.DoesNotExist:
+            metrics.inc('jk_key_lookups_total', key_type='signed_auth', result='miss')
+            return None
+
+        owner_cache.set(owner, cached_at)
+
+    metrics.inc('jk_key_lookups_total', key_type='signed_auth', result='hit')
+    return signed_key._replace(owner=owner)
+
+
+@metrics.timed('jk_verify_seconds', key_type='refresh')
+@timed('jk-lookup')
 def verify_refresh_key(key):
     """
     Confirm that the refresh key is valid.
 
     :param str key: Refresh key string.
     """
-    expiration = now() - api_settings.REFRESH_EXPIRATION_DELTA
-
     try:
-        refresh_key = models.RefreshKey.objects.get(key=key, updated_at__gte=expiration)
+        with verification_reads(recent_keys.get_database(models.RefreshKey, key)):
+            refresh_key = models.RefreshKey.objects.get(key=key, expires_at__gte=now())
     except models.RefreshKey.DoesNotExist:
+        metrics.inc('jk_key_lookups_total', key_type='refresh', result='miss')
         return None
 
+    if refresh_key.is_expired():
+        metrics.inc('jk_key_lookups_total', key_type='refresh', result='expired')
+        return None
+
+    if not key_generations.is_current(refresh_key):
+        metrics.inc('jk_key_lookups_total', key_type='refresh', result='revoked')
+        return None
+
+    metrics.inc('jk_key_lookups_total', key_type='refresh', result='hit')
     return refresh_key
 
 
+@metrics.timed('jk_verify_seconds', key_type='access')
+@timed('jk-lookup')
 def verify_access_key(key):
     """
     Confirm that the access key is valid.
 
     :param str key: Access key string.
     """
+    cached = access_key_cache.get(key)
+
+    # The entries stamped with a previous generation of the owner are verified again.
+    if cached is not None and cached.key and not key_generations.is_current(cached.key):
+        cached = None
+
+    if cached is not None:
+        result = 'negative_cache_hit' if cached.key is None else 'cache_hit'
+        metrics.inc('jk_key_lookups_total', key_type='access', result=result)
+        return cached.key
+
+    # Reject the key without a query if it definitely does not exist.
+    if not access_key_filter.might_contain(key):
+        metrics.inc('jk_key_lookups_total', key_type='access', result='filtered')
+        return None
+
+    # Load the owner in the same query, it is checked by the authentication.
+    queryset = models.AccessKey.objects.select_related('owner')
+    # Taken before the query, so that the entry is rejected by the invalidations during the query.
+    cached_at = time()
+
+    try:
+        with verification_reads(recent_keys.get_database(models.AccessKey, key)):
+            access_key = queryset.get(key=key)
+    except models.AccessKey.DoesNotExist:
+        metrics.inc('jk_key_lookups_total', key_type='access', result='miss')
+        access_key_filter.false_positive(key)
+        access_key_cache.set_missing(key, cached_at)
+        return None
+
+    if not key_generations.is_current(access_key):
+        metrics.inc('jk_key_lookups_total', key_type='access', result='revoked')
+        access_key_cache.set_missing(key, cached_at)
+        return None
+
+    metrics.inc('jk_key_lookups_total', key_type='access', result='hit')
+    access_key_cache.set(access_key, cached_at=cached_at)
+    return access_key
+
+
+def supports_upsert(model):
+    """
+    Return True if the database of the model can upsert with bulk_create(update_conflicts=True).
+
+    :param model: Key model class.
+    """
+    features = connections[router.db_for_write(model)].features
+    return getattr(features, 'supports_update_conflicts_with_target', False)
+
+
+def update_or_create_keys(owner):
+    """
+    Return the authentication key and the refresh key of the owner, created or renewed with update_or_create.
+
+    :param owner: Owner instance.
+    """
+    # The renewed keys are moved to the current generation of the owner.
+    defaults = {'generation': key_generations.get(owner.pk)}
+    auth_key, void = models.AuthKey.objects.update_or_create(owner=owner, defaults=defaults)
+    refresh_key, void = models.RefreshKey.objects.update_or_create(owner=owner, defaults=defaults)
+    return auth_key, refresh_key
+
+
+def upsert_keys(owner):
+    """
+    Return the authentication key and the refresh key of the owner, created or renewed with one upsert each.
+    The existing keys are kept and their expiration and generation are renewed, as update_or_create does.
+
+    :param owner: Owner instance.
+    """
+    current = now()
+    generation = key_generations.get(owner.pk)
+    keys = [
+        models.AuthKey(owner=owner, updated_at=current, generation=generation,
+                       expires_at=current + api_settings.AUTH_EXPIRATION_DELTA),
+        models.RefreshKey(owner=owner, updated_at=current, generation=generation,
+                          expires_at=current + api_settings.REFRESH_EXPIRATION_DELTA),
+    ]
+
+    with transaction.atomic(using=router.db_for_write(models.AuthKey)):
+        for key in keys:
+            type(key).objects.bulk_create(
+                [key],
+                update_conflicts=True,
+                unique_fields=['owner'],
+                update_fields=['updated_at', 'expires_at', 'generation'],
+            )
+
+        # The kept keys are read back in one query.
+        values = models.AuthKey.objects.filter(owner=owner).values_list('key', 'owner__refresh_key__key').get()
+
+    auth_key, refresh_key = keys
+    auth_key.key, refresh_key.key = values
+    recent_keys.mark(values)
+    # The renewed keys are not sent post_save, the authentication key may have been cached as revoked.
+    auth_key_cache.delete(values[0])
+    auth_key._loaded_key, refresh_key._loaded_key = values
+    return auth_key, refresh_key
+
+
+def obtain_keys(owner):
+    """
+    Return the authentication key and the refresh key of the owner, created or with renewed expiration.
+    Both keys are upserted in one transaction where the database supports it, otherwise update_or_create is used.
+
+    :param owner: Owner instance.
+    """
+    if supports_upsert(models.AuthKey):
+        return upsert_keys(owner)
+
+    return update_or_create_keys(owner)
+
+
+async def aobtain_keys(owner):
+    """
+    Asynchronous version of obtain_keys().
+
+    :param owner: Owner instance.
+    """
+    return await sync_to_async(obtain_keys)(owner)
+
+
+def get_grace_period():
+    """
+    Return REFRESH_GRACE_PERIOD, the replaced authentication keys are kept valid in the key cache for the period.
+    """
+    grace_period = api_settings.REFRESH_GRACE_PERIOD
+
+    if grace_period and get_timeout() is None:
+        raise ImproperlyConfigured('REFRESH_GRACE_PERIOD requires KEY_CACHE_TIMEOUT.')
+
+    return grace_period
+
+
+def refresh_keys(auth_key, refresh_key):
+    """
+    Replace the authentication key and the refresh key of the same owner with new keys.
+    Both keys are replaced with one conditional UPDATE each in one transaction, without loading them.
+    The new authentication key is only loaded in the signed mode, to sign it, or to keep the replaced key in grace.
+
+    The refreshes of the same keys within REFRESH_COALESCE_WINDOW return the same new keys without writing.
+
+    :param auth_key: Authentication key string or UUID instance, it may have expired.
+    :param refresh_key: Refresh key string or UUID instance.
+    :return: Tuple of the new authentication key and refresh key instances, or None if the keys are not valid.
+    """
+    refreshed = refresh_cache.get(auth_key, refresh_key)
+
+    if refreshed is not None:
+        return refreshed
+
+    current = now()
+    new_auth_key = models.AuthKey(updated_at=current)
+    new_auth_key.key = new_auth_key.generate_key
+    new_auth_key.expires_at = current + new_auth_key.get_expiration_delta()
+    new_refresh_key = models.RefreshKey(updated_at=current)
+    new_refresh_key.key = new_refresh_key.generate_key
+    new_refresh_key.expires_at = current + new_refresh_key.get_expiration_delta()
+    grace_period = get_grace_period()
+    queryset = models.RefreshKey.objects.all()
+
+    if key_generations.enabled:
+        # The keys of a previous generation of the owner have been revoked.
+        generation = models.KeyGeneration.objects.filter(owner_id=OuterRef('owner_id')).values('generation')
+        queryset = queryset.filter(generation__gte=Coalesce(Subquery(generation), 0))
+
+    with transaction.atomic():
+        # The shortened expiration delta also applies to the refresh keys saved before.
+        updated = queryset.filter(
+            key=refresh_key,
+            expires_at__gte=current,
+            updated_at__gte=current - new_refresh_key.get_expiration_delta(),
+        ).update(key=new_refresh_key.key, updated_at=current, expires_at=new_refresh_key.expires_at)
+
+        if not updated:
+            # A concurrent refresh of the same keys may have replaced them first.
+            return refresh_cache.get(auth_key, refresh_key)
+
+        # Make sure the credentials are the same user.
+        owner = models.RefreshKey.objects.filter(key=new_refresh_key.key).values('owner_id')[:1]
+        updated = models.AuthKey.objects.filter(key=auth_key, owner_id=Subquery(owner)).update(
+            key=new_auth_key.key,
+            updated_at=current,
+            expires_at=new_auth_key.expires_at,
+        )
+
+        if not updated:
+            transaction.set_rollback(True)
+            return None
+
+        if api_settings.SIGNED_AUTH_KEYS or grace_period:
+            new_auth_key = models.AuthKey.objects.select_related('owner').get(key=new_auth_key.key)
+            new_refresh_key.owner_id = new_auth_key.owner_id
+
+        # Stored before the commit, so that the refreshes waiting for the keys find the new keys.
+        refresh_cache.set(auth_key, refresh_key, (new_auth_key, new_refresh_key))
+
+    # The update does not send post_save.
+    auth_key_cache.delete(auth_key, new_auth_key.key)
+    recent_keys.mark([auth_key, refresh_key, new_auth_key.key, new_refresh_key.key])
+
+    # The replaced key remains valid for the grace period, through the cache, whatever KEY_CACHE_TIMEOUT is.
+    if grace_period:
+        expires_at = min(current + grace_period, new_auth_key.get_expiration())
+        timeout = (expires_at - now()).total_seconds()
+
+        if timeout > 0:
+            auth_key_cache.set(new_auth_key, expires_at.timestamp(), key=auth_key, timeout=timeout)
+
+    if api_settings.SIGNED_AUTH_KEYS:
+        revocation_list.revoke(auth_key)
+
+    return new_auth_key, new_refresh_key
+
+
+async def arefresh_keys(auth_key, refresh_key):
+    """
+    Asynchronous version of refresh_keys().
+    The async ORM does not support transactions, so the keys are replaced in a thread.
+
+    :param auth_key: Authentication key string or UUID instance, it may have expired.
+    :param refresh_key: Refresh key string or UUID instance.
+    """
+    return await sync_to_async(refresh_keys)(auth_key, refresh_key)
+
+
+def warm_key_caches(max_entries, time_limit=None, chunk_size=2000, batch_size=500, using=None):
+    """
+    Prefill the key caches with the access keys and the valid authentication keys of the active owners.
+    The recently used keys are cached first, and only the first KEY_CACHE_SIZE keys go to the per-process tier.
+
+    :param int max_entries: Maximum number of the cached keys.
+    :param float time_limit: Seconds after which no more batch is cached, or None.
+    :param int chunk_size: Number of the rows fetched at once.
+    :param int batch_size: Number of the keys written by one set_many.
+    :param str using: Database alias, the default routing by default.
+    :return: Number of the cached keys by key type.
+    """
+    started = monotonic()
+    current = now()
+    # The used access keys are read in the order of the (last_used_at, id) index, so no row is sorted,
+    # and the never used ones by the primary key.
+    targets = (
+        ('access', access_key_cache, models.AccessKey.objects.filter(
+            owner__is_active=True,
+            last_used_at__isnull=False,
+        ).order_by('-last_used_at', '-id')),
+        ('access', access_key_cache, models.AccessKey.objects.filter(
+            owner__is_active=True,
+            last_used_at__isnull=True,
+        ).order_by('-id')),
+        ('auth', auth_key_cache, models.AuthKey.objects.filter(
+            owner__is_active=True,
+            expires_at__gte=current,
+        ).order_by('-updated_at')),
+    )
+    counts = {key_type: 0 for key_type, key_cache, queryset in targets}
+
+    def cache(key_cache, batch, cached_at):
+        local = sum(counts.values()) + len(batch) <= api_settings.KEY_CACHE_SIZE
+        key_cache.set_many(batch, local=local, cached_at=cached_at)
+        return len(batch)
+
+    def expired():
+        return time_limit is not None and monotonic() - started >= time_limit
+
+    for key_type, key_cache, queryset in targets:
+        limit = max_entries - sum(counts.values())
+
+        if limit <= 0 or expired():
+            break
+
+        queryset = queryset.select_related('owner')
+
+        if using is not None:
+            queryset = queryset.using(using)
+
+        batch = []
+        # Taken before the rows are read, so that the keys invalidated meanwhile are rejected.
+        cached_at = time()
+
+        for instance in queryset[:limit].iterator(chunk_size=chunk_size):
+            # A shortened expiration delta also applies to the keys saved before.
+            if isinstance(instance, models.AuthKey) and instance.is_expired():
+                continue
+
+            expires_at = instance.get_expiration().timestamp() if isinstance(instance, models.AuthKey) else None
+            batch.append((instance, expires_at))
+
+            if len(batch) >= batch_size:
+                counts[key_type] += cache(key_cache, batch, cached_at)
+                batch = []
+
+                if expired():
+                    break
+
+        if batch:
+            counts[key_type] += cache(key_cache, batch, cached_at)
+
+    return counts
+
+
+@metrics.timed('jk_verify_seconds', key_type='auth')
+@timed('jk-lookup')
+async def averify_auth_key(key, precise=True):
+    """
+    Asynchronous version of verify_auth_key().
+
+    :param str key: Authentication key string.
+    :param bool precise: Precise check mode. Only the precise check uses the cache.
+    """
+    if precise:
+        cached = await auth_key_cache.aget(key)
+
+        # The entries stamped with a previous generation of the owner are verified again.
+        if cached is not None and cached.key and not await key_generations.ais_current(cached.key):
+            cached = None
+
+        if cached is not None:
+            if cached.key and cached.expires_at >= time():
+                metrics.inc('jk_key_lookups_total', key_type='auth', result='cache_hit')
+                return cached.key
+
+            result = 'negative_cache_hit' if cached.key is None else 'expired'
+            metrics.inc('jk_key_lookups_total', key_type='auth', result=result)
+            return None
+
+    # Load the owner in the same query, it is checked by the authentication.
+    queryset = models.AuthKey.objects.select_related('owner')
+    cached_at = time()
+
+    alias = await recent_keys.aget_database(models.AuthKey, key)
+
+    try:
+        with verification_reads(alias):
+            if precise:
+                # The stored expiration date is verified with one probe of the (key, expires_at) index.
+                auth_key = await queryset.aget(key=key, expires_at__gte=now())
+            else:
+                auth_key = await queryset.aget(key=key)
+    except models.AuthKey.DoesNotExist:
+        metrics.inc('jk_key_lookups_total', key_type='auth', result='miss')
+
+        if precise:
+            await auth_key_cache.aset_missing(key, cached_at)
+        return None
+
+    if precise and auth_key.is_expired():
+        metrics.inc('jk_key_lookups_total', key_type='auth', result='expired')
+        await auth_key_cache.aset_missing(key, cached_at)
+        return None
+
+    if not await key_generations.ais_current(auth_key):
+        metrics.inc('jk_key_lookups_total', key_type='auth', result='revoked')
+
+        if precise:
+            await auth_key_cache.aset_missing(key, cached_at)
+        return None
+
+    metrics.inc('jk_key_lookups_total', key_type='auth', result='hit')
+
+    if precise:
+        await auth_key_cache.aset(auth_key, auth_key.get_expiration().timestamp(), cached_at=cached_at)
+
+    return auth_key
+
+
+@metrics.timed('jk_verify_seconds', key_type='signed_auth')
+@timed('jk-lookup')
+async def averify_signed_auth_key(value):
+    """
+    Asynchronous version of verify_signed_auth_key().
+
+    :param str value: Signed authentication key string.
+    """
+    if revocation_list.sync_due():
+        await sync_to_async(revocation_list.try_sync)()
+
+    signed_key = verify_signed_key(value)
+
+    if signed_key is None:
+        metrics.inc('jk_key_lookups_total', key_type='signed_auth', result='rejected')
+        return None
+
+    owner = owner_cache.get(signed_key.owner_id)
+
+    if owner is None:
+        owner_model = models.AuthKey._meta.get_field('owner').related_model
+        cached_at = time()
+
+        try:
+            owner = await owner_model.objects.aget(pk=signed_key.owner_id)
+        except owner_model.DoesNotExist:
+            metrics.inc('jk_key_lookups_total', key_type='signed_auth', result='miss')
+            return None
+
+        owner_cache.set(owner, cached_at)
+
+    metrics.inc('jk_key_lookups_total', key_type='signed_auth', result='hit')
+    return signed_key._replace(owner=owner)
+
+
+@metrics.timed('jk_verify_seconds', key_type='refresh')
+@timed('jk-lookup')
+async def averify_refresh_key(key):
+    """
+    Asynchronous version of verify_refresh_key().
+
+    :param str key: Refresh key string.
+    """
+    alias = await recent_keys.aget_database(models.RefreshKey, key)
+
+    try:
+        with verification_reads(alias):
+            refresh_key = await models.RefreshKey.objects.aget(key=key, expires_at__gte=now())
+    except models.RefreshKey.DoesNotExist:
+        metrics.inc('jk_key_lookups_total', key_type='refresh', result='miss')
+        return None
+
+    if refresh_key.is_expired():
+        metrics.inc('jk_key_lookups_total', key_type='refresh', result='expired')
+        return None
+
+    if not await key_generations.ais_current(refresh_key):
+        metrics.inc('jk_key_lookups_total', key_type='refresh', result='revoked')
+        return None
+
+    metrics.inc('jk_key_lookups_total', key_type='refresh', result='hit')
+    return refresh_key
+
+
+@metrics.timed('jk_verify_seconds', key_type='access')
+@timed('jk-lookup')
+async def averify_access_key(key):
+    """
+    Asynchronous version of verify_access_key().
+
+    :param str key: Access key string.
+    """
+    cached = await access_key_cache.aget(key)
+
+    # The entries stamped with a previous generation of the owner are verified again.
+    if cached is not None and cached.key and not await key_generations.ais_current(cached.key):
+        cached = None
+
+    if cached is not None:
+        result = 'negative_cache_hit' if cached.key is None else 'cache_hit'
+        metrics.inc('jk_key_lookups_total', key_type='access', result=result)
+        return cached.key
+
+    # Reject the key without a query if it definitely does not exist.
+    if not await access_key_filter.amight_contain(key):
+        metrics.inc('jk_key_lookups_total', key_type='access', result='filtered')
+        return None
+
+    # Load the owner in the same query, it is checked by the authentication.
+    queryset = models.AccessKey.objects.select_related('owner')
+    cached_at = time()
+
+    alias = await recent_keys.aget_database(models.AccessKey, key)
 
     try:
-        access_key = models.AccessKey.objects.get(key=key)
+        with verification_reads(alias):
+            access_key = await queryset.aget(key=key)
     except models.AccessKey.DoesNotExist:
+        metrics.inc('jk_key_lookups_total', key_type='access', result='miss')
+        await access_key_filter.afalse_positive(key)
+        await access_key_cache.aset_missing(key, cached_at)
+        return None
+
+    if not await key_generations.ais_current(access_key):
+        metrics.inc('jk_key_lookups_total', key_type='access', result='revoked')
+        await access_key_cache.aset_missing(key, cached_at)
         return None
 
+    metrics.inc('jk_key_lookups_total', key_type='access', result='hit')
+    await access_key_cache.aset(access_key, cached_at=cached_at)
     return access_key
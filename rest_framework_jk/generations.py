@@ -0,0 +1,139 @@
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models import F
+from django.core.exceptions import ImproperlyConfigured
+
+from rest_framework_jk import models
+from rest_framework_jk.cache import LocalCache, get_timeout
+from rest_framework_jk.settings import api_settings
+from rest_framework_jk.signing import revocation_list
+
+# Create your generations here.
+
+
+class KeyGenerations:
+    """
+    Key generations of the owners, stored in the KeyGeneration table and in the Django cache.
+    The keys are stamped with the generation of their owner when they are issued, and so are their cache entries.
+    Bumping the generation revokes all the keys of the owner on all processes with one write,
+    the rows of the revoked keys are deleted later by jk_purge_expired.
+
+    Without the Django cache, the generations are cached per process for KEY_CACHE_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.local = LocalCache()
+
+    @property
+    def enabled(self):
+        return api_settings.KEY_GENERATIONS
+
+    @property
+    def shared(self):
+        alias = api_settings.KEY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def make_key(self, owner_id):
+        return 'jk:generation:%s' % owner_id
+
+    def get_queryset(self, owner_id):
+        return models.KeyGeneration.objects.filter(owner_id=owner_id).values_list('generation', flat=True)
+
+    def get(self, owner_id):
+        """
+        Return the current generation of the owner, 0 if it has never been bumped or KEY_GENERATIONS is not set.
+
+        :param owner_id: Owner ID.
+        """
+        if not self.enabled:
+            return 0
+
+        shared = self.shared
+        generation = self.local.get(owner_id) if shared is None else shared.get(self.make_key(owner_id))
+
+        if generation is None:
+            generation = next(iter(self.get_queryset(owner_id)), 0)
+            self.store(owner_id, generation)
+
+        return generation
+
+    async def aget(self, owner_id):
+        """
+        Asynchronous version of get().
+
+        :param owner_id: Owner ID.
+        """
+        if not self.enabled:
+            return 0
+
+        shared = self.shared
+        generation = self.local.get(owner_id) if shared is None else await shared.aget(self.make_key(owner_id))
+
+        if generation is None:
+            try:
+                generation = await self.get_queryset(owner_id).aget()
+            except models.KeyGeneration.DoesNotExist:
+                generation = 0
+
+            self.store(owner_id, generation)
+
+        return generation
+
+    def store(self, owner_id, generation):
+        if self.shared is not None:
+            # A generation read before a concurrent bump does not replace the bumped one.
+            self.shared.add(self.make_key(owner_id), generation, None)
+            return
+
+        timeout = get_timeout()
+
+        if timeout is not None:
+            self.local.set(owner_id, generation, timeout)
+
+    def is_current(self, instance):
+        """
+        Return True if the key instance has been issued in the current generation of its owner.
+
+        :param instance: Key instance.
+        """
+        return not self.enabled or instance.generation >= self.get(instance.owner_id)
+
+    async def ais_current(self, instance):
+        """
+        Asynchronous version of is_current().
+
+        :param instance: Key instance.
+        """
+        return not self.enabled or instance.generation >= await self.aget(instance.owner_id)
+
+    def bump(self, owner_id):
+        """
+        Revoke all the keys of the owner by moving it to the next generation, and return the new generation.
+        The signed authentication keys do not carry the generation, the current one is added to the revocation list.
+
+        :param owner_id: Owner ID.
+        """
+        if not self.enabled:
+            raise ImproperlyConfigured('Bumping the key generation requires KEY_GENERATIONS.')
+
+        with transaction.atomic(using=router.db_for_write(models.KeyGeneration)):
+            models.KeyGeneration.objects.get_or_create(owner_id=owner_id)
+            models.KeyGeneration.objects.filter(owner_id=owner_id).update(generation=F('generation') + 1)
+            generation = self.get_queryset(owner_id).get()
+
+        self.local.delete(owner_id)
+
+        if self.shared is not None:
+            self.shared.set(self.make_key(owner_id), generation, None)
+
+        if api_settings.SIGNED_AUTH_KEYS:
+            for key in models.AuthKey.objects.filter(owner_id=owner_id).values_list('key', flat=True):
+                revocation_list.revoke(key)
+
+        return generation
+
+    def clear(self):
+        self.local.clear()
+
+
+key_generations = KeyGenerations()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework_jk.snapshot import export_snapshot
+from rest_framework_jk.settings import api_settings
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = 'Write the snapshot of the valid access keys verified by SnapshotAccessKeyAuthentication.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=None,
+            help='Path of the snapshot file, SNAPSHOT_PATH by default.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of the rows fetched at once.',
+        )
+        parser.add_argument(
+            '--database', default=None,
+            help='Database to read the keys from.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output'] or api_settings.SNAPSHOT_PATH
+
+        if not path:
+            raise CommandError('Set SNAPSHOT_PATH or --output.')
+
+        count = export_snapshot(path, chunk_size=options['chunk_size'], using=options['database'])
+        self.stdout.write('%s: %d keys were exported.' % (path, count))
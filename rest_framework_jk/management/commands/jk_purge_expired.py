@@ -0,0 +1,89 @@
+from time import sleep
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.utils.timezone import now
+from django.core.management.base import BaseCommand
+
+from rest_framework_jk import models
+from rest_framework_jk.settings import api_settings
+from rest_framework_jk.generations import key_generations
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired authentication keys and refresh keys, and the revoked keys, in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Width of the primary key range deleted by one statement.',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.0,
+            help='Seconds to sleep between the batches.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count the expired and the revoked keys.',
+        )
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to purge.',
+        )
+
+    def handle(self, *args, **options):
+        current = now()
+        # An expired authentication key can still be refreshed while the refresh key is valid.
+        targets = (
+            (models.AuthKey, current - max(api_settings.AUTH_EXPIRATION_DELTA, api_settings.REFRESH_EXPIRATION_DELTA)),
+            (models.RefreshKey, current - api_settings.REFRESH_EXPIRATION_DELTA),
+        )
+
+        for model, expiration in targets:
+            queryset = model.objects.using(options['database']).filter(updated_at__lt=expiration)
+            self.run(model, queryset, 'expired', options)
+
+        # Without KEY_GENERATIONS the keys are stamped with 0 and valid whatever generation is stored.
+        if not key_generations.enabled:
+            return
+
+        # The keys of a previous generation of their owner have been revoked by KeyGenerations.bump().
+        generation = models.KeyGeneration.objects.filter(owner_id=OuterRef('owner_id')).values('generation')
+
+        for model in (models.AuthKey, models.RefreshKey, models.AccessKey):
+            queryset = model.objects.using(options['database']).filter(generation__lt=Subquery(generation))
+            self.run(model, queryset, 'revoked', options)
+
+    def run(self, model, queryset, state, options):
+        if options['dry_run']:
+            count = queryset.count()
+            self.stdout.write('%s: %d %s keys would be deleted.' % (model._meta.db_table, count, state))
+        else:
+            count = self.purge(queryset, options['batch_size'], options['sleep'])
+            self.stdout.write('%s: %d %s keys were deleted.' % (model._meta.db_table, count, state))
+
+    def purge(self, queryset, batch_size, interval):
+        """
+        Delete the rows of the queryset by primary key ranges,
+        so that no statement holds the locks of the table for long.
+        Each range is loaded once to send post_delete, and deleted with one statement.
+        """
+        bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+
+        if bounds['first'] is None:
+            return 0
+
+        count = 0
+
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            if start > bounds['first'] and interval:
+                sleep(interval)
+
+            batch = queryset.filter(pk__gte=start, pk__lt=start + batch_size)
+            # The deleted keys are invalidated in the key caches by post_delete.
+            deleted, counts = batch.delete()
+            count += counts.get(queryset.model._meta.label, 0)
+
+        return count
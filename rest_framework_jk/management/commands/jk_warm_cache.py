@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from rest_framework_jk import compat
+from rest_framework_jk.settings import api_settings
+
+# Create your commands here.
+
+
+class Command(BaseCommand):
+    help = 'Prefill the key caches with the recently used access keys and authentication keys.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-entries', type=int, default=None,
+            help='Maximum number of the cached keys, WARM_CACHE_MAX_ENTRIES by default.',
+        )
+        parser.add_argument(
+            '--time-limit', type=float, default=None,
+            help='Seconds after which no more batch is cached, WARM_CACHE_TIME_LIMIT by default.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of the rows fetched at once.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of the keys written to the cache at once.',
+        )
+        parser.add_argument(
+            '--database', default=None,
+            help='Database to read the keys from.',
+        )
+
+    def handle(self, *args, **options):
+        if api_settings.KEY_CACHE_TIMEOUT is None:
+            self.stderr.write('The key cache is disabled by KEY_CACHE_TIMEOUT.')
+            return
+
+        # Only the Django cache is shared with the other processes.
+        if api_settings.KEY_CACHE_ALIAS is None:
+            self.stderr.write('KEY_CACHE_ALIAS is None, the keys are only cached in this process.')
+
+        time_limit = options['time_limit']
+
+        if time_limit is None and api_settings.WARM_CACHE_TIME_LIMIT:
+            time_limit = api_settings.WARM_CACHE_TIME_LIMIT.total_seconds()
+
+        counts = compat.warm_key_caches(
+            options['max_entries'] if options['max_entries'] is not None else api_settings.WARM_CACHE_MAX_ENTRIES,
+            time_limit=time_limit,
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            using=options['database'],
+        )
+
+        for key_type, count in counts.items():
+            self.stdout.write('%s: %d keys were cached.' % (key_type, count))
@@ -0,0 +1,253 @@
+from time import perf_counter
+from bisect import bisect_left
+from threading import Lock
+from functools import wraps
+from inspect import iscoroutinefunction
+from collections import defaultdict
+
+from rest_framework.exceptions import APIException
+
+from rest_framework_jk.settings import api_settings
+
+# Create your metrics here.
+
+# Name: (type, help)
+METRICS = {
+    'jk_authentication_total': ('counter', 'Authentication attempts by scheme and result.'),
+    'jk_authentication_seconds': ('histogram', 'Time spent in the authentication by scheme.'),
+    'jk_key_lookups_total': ('counter', 'Key lookups by key type and result.'),
+    'jk_verify_seconds': ('histogram', 'Time spent in compat.verify_* by key type.'),
+    'jk_endpoint_requests_total': ('counter', 'Key endpoint requests by endpoint and status.'),
+    'jk_endpoint_seconds': ('histogram', 'Time spent in the key endpoints by endpoint.'),
+    'jk_negative_lookups_total': ('counter', 'Events of the negative lookup path by source.'),
+    'jk_throttled_total': ('counter', 'Obtain attempts rejected before the password hashing by scope.'),
+}
+
+# Upper bounds in seconds, the last bucket is +Inf.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else '%d' % value
+
+
+class Metrics:
+    """
+    In-process counters and histograms, exported in the Prometheus text format.
+    Each sample is also passed to the hooks, e.g. to forward it to statsd.
+    Nothing is recorded unless METRICS_ENABLED is set.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.hooks = []
+        self.lock = Lock()
+
+    @property
+    def enabled(self):
+        return api_settings.METRICS_ENABLED
+
+    def add_hook(self, hook):
+        """
+        Register the hook called as hook(kind, name, value, labels) for each sample.
+
+        :param hook: Callable, kind is 'counter' or 'histogram'.
+        """
+        self.hooks.append(hook)
+
+    def call_hooks(self, kind, name, value, labels):
+        for hook in (*api_settings.METRICS_HOOKS, *self.hooks):
+            hook(kind, name, value, labels)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase the counter.
+
+        :param str name: Metric name.
+        :param value: Increment.
+        :param labels: Label values.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+        self.call_hooks('counter', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Record the value in the histogram.
+
+        :param str name: Metric name.
+        :param float value: Observed value in seconds.
+        :param labels: Label values.
+        """
+        if not self.enabled:
+            return
+
+        item = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            histogram = self.histograms.get(item)
+
+            if histogram is None:
+                # Bucket counts, sum
+                histogram = self.histograms[item] = [[0] * (len(BUCKETS) + 1), 0.0]
+
+            histogram[0][bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+
+        self.call_hooks('histogram', name, value, labels)
+
+    def timed(self, name, **labels):
+        """
+        Decorator recording the duration of the function or the coroutine function in the histogram.
+
+        :param str name: Metric name.
+        :param labels: Label values.
+        """
+
+        def decorator(function):
+            if iscoroutinefunction(function):
+                @wraps(function)
+                async def wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await function(*args, **kwargs)
+
+                    started = perf_counter()
+
+                    try:
+                        return await function(*args, **kwargs)
+                    finally:
+                        self.observe(name, perf_counter() - started, **labels)
+            else:
+                @wraps(function)
+                def wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return function(*args, **kwargs)
+
+                    started = perf_counter()
+
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        self.observe(name, perf_counter() - started, **labels)
+
+            return wrapper
+
+        return decorator
+
+    def endpoint(self, endpoint):
+        """
+        Decorator of the view methods recording the requests by response status and their duration.
+
+        :param str endpoint: Endpoint label.
+        """
+
+        def record(started, status):
+            self.inc('jk_endpoint_requests_total', endpoint=endpoint, status=status)
+            self.observe('jk_endpoint_seconds', perf_counter() - started, endpoint=endpoint)
+
+        def decorator(function):
+            if iscoroutinefunction(function):
+                @wraps(function)
+                async def wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await function(*args, **kwargs)
+
+                    started = perf_counter()
+
+                    try:
+                        response = await function(*args, **kwargs)
+                    except Exception as exc:
+                        record(started, exc.status_code if isinstance(exc, APIException) else 500)
+                        raise
+
+                    record(started, response.status_code)
+                    return response
+            else:
+                @wraps(function)
+                def wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return function(*args, **kwargs)
+
+                    started = perf_counter()
+
+                    try:
+                        response = function(*args, **kwargs)
+                    except Exception as exc:
+                        record(started, exc.status_code if isinstance(exc, APIException) else 500)
+                        raise
+
+                    record(started, response.status_code)
+                    return response
+
+            return wrapper
+
+        return decorator
+
+    def collect(self):
+        """
+        Return the samples as {name: [(suffix, labels, value)]}.
+        The counters of the negative lookup path are collected from their sources.
+        """
+        from rest_framework_jk.bloom import get_negative_stats
+
+        samples = defaultdict(list)
+
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(item, list(counts), total) for item, (counts, total) in self.histograms.items()]
+
+        for (name, labels), value in counters:
+            samples[name].append(('', labels, value))
+
+        for (name, labels), counts, total in histograms:
+            cumulative = 0
+
+            for bound, count in zip((*BUCKETS, '+Inf'), counts):
+                cumulative += count
+                samples[name].append(('_bucket', (*labels, ('le', bound)), cumulative))
+
+            samples[name].append(('_sum', labels, total))
+            samples[name].append(('_count', labels, cumulative))
+
+        for source, stats in get_negative_stats().items():
+            for event, value in stats.items():
+                samples['jk_negative_lookups_total'].append(('', (('event', event), ('source', source)), value))
+
+        return samples
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        for name, samples in sorted(self.collect().items()):
+            kind, description = METRICS.get(name, ('untyped', ''))
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %s' % (name, suffix, format_labels(labels), format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,60 @@
+from inspect import iscoroutinefunction
+
+from rest_framework_jk.timing import RequestTiming, current_timing
+
+try:
+    from asgiref.sync import markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    markcoroutinefunction = None
+
+# Create your middlewares here.
+
+
+class ServerTimingMiddleware:
+    """
+    Add the time spent in the header parsing, the key lookups and the key endpoints,
+    and the number of queries issued by rest_framework_jk to the Server-Timing header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+
+        if self.async_mode and markcoroutinefunction:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+
+        return self.add_header(response, timing)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+
+        return self.add_header(response, timing)
+
+    def add_header(self, response, timing):
+        header = timing.get_header()
+
+        if response.has_header('Server-Timing'):
+            header = '%s, %s' % (response['Server-Timing'], header)
+
+        response['Server-Timing'] = header
+        return response
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_jk', '0003_auto_20190613_0738'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedKey',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.UUIDField(unique=True, verbose_name='Key')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expires at')),
+            ],
+            options={
+                'verbose_name': 'Revoked key',
+                'verbose_name_plural': 'Revoked keys',
+                'db_table': 'jk_revoked_keys',
+            },
+        ),
+    ]
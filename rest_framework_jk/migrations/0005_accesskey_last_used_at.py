@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_jk', '0004_revokedkey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesskey',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last used at'),
+        ),
+    ]
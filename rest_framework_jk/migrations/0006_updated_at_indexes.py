@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_jk', '0005_accesskey_last_used_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='authkey',
+            index=models.Index(fields=['updated_at'], name='jk_auth_keys_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refreshkey',
+            index=models.Index(fields=['updated_at'], name='jk_refresh_keys_updated_idx'),
+        ),
+    ]
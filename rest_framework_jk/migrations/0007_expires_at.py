@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_jk', '0006_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authkey',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Expires at'),
+        ),
+        migrations.AddField(
+            model_name='refreshkey',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Expires at'),
+        ),
+        migrations.AddIndex(
+            model_name='authkey',
+            index=models.Index(fields=['key', 'expires_at'], name='jk_auth_keys_key_exp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refreshkey',
+            index=models.Index(fields=['key', 'expires_at'], name='jk_refresh_keys_key_exp_idx'),
+        ),
+    ]
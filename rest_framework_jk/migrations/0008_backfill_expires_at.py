@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import F, Max, Min
+
+BATCH_SIZE = 10000
+
+
+def backfill_expires_at(apps, schema_editor):
+    """
+    Store the expiration dates of the existing keys, in primary key ranges to keep the transactions short.
+    """
+    from rest_framework_jk.settings import api_settings
+
+    targets = (
+        ('AuthKey', api_settings.AUTH_EXPIRATION_DELTA),
+        ('RefreshKey', api_settings.REFRESH_EXPIRATION_DELTA),
+    )
+
+    for model_name, delta in targets:
+        model = apps.get_model('rest_framework_jk', model_name)
+        queryset = model.objects.using(schema_editor.connection.alias).filter(expires_at__isnull=True)
+        bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+
+        if bounds['first'] is None:
+            continue
+
+        for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+            batch = queryset.filter(pk__gte=start, pk__lt=start + BATCH_SIZE)
+            batch.update(expires_at=F('updated_at') + delta)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('rest_framework_jk', '0007_expires_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_jk', '0008_backfill_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesskey',
+            name='scopes',
+            field=models.BigIntegerField(default=0, verbose_name='Scopes'),
+        ),
+    ]
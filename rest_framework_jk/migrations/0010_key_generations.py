@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rest_framework_jk', '0009_accesskey_scopes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyGeneration',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='key_generation', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Owner')),
+                ('generation', models.PositiveIntegerField(default=0, verbose_name='Generation')),
+            ],
+            options={
+                'verbose_name': 'Key generation',
+                'verbose_name_plural': 'Key generations',
+                'db_table': 'jk_key_generations',
+            },
+        ),
+        migrations.AddField(
+            model_name='accesskey',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Generation'),
+        ),
+        migrations.AddField(
+            model_name='authkey',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Generation'),
+        ),
+        migrations.AddField(
+            model_name='refreshkey',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Generation'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_jk', '0010_key_generations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accesskey',
+            index=models.Index(fields=['-last_used_at', '-id'], name='jk_access_keys_used_idx'),
+        ),
+    ]
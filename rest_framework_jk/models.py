@@ -1,7 +1,10 @@
 from uuid import uuid4
 
 from django.db import models
-from django.utils.translation import ugettext_lazy as _
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_jk.settings import api_settings
 
 # Create your models here.
 
@@ -23,6 +26,10 @@ class AbstractKey(models.Model):
         verbose_name=_('Updated at'),
         auto_now=True,
     )
+    generation = models.PositiveIntegerField(
+        verbose_name=_('Generation'),
+        default=0,
+    )
 
     class Meta:
         abstract = True
@@ -38,7 +45,44 @@ class AbstractKey(models.Model):
         return uuid4().hex
 
 
-class AuthKey(AbstractKey):
+class AbstractExpiringKey(AbstractKey):
+    """
+    This is an abstract class that defines the key with an expiration date.
+    The expiration date is stored when the key is saved, so that it can be verified with one index probe.
+    """
+    expires_at = models.DateTimeField(
+        verbose_name=_('Expires at'),
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        abstract = True
+
+    def get_expiration_delta(self):
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        self.expires_at = now() + self.get_expiration_delta()
+
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'expires_at'}
+
+        super().save(*args, **kwargs)
+
+    def get_expiration(self):
+        """
+        A shortened expiration delta also applies to the keys saved before.
+        The rows left without expires_at expire by updated_at.
+        """
+        expiration = self.updated_at + self.get_expiration_delta()
+        return expiration if self.expires_at is None else min(self.expires_at, expiration)
+
+    def is_expired(self):
+        return self.get_expiration() < now()
+
+
+class AuthKey(AbstractExpiringKey):
     """
     This is the model that defines the authentication key.
     Authentication key shall be used from the front end.
@@ -55,9 +99,16 @@ class AuthKey(AbstractKey):
         verbose_name = _('Auth key')
         verbose_name_plural = _('Auth keys')
         db_table = 'jk_auth_keys'
+        indexes = [
+            models.Index(fields=['updated_at'], name='jk_auth_keys_updated_idx'),
+            models.Index(fields=['key', 'expires_at'], name='jk_auth_keys_key_exp_idx'),
+        ]
+
+    def get_expiration_delta(self):
+        return api_settings.AUTH_EXPIRATION_DELTA
 
 
-class RefreshKey(AbstractKey):
+class RefreshKey(AbstractExpiringKey):
     """
     This is the model that defines the refresh key.
     Refresh keys are used to update the same user's authentication key.
@@ -74,6 +125,13 @@ class RefreshKey(AbstractKey):
         verbose_name = _('Refresh key')
         verbose_name_plural = _('Refresh keys')
         db_table = 'jk_refresh_keys'
+        indexes = [
+            models.Index(fields=['updated_at'], name='jk_refresh_keys_updated_idx'),
+            models.Index(fields=['key', 'expires_at'], name='jk_refresh_keys_key_exp_idx'),
+        ]
+
+    def get_expiration_delta(self):
+        return api_settings.REFRESH_EXPIRATION_DELTA
 
 
 class AccessKey(AbstractKey):
@@ -93,8 +151,77 @@ class AccessKey(AbstractKey):
         related_name=_('access_keys'),
         on_delete=models.CASCADE,
     )
+    last_used_at = models.DateTimeField(
+        verbose_name=_('Last used at'),
+        null=True,
+        blank=True,
+    )
+    scopes = models.BigIntegerField(
+        verbose_name=_('Scopes'),
+        default=0,
+    )
 
     class Meta:
         verbose_name = _('Access key')
         verbose_name_plural = _('Access keys')
         db_table = 'jk_access_keys'
+        indexes = [
+            models.Index(fields=['-last_used_at', '-id'], name='jk_access_keys_used_idx'),
+        ]
+
+    def has_scopes(self, mask):
+        """
+        Return True if the key has all the scopes of the bitmask.
+
+        :param int mask: Scope bitmask of scope_registry.
+        """
+        return self.scopes & mask == mask
+
+
+class KeyGeneration(models.Model):
+    """
+    This is the model that defines the key generation of the owner.
+    The keys are stamped with the generation of their owner when they are issued,
+    and the keys of a previous generation are no longer valid.
+    """
+    owner = models.OneToOneField(
+        'auth.User',
+        verbose_name=_('Owner'),
+        related_name=_('key_generation'),
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    generation = models.PositiveIntegerField(
+        verbose_name=_('Generation'),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _('Key generation')
+        verbose_name_plural = _('Key generations')
+        db_table = 'jk_key_generations'
+
+
+class RevokedKey(models.Model):
+    """
+    This is the model that defines the revoked signed key.
+    Signed keys are verified without a query, so the keys refreshed before they expire are listed here.
+    The row can be deleted after the key has expired.
+    """
+    id = models.AutoField(
+        verbose_name=_('ID'),
+        primary_key=True,
+    )
+    key = models.UUIDField(
+        verbose_name=_('Key'),
+        unique=True,
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_('Expires at'),
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = _('Revoked key')
+        verbose_name_plural = _('Revoked keys')
+        db_table = 'jk_revoked_keys'
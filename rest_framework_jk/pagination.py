@@ -0,0 +1,60 @@
+from django.db.models import QuerySet
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+from rest_framework_jk.settings import api_settings
+
+# Create your paginations here.
+
+
+def get_id(item):
+    return item['id'] if isinstance(item, dict) else item.pk
+
+
+class KeyList(list):
+    """
+    List of keys with the queryset methods CursorPagination calls to order and filter them by ID.
+    """
+
+    def order_by(self, ordering):
+        return KeyList(sorted(self, key=get_id, reverse=ordering.startswith('-')))
+
+    def filter(self, id__gt=None, id__lt=None):
+        if id__gt is not None:
+            return KeyList(item for item in self if get_id(item) > int(id__gt))
+        return KeyList(item for item in self if get_id(item) < int(id__lt))
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Cursor pagination ordered by ID, so each page is one range scan of the primary key, however deep it is.
+    The items are model instances or dictionaries, in a queryset or in a list.
+    The page size is ACCESS_KEY_PAGE_SIZE, or the page_size parameter up to ACCESS_KEY_MAX_PAGE_SIZE.
+    The items are not paginated if ACCESS_KEY_PAGE_SIZE is None.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = api_settings.ACCESS_KEY_PAGE_SIZE
+        self.max_page_size = api_settings.ACCESS_KEY_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # The stores other than the database return lists.
+        if not isinstance(queryset, QuerySet):
+            queryset = KeyList(queryset)
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+
+        # The position is compared with the IDs.
+        if cursor is not None and cursor.position is not None:
+            try:
+                int(cursor.position)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        return cursor
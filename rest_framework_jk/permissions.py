@@ -0,0 +1,29 @@
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.permissions import BasePermission
+
+from rest_framework_jk import models
+from rest_framework_jk.scopes import scope_registry
+
+# Create your permissions here.
+
+
+class HasKeyScope(BasePermission):
+    """
+    Allow the access keys that have all the scopes of the `required_scopes` of the view.
+    `required_scopes` is a tuple of scope names, or a dictionary of them by HTTP method.
+    The mask is read from the key of `request.auth`, which may come from the key cache, so no query is issued.
+    The other authentications are left to the other permission classes.
+    """
+    message = _('The key does not have the required scopes.')
+
+    def has_permission(self, request, view):
+        if not isinstance(request.auth, models.AccessKey):
+            return True
+
+        required_scopes = getattr(view, 'required_scopes', ())
+
+        if isinstance(required_scopes, dict):
+            required_scopes = required_scopes.get(request.method, ())
+
+        return request.auth.has_scopes(scope_registry.get_mask(required_scopes))
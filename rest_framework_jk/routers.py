@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, router
+
+from rest_framework_jk.cache import normalize_key
+from rest_framework_jk.settings import api_settings
+
+# Create your routers here.
+
+# The database alias of the current key verification, None outside of the verifications.
+verification_database = ContextVar('rest_framework_jk_verification_database', default=None)
+
+
+class RecentKeys:
+    """
+    Keys written within REPLICATION_LAG_WINDOW, tracked per key in the Django cache.
+    The replica may not have them yet, so their verifications read the primary database.
+    """
+
+    @property
+    def shared(self):
+        alias = api_settings.KEY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    @property
+    def enabled(self):
+        # Without the Django cache the keys written by the other processes are unknown.
+        return bool(api_settings.REPLICA_DATABASE_ALIAS and api_settings.REPLICATION_LAG_WINDOW and self.shared)
+
+    def make_key(self, key):
+        return 'jk:recent:%s' % key
+
+    def mark(self, keys):
+        """
+        Record the keys that have been written.
+
+        :param keys: Iterable of key strings or UUID instances.
+        """
+        if not self.enabled:
+            return
+
+        keys = [key for key in map(normalize_key, keys) if key is not None]
+
+        if keys:
+            timeout = api_settings.REPLICATION_LAG_WINDOW.total_seconds()
+            self.shared.set_many({self.make_key(key): True for key in keys}, timeout)
+
+    def get_database(self, model, key):
+        """
+        Return the alias of the database the verification of the key reads,
+        or None to leave it to the other routers.
+
+        :param model: Key model class.
+        :param key: Key string or UUID instance.
+        """
+        if not self.enabled:
+            return None
+
+        key = normalize_key(key)
+
+        if key is None or self.shared.get(self.make_key(key)):
+            return router.db_for_write(model)
+
+        return api_settings.REPLICA_DATABASE_ALIAS
+
+    async def aget_database(self, model, key):
+        """
+        Asynchronous version of get_database().
+
+        :param model: Key model class.
+        :param key: Key string or UUID instance.
+        """
+        if not self.enabled:
+            return None
+
+        key = normalize_key(key)
+
+        if key is None or await self.shared.aget(self.make_key(key)):
+            return router.db_for_write(model)
+
+        return api_settings.REPLICA_DATABASE_ALIAS
+
+
+recent_keys = RecentKeys()
+
+
+@contextmanager
+def verification_reads(alias):
+    """
+    Route the reads within the block to the database.
+
+    :param str alias: Database alias, or None to leave the reads to the other routers.
+    """
+    token = verification_database.set(alias)
+
+    try:
+        yield
+    finally:
+        verification_database.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Route the reads of the key verifications to REPLICA_DATABASE_ALIAS.
+    The other reads are left to the other routers, and the writes go to the primary database.
+    """
+
+    def db_for_read(self, model, **hints):
+        return verification_database.get()
+
+    def db_for_write(self, model, **hints):
+        # The instances loaded from the replica, such as the request user, are saved to the primary database.
+        alias = api_settings.REPLICA_DATABASE_ALIAS
+        instance = hints.get('instance')
+
+        if alias and instance is not None and instance._state.db == alias:
+            return DEFAULT_DB_ALIAS
+
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        alias = api_settings.REPLICA_DATABASE_ALIAS
+        databases = {DEFAULT_DB_ALIAS, alias}
+
+        if alias and obj1._state.db in databases and obj2._state.db in databases:
+            return True
+
+        return None
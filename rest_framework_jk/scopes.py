@@ -0,0 +1,103 @@
+from threading import Lock
+
+from django.core.exceptions import ImproperlyConfigured
+
+from rest_framework_jk.settings import api_settings
+
+# Create your scopes here.
+
+# The scope bitmask is stored in a signed 64-bit integer.
+MAX_BITS = 63
+
+
+class ScopeRegistry:
+    """
+    Registry of the scope names and their bit positions in the scope bitmask of the access keys.
+    The scopes of ACCESS_KEY_SCOPES are registered on first use.
+    The bit of a scope must not change once keys have been issued with it.
+    """
+
+    def __init__(self):
+        self.bits = None
+        self.masks = {}
+        self.lock = Lock()
+
+    def get_bits(self):
+        """
+        Return the bit positions by scope name.
+        """
+        if self.bits is None:
+            with self.lock:
+                if self.bits is None:
+                    bits = {}
+
+                    for name, bit in api_settings.ACCESS_KEY_SCOPES.items():
+                        self.check(bits, name, bit)
+                        bits[name] = bit
+
+                    self.bits = bits
+
+        return self.bits
+
+    def check(self, bits, name, bit):
+        if not isinstance(bit, int) or not 0 <= bit < MAX_BITS:
+            raise ImproperlyConfigured('The bit of the scope "%s" must be from 0 to %d.' % (name, MAX_BITS - 1))
+
+        for other, other_bit in bits.items():
+            if other_bit == bit and other != name:
+                raise ImproperlyConfigured('The scopes "%s" and "%s" have the same bit.' % (other, name))
+
+    def register(self, name, bit):
+        """
+        Register the scope in addition to ACCESS_KEY_SCOPES.
+
+        :param str name: Scope name.
+        :param int bit: Bit position from 0 to 62.
+        """
+        bits = dict(self.get_bits())
+        self.check(bits, name, bit)
+        bits[name] = bit
+
+        with self.lock:
+            self.bits = bits
+            self.masks = {}
+
+    def get_mask(self, names):
+        """
+        Return the bitmask of the scope names. The masks are computed once per tuple of names.
+
+        :param names: Iterable of scope names.
+        :raise KeyError: If a name is not registered.
+        """
+        names = tuple(names)
+        mask = self.masks.get(names)
+
+        if mask is None:
+            bits = self.get_bits()
+            mask = 0
+
+            for name in names:
+                mask |= 1 << bits[name]
+
+            self.masks[names] = mask
+
+        return mask
+
+    def get_names(self, mask):
+        """
+        Return the registered scope names of the bitmask, in the order of their bits.
+
+        :param int mask: Scope bitmask.
+        """
+        return [name for name, bit in sorted(self.get_bits().items(), key=lambda item: item[1]) if mask & (1 << bit)]
+
+    def clear(self):
+        """
+        Forget the registered scopes, ACCESS_KEY_SCOPES is read again on next use.
+        """
+        with self.lock:
+            self.bits = None
+            self.masks = {}
+
+
+scope_registry = ScopeRegistry()
@@ -1,14 +1,117 @@
 from django.contrib.auth import authenticate
-from django.utils.translation import ugettext as _
+from django.utils.translation import gettext as _
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 from rest_framework import serializers
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, Throttled, ValidationError
 
-from rest_framework_jk import models, compat
+from rest_framework_jk import models
+from rest_framework_jk.scopes import scope_registry
+from rest_framework_jk.stores import get_key_store
+from rest_framework_jk.signing import is_signed_key, unsign_key
+from rest_framework_jk.settings import api_settings
+from rest_framework_jk.throttling import obtain_throttle
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+try:
+    from django.contrib.auth import aauthenticate
+except ImportError:  # Django < 5.0
+    aauthenticate = None
 
 # Create your serializers here.
 
 
+class AsyncValidationMixin:
+    """
+    Validate the data in async views with the `avalidate` method instead of `validate`.
+    `ais_valid` and `arun_validation` are the same as `is_valid` and `run_validation`,
+    only `avalidate` is awaited, so that the lookups of the validation do not block the event loop.
+    """
+
+    async def ais_valid(self, raise_exception=False):
+        assert hasattr(self, 'initial_data'), (
+            'Cannot call `.ais_valid()` as no `data=` keyword argument was '
+            'passed when instantiating the serializer instance.'
+        )
+
+        if not hasattr(self, '_validated_data'):
+            try:
+                self._validated_data = await self.arun_validation(self.initial_data)
+            except ValidationError as exc:
+                self._validated_data = {}
+                self._errors = exc.detail
+            else:
+                self._errors = {}
+
+        if self._errors and raise_exception:
+            raise ValidationError(self.errors)
+
+        return not bool(self._errors)
+
+    async def arun_validation(self, data=serializers.empty):
+        (is_empty_value, data) = self.validate_empty_values(data)
+
+        if is_empty_value:
+            return data
+
+        value = self.to_internal_value(data)
+
+        try:
+            self.run_validators(value)
+            value = await self.avalidate(value)
+            assert value is not None, '.avalidate() should return the validated data'
+        except (ValidationError, DjangoValidationError) as exc:
+            raise ValidationError(detail=serializers.as_serializer_error(exc))
+
+        return value
+
+    async def avalidate(self, attrs):
+        return self.validate(attrs)
+
+
+class AuthKeyField(serializers.UUIDField):
+    """
+    Authentication key field that also accepts the signed keys.
+    """
+
+    def to_internal_value(self, data):
+        if is_signed_key(data):
+            signed_key = unsign_key(data)
+
+            if signed_key is None:
+                self.fail('invalid', value=data)
+
+            return signed_key.key
+
+        return super().to_internal_value(data)
+
+
+class ScopesField(serializers.ListField):
+    """
+    Scope names of the access key, stored as the bitmask of scope_registry.
+    """
+    child = serializers.CharField()
+    default_error_messages = {
+        'unknown_scope': _('"{name}" is not a valid scope.'),
+    }
+
+    def to_internal_value(self, data):
+        names = super().to_internal_value(data)
+
+        for name in names:
+            if name not in scope_registry.get_bits():
+                self.fail('unknown_scope', name=name)
+
+        return scope_registry.get_mask(names)
+
+    def to_representation(self, value):
+        return scope_registry.get_names(value)
+
+
 class AuthKeySerializer(serializers.Serializer):
     """
     Serializer of authentication key.
@@ -16,7 +119,7 @@ class AuthKeySerializer(serializers.Serializer):
     pass
 
 
-class ObtainAuthKeySerializer(serializers.Serializer):
+class ObtainAuthKeySerializer(AsyncValidationMixin, serializers.Serializer):
     """
     Serializer of obtain authentication key.
     """
@@ -34,8 +137,32 @@ class ObtainAuthKeySerializer(serializers.Serializer):
         password = attrs.get('password')
 
         request = self.context.get('request')
+        # Reject the throttled attempts before hashing the password.
+        self.validate_throttle(obtain_throttle.check(request, username))
         user = authenticate(request=request, username=username, password=password)
+        return self.validate_user(attrs, user)
+
+    async def avalidate(self, attrs):
+        username = attrs.get('username')
+        password = attrs.get('password')
+
+        request = self.context.get('request')
+        # Reject the throttled attempts before hashing the password.
+        self.validate_throttle(await obtain_throttle.acheck(request, username))
+
+        if aauthenticate:
+            user = await aauthenticate(request=request, username=username, password=password)
+        else:
+            user = await sync_to_async(authenticate)(request=request, username=username, password=password)
 
+        return self.validate_user(attrs, user)
+
+    def validate_throttle(self, wait):
+        if wait:
+            message = _('Too many login attempts.')
+            raise Throttled(wait, detail=message)
+
+    def validate_user(self, attrs, user):
         if user:
             # From Django onwards the `authenticate` call simply
             # returns `None` for is_active=False users.
@@ -51,11 +178,12 @@ class ObtainAuthKeySerializer(serializers.Serializer):
         return attrs
 
 
-class RefreshAuthKeySerializer(serializers.Serializer):
+class RefreshAuthKeySerializer(AsyncValidationMixin, serializers.Serializer):
     """
     Serializer of refresh authentication key.
+    The keys are verified when they are replaced by the key store.
     """
-    auth_key = serializers.UUIDField(
+    auth_key = AuthKeyField(
         label=_('Auth key'),
         write_only=True,
     )
@@ -64,26 +192,6 @@ class RefreshAuthKeySerializer(serializers.Serializer):
         write_only=True,
     )
 
-    def validate(self, attrs):
-        auth_key = attrs.get('auth_key')
-        refresh_key = attrs.get('refresh_key')
-
-        verified_auth_key = compat.verify_auth_key(auth_key.hex, precise=False)
-        verified_refresh_key = compat.verify_refresh_key(refresh_key.hex)
-
-        if not verified_auth_key or not verified_refresh_key:
-            message = _('Invalid in with provided credentials.')
-            raise PermissionDenied(message, code='verify_refresh_key')
-
-        # Make sure the credentials are the same user.
-        if not verified_auth_key.owner == verified_refresh_key.owner:
-            message = _('The credentials were inconsistent.')
-            raise PermissionDenied(message, code='verify_refresh_key')
-
-        attrs['auth_key'] = verified_auth_key
-        attrs['refresh_key'] = verified_refresh_key
-        return attrs
-
 
 class AccessKeySerializer(serializers.ModelSerializer):
     """
@@ -92,10 +200,20 @@ class AccessKeySerializer(serializers.ModelSerializer):
     key = serializers.UUIDField(
         read_only=True,
     )
+    scopes = ScopesField(
+        label=_('Scopes'),
+        required=False,
+    )
 
     class Meta:
         model = models.AccessKey
-        fields = ('id', 'key', 'name')
+        fields = ('id', 'key', 'name', 'scopes')
+
+    def create(self, validated_data):
+        return get_key_store().issue(models.AccessKey, **validated_data)
+
+    def update(self, instance, validated_data):
+        return get_key_store().update(instance, **validated_data)
 
 
 class RefreshAccessKeySerializer(serializers.Serializer):
@@ -103,3 +221,56 @@ class RefreshAccessKeySerializer(serializers.Serializer):
     Serializer of refresh access key.
     """
     pass
+
+
+class BulkListField(serializers.ListField):
+    """
+    List field limited to BULK_MAX_SIZE items.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        data = super().to_internal_value(data)
+
+        if len(data) > api_settings.BULK_MAX_SIZE:
+            message = _('Ensure this field has no more than {max_length} elements.')
+            raise ValidationError(message.format(max_length=api_settings.BULK_MAX_SIZE), code='max_length')
+
+        return data
+
+
+class IntrospectKeySerializer(serializers.Serializer):
+    """
+    Serializer of key introspection.
+    The keys are the values of the authorization header, such as "JK-Access <access_key>".
+    """
+    keys = BulkListField(
+        label=_('Keys'),
+        child=serializers.CharField(),
+        write_only=True,
+    )
+
+
+class BulkCreateAccessKeySerializer(serializers.Serializer):
+    """
+    Serializer of bulk create access keys.
+    """
+    names = BulkListField(
+        label=_('Names'),
+        child=serializers.CharField(max_length=255, allow_blank=True),
+        write_only=True,
+    )
+
+
+class BulkAccessKeySerializer(serializers.Serializer):
+    """
+    Serializer of bulk destroy or refresh access keys.
+    """
+    ids = BulkListField(
+        label=_('IDs'),
+        child=serializers.IntegerField(),
+        write_only=True,
+    )
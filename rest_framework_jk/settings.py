@@ -13,8 +13,48 @@ DEFAULTS = {
     'REFRESH_EXPIRATION_DELTA': timedelta(days=7),
     'AUTH_HEADER_PREFIX': 'JK-Auth',
     'ACCESS_HEADER_PREFIX': 'JK-Access',
+    'KEY_CACHE_ALIAS': 'default',
+    'KEY_CACHE_SIZE': 1024,
+    'KEY_CACHE_TIMEOUT': timedelta(minutes=1),
+    'NEGATIVE_KEY_CACHE_TIMEOUT': timedelta(seconds=10),
+    'WARM_CACHE_ON_STARTUP': False,
+    'WARM_CACHE_MAX_ENTRIES': 10000,
+    'WARM_CACHE_TIME_LIMIT': timedelta(seconds=5),
+    'KEY_STORE': 'rest_framework_jk.stores.ORMKeyStore',
+    'KEY_STORE_CACHE_ALIAS': 'default',
+    'KEY_STORE_REDIS_URL': 'redis://localhost:6379/0',
+    'KEY_GENERATIONS': False,
+    'SNAPSHOT_PATH': None,
+    'SNAPSHOT_CHECK_INTERVAL': timedelta(seconds=5),
+    'REPLICA_DATABASE_ALIAS': None,
+    'REPLICATION_LAG_WINDOW': timedelta(seconds=10),
+    'ACCESS_KEY_FILTER_INTERVAL': None,
+    'ACCESS_KEY_FILTER_ERROR_RATE': 0.01,
+    'SIGNED_AUTH_KEYS': False,
+    'SIGNED_KEY_SECRET': None,
+    'REVOCATION_SYNC_INTERVAL': timedelta(seconds=30),
+    'AUTH_SLIDING_EXPIRATION': False,
+    'REFRESH_COALESCE_WINDOW': None,
+    'REFRESH_GRACE_PERIOD': None,
+    'USAGE_WRITE_INTERVAL': timedelta(minutes=5),
+    'USAGE_FLUSH_INTERVAL': timedelta(seconds=10),
+    'USAGE_FLUSH_SIZE': 500,
+    'BULK_MAX_SIZE': 1000,
+    'INTROSPECTION_MAX_AGE': timedelta(seconds=30),
+    'ACCESS_KEY_PAGE_SIZE': 100,
+    'ACCESS_KEY_MAX_PAGE_SIZE': 1000,
+    'ACCESS_KEY_SCOPES': {},
+    'METRICS_ENABLED': False,
+    'METRICS_HOOKS': [],
+    'OBTAIN_USERNAME_THROTTLE': None,
+    'OBTAIN_IP_THROTTLE': None,
+    'THROTTLE_CACHE_ALIAS': None,
+    'THROTTLE_CACHE_SIZE': 100000,
 }
 
-IMPORT_SETTINGS = ()
+IMPORT_SETTINGS = (
+    'KEY_STORE',
+    'METRICS_HOOKS',
+)
 
 api_settings = APISettings(USER_SETTINGS, DEFAULTS, IMPORT_SETTINGS)
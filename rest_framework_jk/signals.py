@@ -0,0 +1,123 @@
+from django.dispatch import receiver
+from django.core.signals import request_finished
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+
+from rest_framework_jk import models
+from rest_framework_jk.bloom import access_key_filter
+from rest_framework_jk.cache import auth_key_cache, access_key_cache, owner_cache
+from rest_framework_jk.usage import usage_buffer
+from rest_framework_jk.routers import recent_keys
+from rest_framework_jk.signing import revocation_list
+from rest_framework_jk.generations import key_generations
+from rest_framework_jk.settings import api_settings
+
+# Create your signals here.
+
+KEY_CACHES = {
+    models.AuthKey: auth_key_cache,
+    models.AccessKey: access_key_cache,
+}
+
+
+@receiver(post_init, sender=models.AuthKey)
+@receiver(post_init, sender=models.AccessKey)
+def remember_key(sender, instance, **kwargs):
+    """
+    Remember the loaded key so that it can be invalidated after a refresh.
+    """
+    # A deferred key is not loaded here.
+    instance._loaded_key = instance.__dict__.get('key')
+
+
+@receiver(pre_save, sender=models.AuthKey)
+@receiver(pre_save, sender=models.RefreshKey)
+@receiver(pre_save, sender=models.AccessKey)
+def stamp_generation(sender, instance, raw, **kwargs):
+    """
+    Stamp the new key with the current generation of its owner.
+    """
+    if instance._state.adding and not raw:
+        instance.generation = key_generations.get(instance.owner_id)
+
+
+@receiver(post_save, sender=models.AuthKey)
+@receiver(post_save, sender=models.AccessKey)
+def invalidate_saved_key(sender, instance, created, **kwargs):
+    """
+    Invalidate the cache of the key before it was refreshed.
+    The new key may also have been cached as unknown.
+    """
+    KEY_CACHES[sender].delete(instance._loaded_key, instance.key)
+    recent_keys.mark([instance._loaded_key, instance.key])
+
+    if sender is models.AccessKey and (created or instance._loaded_key != instance.key):
+        access_key_filter.add(instance.key)
+
+    # The signed keys issued for the refreshed key are no longer valid.
+    if sender is models.AuthKey and api_settings.SIGNED_AUTH_KEYS and instance._loaded_key != instance.key:
+        revocation_list.revoke(instance._loaded_key)
+
+    instance._loaded_key = instance.key
+
+
+@receiver(post_delete, sender=models.AuthKey)
+@receiver(post_delete, sender=models.AccessKey)
+def invalidate_deleted_key(sender, instance, **kwargs):
+    """
+    Invalidate the cache of the deleted key.
+    """
+    KEY_CACHES[sender].delete(instance._loaded_key, instance.key)
+    recent_keys.mark([instance._loaded_key, instance.key])
+
+    if sender is models.AuthKey and api_settings.SIGNED_AUTH_KEYS:
+        revocation_list.revoke(instance._loaded_key)
+
+
+@receiver(post_save, sender=models.RefreshKey)
+@receiver(post_delete, sender=models.RefreshKey)
+def mark_written_refresh_key(sender, instance, **kwargs):
+    """
+    Verify the written refresh key on the primary database until the replica has it.
+    """
+    recent_keys.mark([instance.key])
+
+
+@receiver(post_init, sender='auth.User')
+def remember_owner(sender, instance, **kwargs):
+    """
+    Remember the loaded is_active flag, so that only its changes invalidate the keys.
+    """
+    # A deferred is_active is not loaded here.
+    instance._loaded_is_active = instance.__dict__.get('is_active')
+
+
+@receiver(post_save, sender='auth.User')
+def invalidate_owner_keys(sender, instance, created, update_fields, **kwargs):
+    """
+    Invalidate the cache of the keys whose owner has been activated or deactivated.
+    The caches only hold the is_active flag of the owners, the other changes do not concern them.
+    """
+    if created or (update_fields is not None and 'is_active' not in update_fields):
+        return
+
+    loaded_is_active, instance._loaded_is_active = getattr(instance, '_loaded_is_active', None), instance.is_active
+
+    if loaded_is_active == instance.is_active:
+        return
+
+    owner_cache.delete(instance.pk)
+    auth_keys = list(models.AuthKey.objects.filter(owner_id=instance.pk).values_list('key', flat=True))
+    access_keys = list(models.AccessKey.objects.filter(owner_id=instance.pk).values_list('key', flat=True))
+    auth_key_cache.delete_owner(instance.pk, auth_keys)
+    access_key_cache.delete_owner(instance.pk, access_keys)
+    # The replica may still have the owner before the change.
+    recent_keys.mark(auth_keys + access_keys)
+
+
+@receiver(request_finished)
+def flush_usages(sender, **kwargs):
+    """
+    Write the recorded key usages after the response has been sent.
+    """
+    if usage_buffer.flush_due():
+        usage_buffer.flush()
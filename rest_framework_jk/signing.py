@@ -0,0 +1,156 @@
+import hmac
+from uuid import UUID
+from time import time, monotonic
+from hashlib import sha256
+from base64 import urlsafe_b64encode
+from threading import Lock
+from datetime import timedelta
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.timezone import now
+from django.utils.encoding import force_bytes
+
+from rest_framework_jk import models
+from rest_framework_jk.settings import api_settings
+
+# Create your signings here.
+
+# The owner is loaded after the key has been verified.
+SignedKey = namedtuple('SignedKey', ('key', 'owner_id', 'expires_at', 'owner'))
+
+SIGNATURE_LENGTH = 22
+
+
+def get_secret():
+    secret = api_settings.SIGNED_KEY_SECRET or settings.SECRET_KEY
+    return sha256(b'rest_framework_jk.signing' + force_bytes(secret)).digest()
+
+
+def get_signature(payload):
+    digest = hmac.new(get_secret(), payload.encode(), sha256).digest()
+    return urlsafe_b64encode(digest).decode()[:SIGNATURE_LENGTH]
+
+
+def is_signed_key(key):
+    """
+    Return True if the key string looks like a signed key.
+
+    :param key: Key string or UUID instance.
+    """
+    return isinstance(key, str) and '.' in key
+
+
+def sign_key(key, owner_id, expires_at):
+    """
+    Return the signed key string carrying the key, the owner ID and the expiration timestamp.
+
+    :param key: Key string or UUID instance.
+    :param int owner_id: Owner ID.
+    :param float expires_at: Expiration timestamp.
+    """
+    payload = '%s.%d.%d' % (UUID(str(key)).hex, owner_id, expires_at)
+    return '%s.%s' % (payload, get_signature(payload))
+
+
+def unsign_key(value):
+    """
+    Return the SignedKey of the signed key string, or None if the signature is not valid.
+    The expiration and the revocation are not checked.
+
+    :param str value: Signed key string.
+    """
+    try:
+        payload, signature = value.rsplit('.', 1)
+        key, owner_id, expires_at = payload.split('.')
+        signed = SignedKey(UUID(key), int(owner_id), int(expires_at), None)
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(signature, get_signature(payload)):
+        return None
+
+    return signed
+
+
+def issue_auth_key(auth_key):
+    """
+    Return the authentication key handed to the client, signed if the signed mode is enabled.
+
+    :param auth_key: Authentication key instance.
+    """
+    if not api_settings.SIGNED_AUTH_KEYS:
+        return auth_key.key
+
+    return sign_key(auth_key.key, auth_key.owner_id, auth_key.get_expiration().timestamp())
+
+
+class RevocationList:
+    """
+    Per-process set of revoked signed keys, synchronized periodically from the database.
+    The keys revoked by this process are applied at once.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.synced_at = None
+        self.lock = Lock()
+
+    def sync_due(self):
+        interval = api_settings.REVOCATION_SYNC_INTERVAL.total_seconds()
+        return self.synced_at is None or monotonic() - self.synced_at >= interval
+
+    def sync(self):
+        """
+        Reload the revoked keys that have not expired yet, and delete the expired ones.
+        """
+        current = now()
+        models.RevokedKey.objects.filter(expires_at__lt=current).delete()
+        queryset = models.RevokedKey.objects.filter(expires_at__gte=current)
+        self.keys = {key: expires_at.timestamp() for key, expires_at in queryset.values_list('key', 'expires_at')}
+        self.synced_at = monotonic()
+
+    def try_sync(self):
+        # Only one thread synchronizes the list, the others use the current one meanwhile.
+        if self.lock.acquire(blocking=False):
+            try:
+                self.sync()
+            finally:
+                self.lock.release()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def revoke(self, key):
+        """
+        Revoke the signed keys issued for the key.
+
+        :param key: Key string or UUID instance.
+        """
+        key = UUID(str(key))
+        # A signed key expires at most an expiration delta after it has been issued.
+        expires_at = now() + api_settings.AUTH_EXPIRATION_DELTA + timedelta(seconds=1)
+        self.keys[key] = expires_at.timestamp()
+        models.RevokedKey.objects.bulk_create([models.RevokedKey(key=key, expires_at=expires_at)], ignore_conflicts=True)
+
+    def clear(self):
+        self.keys = {}
+        self.synced_at = None
+
+
+revocation_list = RevocationList()
+
+
+def verify_signed_key(value):
+    """
+    Return the SignedKey of the signed key string, or None if it is not valid, has expired or has been revoked.
+    The revocation list must be synchronized by the caller when it is due.
+
+    :param str value: Signed key string.
+    """
+    signed = unsign_key(value)
+
+    if signed is None or signed.expires_at < time() or signed.key in revocation_list:
+        return None
+
+    return signed
@@ -0,0 +1,203 @@
+import os
+import mmap
+import struct
+import logging
+from uuid import UUID
+from time import time, monotonic
+from hashlib import sha256
+from threading import Lock
+
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.exceptions import ImproperlyConfigured
+
+from rest_framework_jk import models
+from rest_framework_jk.cache import normalize_key
+from rest_framework_jk.timing import timed
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.settings import api_settings
+from rest_framework_jk.generations import key_generations
+
+logger = logging.getLogger(__name__)
+
+# Create your snapshots here.
+
+MAGIC = b'JKSNAP01'
+# Magic, number of the records, export timestamp
+HEADER = struct.Struct('>8sQq')
+# Key digest, owner ID, expiration timestamp or 0, scope bitmask
+RECORD = struct.Struct('>16sQqq')
+DIGEST_SIZE = 16
+
+
+def get_digest(key):
+    """
+    Return the digest of the key stored in the snapshot, the keys themselves are not written.
+
+    :param str key: Key string in the hex form.
+    """
+    return sha256(bytes.fromhex(key)).digest()[:DIGEST_SIZE]
+
+
+def export_snapshot(path, chunk_size=2000, using=None):
+    """
+    Write the snapshot of the access keys of the active owners, sorted by digest.
+    The file is written next to the path and renamed into place, so that the readers never see a partial file.
+
+    :param str path: Path of the snapshot file.
+    :param int chunk_size: Number of the rows fetched at once.
+    :param str using: Database alias, the default routing by default.
+    :return: Number of the exported keys.
+    """
+    queryset = models.AccessKey.objects.filter(owner__is_active=True)
+
+    if key_generations.enabled:
+        # The keys of a previous generation of the owner have been revoked.
+        generation = models.KeyGeneration.objects.filter(owner_id=OuterRef('owner_id')).values('generation')
+        queryset = queryset.filter(generation__gte=Coalesce(Subquery(generation), 0))
+
+    if using is not None:
+        queryset = queryset.using(using)
+
+    rows = queryset.values_list('key', 'owner_id', 'scopes').iterator(chunk_size=chunk_size)
+    # The records start with the digest, so sorting them sorts the digests.
+    records = sorted(RECORD.pack(get_digest(key.hex), owner_id, 0, scopes) for key, owner_id, scopes in rows)
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(records), int(time())))
+            file.writelines(records)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    return len(records)
+
+
+class Snapshot:
+    """
+    Snapshot file mapped in memory. The pages are shared by all the processes that map the same file,
+    and the records are searched in place, so no object is kept per key.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.identity = self.get_identity(os.fstat(file.fileno()))
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise ValueError('%s is not a key snapshot.' % path)
+
+        magic, self.count, self.exported_at = HEADER.unpack_from(self.data)
+
+        if magic != MAGIC or len(self.data) != HEADER.size + self.count * RECORD.size:
+            raise ValueError('%s is not a key snapshot.' % path)
+
+    @staticmethod
+    def get_identity(stat):
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def find(self, digest):
+        """
+        Return the (digest, owner_id, expires_at, scopes) record of the digest by binary search, or None.
+
+        :param bytes digest: Key digest.
+        """
+        data = self.data
+        low, high = 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            probe = data[offset:offset + DIGEST_SIZE]
+
+            if probe < digest:
+                low = middle + 1
+            elif probe > digest:
+                high = middle
+            else:
+                return RECORD.unpack_from(data, offset)
+
+        return None
+
+
+class SnapshotReader:
+    """
+    Reader of the snapshot file of SNAPSHOT_PATH.
+    The file is checked every SNAPSHOT_CHECK_INTERVAL, and mapped again when a new snapshot has been renamed into place.
+    The verifications in progress keep the snapshot they started with.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.checked_at = None
+        self.lock = Lock()
+
+    def get_snapshot(self):
+        interval = api_settings.SNAPSHOT_CHECK_INTERVAL
+        checked_at = self.checked_at
+
+        if checked_at is None or (interval is not None and monotonic() - checked_at >= interval.total_seconds()):
+            self.reload()
+
+        return self.snapshot
+
+    def reload(self):
+        path = api_settings.SNAPSHOT_PATH
+
+        if not path:
+            raise ImproperlyConfigured('The snapshot authentication requires SNAPSHOT_PATH.')
+
+        with self.lock:
+            self.checked_at = monotonic()
+
+            try:
+                if self.snapshot is not None and self.snapshot.identity == Snapshot.get_identity(os.stat(path)):
+                    return
+
+                self.snapshot = Snapshot(path)
+            except (OSError, ValueError):
+                # The previous snapshot is kept, or no key is valid until the first one is exported.
+                logger.warning('The key snapshot was not loaded.', exc_info=True)
+
+    @timed('jk-lookup')
+    def verify(self, key):
+        """
+        Return the access key of the key string, with only the fields of the snapshot, or None.
+        The owner is not loaded, its fields other than the primary key and is_active are queried on access.
+
+        :param key: Access key string or UUID instance.
+        """
+        key = normalize_key(key)
+        snapshot = self.get_snapshot()
+        record = None if key is None or snapshot is None else snapshot.find(get_digest(key))
+
+        if record is None:
+            metrics.inc('jk_key_lookups_total', key_type='snapshot', result='miss')
+            return None
+
+        digest, owner_id, expires_at, scopes = record
+
+        if expires_at and expires_at < time():
+            metrics.inc('jk_key_lookups_total', key_type='snapshot', result='expired')
+            return None
+
+        owner_model = models.AccessKey._meta.get_field('owner').related_model
+        # Only the keys of the active owners are exported.
+        owner = owner_model.from_db(None, [owner_model._meta.pk.attname, 'is_active'], [owner_id, True])
+        metrics.inc('jk_key_lookups_total', key_type='snapshot', result='hit')
+        return models.AccessKey(key=UUID(key), owner=owner, scopes=scopes)
+
+    def clear(self):
+        with self.lock:
+            self.snapshot = None
+            self.checked_at = None
+
+
+access_key_snapshot = SnapshotReader()
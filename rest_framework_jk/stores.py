@@ -0,0 +1,667 @@
+import json
+from uuid import UUID
+from time import sleep, time
+from datetime import timedelta
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.timezone import now
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+
+from rest_framework_jk import compat, models
+from rest_framework_jk.bloom import access_key_filter
+from rest_framework_jk.timing import timed
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.routers import recent_keys
+from rest_framework_jk.usage import usage_buffer
+from rest_framework_jk.cache import access_key_cache, normalize_key, owner_cache
+from rest_framework_jk.settings import api_settings
+from rest_framework_jk.signing import revocation_list
+from rest_framework_jk.generations import key_generations
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Create your stores here.
+
+# Key type labels of the metrics.
+KEY_TYPES = {
+    models.AuthKey: 'auth',
+    models.RefreshKey: 'refresh',
+    models.AccessKey: 'access',
+}
+
+
+class BaseKeyStore:
+    """
+    Storage of the keys used by the authentications, the serializers and the viewsets.
+    The keys are model instances, but only ORMKeyStore saves them in the database.
+    """
+
+    def verify(self, model, key):
+        """
+        Return the valid key instance with its owner loaded, or None.
+
+        :param model: Key model class.
+        :param key: Key string or UUID instance.
+        """
+        raise NotImplementedError
+
+    async def averify(self, model, key):
+        """
+        Asynchronous version of verify().
+
+        :param model: Key model class.
+        :param key: Key string or UUID instance.
+        """
+        return await sync_to_async(self.verify)(model, key)
+
+    def find_many(self, model, keys):
+        """
+        Return the existing key instances, expired or not, with their owners loaded, by key string in the hex form.
+
+        :param model: Key model class.
+        :param list keys: Key strings in the hex form.
+        """
+        raise NotImplementedError
+
+    def obtain(self, owner):
+        """
+        Return the authentication key and the refresh key of the owner, issued or with renewed expiration.
+
+        :param owner: Owner instance.
+        """
+        raise NotImplementedError
+
+    async def aobtain(self, owner):
+        """
+        Asynchronous version of obtain().
+
+        :param owner: Owner instance.
+        """
+        return await sync_to_async(self.obtain)(owner)
+
+    def refresh(self, auth_key, refresh_key):
+        """
+        Replace the authentication key and the refresh key of the same owner with new keys.
+
+        :param auth_key: Authentication key string or UUID instance, it may have expired.
+        :param refresh_key: Refresh key string or UUID instance.
+        :return: Tuple of the new authentication key and refresh key instances, or None if the keys are not valid.
+        """
+        raise NotImplementedError
+
+    async def arefresh(self, auth_key, refresh_key):
+        """
+        Asynchronous version of refresh().
+
+        :param auth_key: Authentication key string or UUID instance, it may have expired.
+        :param refresh_key: Refresh key string or UUID instance.
+        """
+        return await sync_to_async(self.refresh)(auth_key, refresh_key)
+
+    def list_by_owner(self, model, owner):
+        """
+        Return the keys of the owner, as a queryset or a list ordered by ID.
+
+        :param model: Key model class.
+        :param owner: Owner instance.
+        """
+        raise NotImplementedError
+
+    def get(self, model, owner, pk):
+        """
+        Return the key of the owner with the ID, or None.
+
+        :param model: Key model class.
+        :param owner: Owner instance.
+        :param pk: Key ID.
+        """
+        return next((instance for instance in self.list_by_owner(model, owner) if str(instance.pk) == str(pk)), None)
+
+    def issue(self, model, owner, **fields):
+        """
+        Return a new key of the owner.
+
+        :param model: Key model class.
+        :param owner: Owner instance.
+        :param fields: Values of the other fields, e.g. the name of the access key.
+        """
+        raise NotImplementedError
+
+    def rotate(self, instance):
+        """
+        Replace the key string of the key instance, and return it.
+
+        :param instance: Key instance.
+        """
+        raise NotImplementedError
+
+    def update(self, instance, **fields):
+        """
+        Change the fields of the key instance, and return it.
+
+        :param instance: Key instance.
+        :param fields: Values of the fields.
+        """
+        raise NotImplementedError
+
+    def revoke(self, instance):
+        """
+        Delete the key instance.
+
+        :param instance: Key instance.
+        """
+        raise NotImplementedError
+
+    def touch(self, instance, field):
+        """
+        Record the usage of the key in the timestamp field. The stores that do not track usages ignore it.
+
+        :param instance: Key instance.
+        :param str field: Name of the timestamp field.
+        """
+        pass
+
+    def issue_access_keys(self, owner, names):
+        """
+        Return the new access keys of the owner, in the order of the names.
+
+        :param owner: Owner instance.
+        :param list names: Names of the access keys.
+        """
+        return [self.issue(models.AccessKey, owner, name=name) for name in names]
+
+    def rotate_access_keys(self, owner, ids):
+        """
+        Replace the key strings of the access keys of the owner with the IDs, and return them ordered by ID.
+        The IDs of the other owners are ignored.
+
+        :param owner: Owner instance.
+        :param list ids: Access key IDs.
+        """
+        ids = set(ids)
+        return [self.rotate(instance) for instance in self.list_by_owner(models.AccessKey, owner) if instance.pk in ids]
+
+    def revoke_access_keys(self, owner, ids):
+        """
+        Delete the access keys of the owner with the IDs, and return the deleted IDs in order.
+        The IDs of the other owners are ignored.
+
+        :param owner: Owner instance.
+        :param list ids: Access key IDs.
+        """
+        ids = set(ids)
+        instances = [instance for instance in self.list_by_owner(models.AccessKey, owner) if instance.pk in ids]
+
+        for instance in instances:
+            self.revoke(instance)
+
+        return sorted(instance.pk for instance in instances)
+
+
+class ORMKeyStore(BaseKeyStore):
+    """
+    Store of the keys in the database, with the key caches, the Bloom filter and the replica routing of compat.
+    """
+
+    def verify(self, model, key):
+        return getattr(compat, 'verify_%s_key' % KEY_TYPES[model])(key)
+
+    async def averify(self, model, key):
+        return await getattr(compat, 'averify_%s_key' % KEY_TYPES[model])(key)
+
+    def find_many(self, model, keys):
+        # One query of the unique key index for all the keys.
+        return {instance.key.hex: instance for instance in model.objects.select_related('owner').filter(key__in=keys)}
+
+    def obtain(self, owner):
+        return compat.obtain_keys(owner)
+
+    async def aobtain(self, owner):
+        return await compat.aobtain_keys(owner)
+
+    def refresh(self, auth_key, refresh_key):
+        return compat.refresh_keys(auth_key, refresh_key)
+
+    async def arefresh(self, auth_key, refresh_key):
+        return await compat.arefresh_keys(auth_key, refresh_key)
+
+    def list_by_owner(self, model, owner):
+        return model.objects.filter(owner=owner)
+
+    def get(self, model, owner, pk):
+        try:
+            return model.objects.get(owner=owner, pk=pk)
+        except (model.DoesNotExist, ValueError, TypeError, ValidationError):
+            return None
+
+    def issue(self, model, owner, **fields):
+        return model.objects.create(owner=owner, **fields)
+
+    def rotate(self, instance):
+        # The replaced key is invalidated by post_save.
+        instance.key = instance.generate_key
+        instance.save()
+        return instance
+
+    def update(self, instance, **fields):
+        for name, value in fields.items():
+            setattr(instance, name, value)
+
+        instance.save()
+        return instance
+
+    def revoke(self, instance):
+        # The deleted key is invalidated by post_delete.
+        instance.delete()
+
+    def touch(self, instance, field):
+        usage_buffer.touch(instance, field)
+
+    def issue_access_keys(self, owner, names):
+        # bulk_create does not send pre_save, the new keys are stamped here.
+        generation = key_generations.get(owner.pk)
+        access_keys = [models.AccessKey(name=name, owner=owner, generation=generation) for name in names]
+        models.AccessKey.objects.bulk_create(access_keys)
+        # bulk_create does not send post_save, the new keys may have been cached as unknown.
+        keys = [access_key.key for access_key in access_keys]
+        access_key_cache.delete(*keys)
+        access_key_filter.add(*keys)
+        recent_keys.mark(keys)
+        # Not every database returns the primary keys of the created rows.
+        return list(models.AccessKey.objects.filter(owner=owner, key__in=keys).order_by('id'))
+
+    def rotate_access_keys(self, owner, ids):
+        updated_at = now()
+
+        with transaction.atomic():
+            queryset = models.AccessKey.objects.select_for_update().filter(owner=owner, id__in=ids)
+            access_keys = list(queryset.order_by('id'))
+            loaded_keys = [access_key.key for access_key in access_keys]
+
+            for access_key in access_keys:
+                access_key.key = access_key.generate_key
+                access_key.updated_at = updated_at
+
+            models.AccessKey.objects.bulk_update(access_keys, ['key', 'updated_at'])
+
+        # bulk_update does not send post_save.
+        keys = [access_key.key for access_key in access_keys]
+        access_key_cache.delete(*loaded_keys, *keys)
+        access_key_filter.add(*keys)
+        recent_keys.mark(loaded_keys + keys)
+        return access_keys
+
+    def revoke_access_keys(self, owner, ids):
+        queryset = models.AccessKey.objects.filter(owner=owner, pk__in=ids)
+        deleted = sorted(queryset.values_list('id', flat=True))
+        # delete() sends post_delete, which invalidates the cached keys.
+        queryset.delete()
+        return deleted
+
+
+class RecordKeyStore(BaseKeyStore):
+    """
+    Base of the stores that keep the keys as records outside of the database.
+    A record holds the field values of the key as strings, and is found by the key string.
+    The owners are still loaded from the owner cache or the database.
+
+    The records are not written in transactions, and the refreshes are neither coalesced nor given a grace period.
+    Usages are not tracked, so the expiration of the authentication key does not slide.
+    """
+
+    def load(self, model, keys):
+        """
+        Return the records of the key strings in the hex form, None for the missing ones.
+        """
+        raise NotImplementedError
+
+    def save(self, model, record, timeout):
+        """
+        Store the record for its key string, for timeout seconds, or without expiration if timeout is None.
+        """
+        raise NotImplementedError
+
+    def remove(self, model, key):
+        """
+        Delete the record of the key string in the hex form, and return False if another call deleted it first.
+        """
+        raise NotImplementedError
+
+    def get_owner_keys(self, model, owner_id):
+        raise NotImplementedError
+
+    def add_owner_key(self, model, owner_id, key):
+        raise NotImplementedError
+
+    def remove_owner_key(self, model, owner_id, key):
+        raise NotImplementedError
+
+    def next_id(self, model):
+        raise NotImplementedError
+
+    def make_key(self, model, *parts):
+        return ':'.join(('jk', 'store', model._meta.model_name, *map(str, parts)))
+
+    def to_record(self, instance):
+        record = {}
+
+        for field in instance._meta.concrete_fields:
+            value = field.value_from_object(instance)
+            record[field.attname] = None if value is None else field.value_to_string(instance)
+
+        return record
+
+    def from_record(self, model, record):
+        fields = {field.attname: field for field in model._meta.concrete_fields}
+        return model(**{name: None if value is None else fields[name].to_python(value)
+                        for name, value in record.items() if name in fields})
+
+    def get_timeout(self, instance):
+        if not isinstance(instance, models.AbstractExpiringKey):
+            return None
+
+        # Expired authentication keys are kept while they can still be refreshed.
+        retention = api_settings.REFRESH_EXPIRATION_DELTA if isinstance(instance, models.AuthKey) else timedelta(0)
+        return max((instance.get_expiration() + retention - now()).total_seconds(), 1)
+
+    def put(self, instance):
+        self.save(type(instance), self.to_record(instance), self.get_timeout(instance))
+        self.add_owner_key(type(instance), instance.owner_id, instance.key.hex)
+        return instance
+
+    def get_owner(self, owner_id):
+        owner = owner_cache.get(owner_id)
+
+        if owner is None:
+            owner_model = models.AuthKey._meta.get_field('owner').related_model
+            cached_at = time()
+
+            try:
+                owner = owner_model.objects.get(pk=owner_id)
+            except owner_model.DoesNotExist:
+                return None
+
+            owner_cache.set(owner, cached_at)
+
+        return owner
+
+    def find(self, model, key):
+        key = normalize_key(key)
+
+        if key is None:
+            return None
+
+        record, = self.load(model, [key])
+        return None if record is None else self.from_record(model, record)
+
+    @timed('jk-lookup')
+    def verify(self, model, key):
+        instance = self.find(model, key)
+
+        if instance is None:
+            metrics.inc('jk_key_lookups_total', key_type=KEY_TYPES[model], result='miss')
+            return None
+
+        if isinstance(instance, models.AbstractExpiringKey) and instance.is_expired():
+            metrics.inc('jk_key_lookups_total', key_type=KEY_TYPES[model], result='expired')
+            return None
+
+        if not key_generations.is_current(instance):
+            metrics.inc('jk_key_lookups_total', key_type=KEY_TYPES[model], result='revoked')
+            return None
+
+        instance.owner = self.get_owner(instance.owner_id)
+
+        if instance.owner is None:
+            metrics.inc('jk_key_lookups_total', key_type=KEY_TYPES[model], result='miss')
+            return None
+
+        metrics.inc('jk_key_lookups_total', key_type=KEY_TYPES[model], result='hit')
+        return instance
+
+    def find_many(self, model, keys):
+        instances = {}
+
+        for key, record in zip(keys, self.load(model, keys)):
+            if record is None:
+                continue
+
+            instance = self.from_record(model, record)
+            instance.owner = self.get_owner(instance.owner_id)
+
+            if instance.owner is not None:
+                instances[key] = instance
+
+        return instances
+
+    def new_key(self, model, owner, **fields):
+        instance = model(id=self.next_id(model), owner=owner, generation=key_generations.get(owner.pk), **fields)
+        instance.key = UUID(instance.generate_key)
+        instance.updated_at = now()
+
+        if isinstance(instance, models.AbstractExpiringKey):
+            instance.expires_at = instance.updated_at + instance.get_expiration_delta()
+
+        return instance
+
+    def obtain(self, owner):
+        keys = []
+
+        for model in (models.AuthKey, models.RefreshKey):
+            instance = next(iter(self.list_by_owner(model, owner)), None)
+
+            if instance is None:
+                instance = self.new_key(model, owner)
+            else:
+                instance.updated_at = now()
+                instance.expires_at = instance.updated_at + instance.get_expiration_delta()
+                instance.generation = key_generations.get(owner.pk)
+
+            keys.append(self.put(instance))
+
+        return tuple(keys)
+
+    def refresh(self, auth_key, refresh_key):
+        refresh_instance = self.verify(models.RefreshKey, refresh_key)
+        auth_instance = self.find(models.AuthKey, auth_key)
+
+        # Make sure the credentials are the same user.
+        if refresh_instance is None or auth_instance is None or auth_instance.owner_id != refresh_instance.owner_id:
+            return None
+
+        # Only one of the concurrent refreshes of the same keys replaces them.
+        if not self.remove(models.RefreshKey, refresh_instance.key.hex):
+            return None
+
+        auth_instance.owner = refresh_instance.owner
+        new_keys = (self.rotate(auth_instance), self.rotate(refresh_instance))
+
+        # The signed keys issued for the replaced key are no longer valid.
+        if api_settings.SIGNED_AUTH_KEYS:
+            revocation_list.revoke(auth_key)
+
+        return new_keys
+
+    def list_by_owner(self, model, owner):
+        keys = self.get_owner_keys(model, owner.pk)
+        instances = []
+
+        for key, record in zip(keys, self.load(model, keys)):
+            if record is None:
+                # The record has expired.
+                self.remove_owner_key(model, owner.pk, key)
+                continue
+
+            instance = self.from_record(model, record)
+            instance.owner = owner
+            instances.append(instance)
+
+        return sorted(instances, key=lambda instance: instance.pk)
+
+    def issue(self, model, owner, **fields):
+        return self.put(self.new_key(model, owner, **fields))
+
+    def rotate(self, instance):
+        model = type(instance)
+        loaded_key = instance.key.hex
+        instance.key = UUID(instance.generate_key)
+        instance.updated_at = now()
+
+        if isinstance(instance, models.AbstractExpiringKey):
+            instance.expires_at = instance.updated_at + instance.get_expiration_delta()
+
+        self.put(instance)
+        self.remove(model, loaded_key)
+        self.remove_owner_key(model, instance.owner_id, loaded_key)
+        return instance
+
+    def update(self, instance, **fields):
+        for name, value in fields.items():
+            setattr(instance, name, value)
+
+        instance.updated_at = now()
+        return self.put(instance)
+
+    def revoke(self, instance):
+        model = type(instance)
+        self.remove(model, instance.key.hex)
+        self.remove_owner_key(model, instance.owner_id, instance.key.hex)
+
+
+class CacheKeyStore(RecordKeyStore):
+    """
+    Store of the keys in the Django cache of KEY_STORE_CACHE_ALIAS.
+    The cache must not evict the records, e.g. a Redis or Memcached server with enough memory.
+    The key lists of the owners are updated under a lock claimed with add(), so concurrent updates do not drop keys.
+    """
+    # Seconds the claims of the removed records are kept, longer than any refresh takes.
+    claim_timeout = 300
+    # Seconds the lock of a key list is kept at most, if its holder dies.
+    lock_timeout = 10
+
+    @property
+    def cache(self):
+        return caches[api_settings.KEY_STORE_CACHE_ALIAS]
+
+    def load(self, model, keys):
+        records = self.cache.get_many([self.make_key(model, key) for key in keys])
+        return [records.get(self.make_key(model, key)) for key in keys]
+
+    def save(self, model, record, timeout):
+        self.cache.set(self.make_key(model, normalize_key(record['key'])), record, timeout)
+
+    def remove(self, model, key):
+        # The backends of Django < 3.1 do not return whether the key was deleted,
+        # so the concurrent calls claim the removal with add(), which only one of them wins.
+        claimed = self.cache.add(self.make_key(model, key, 'removed'), True, self.claim_timeout)
+        self.cache.delete(self.make_key(model, key))
+        return claimed
+
+    def get_owner_keys(self, model, owner_id):
+        return self.cache.get(self.make_key(model, 'owner', owner_id), [])
+
+    @contextmanager
+    def lock_owner_keys(self, model, owner_id):
+        """
+        Hold the lock of the key list of the owner, claimed with add(), which only one caller wins.
+        """
+        lock = self.make_key(model, 'owner', owner_id, 'lock')
+
+        while not self.cache.add(lock, True, self.lock_timeout):
+            sleep(0.005)
+
+        try:
+            yield
+        finally:
+            self.cache.delete(lock)
+
+    def add_owner_key(self, model, owner_id, key):
+        with self.lock_owner_keys(model, owner_id):
+            keys = self.get_owner_keys(model, owner_id)
+
+            if key not in keys:
+                self.cache.set(self.make_key(model, 'owner', owner_id), keys + [key], None)
+
+    def remove_owner_key(self, model, owner_id, key):
+        with self.lock_owner_keys(model, owner_id):
+            keys = self.get_owner_keys(model, owner_id)
+
+            if key in keys:
+                self.cache.set(self.make_key(model, 'owner', owner_id), [k for k in keys if k != key], None)
+
+    def next_id(self, model):
+        key = self.make_key(model, 'id')
+        self.cache.add(key, 0, None)
+        return self.cache.incr(key)
+
+
+class RedisKeyStore(RecordKeyStore):
+    """
+    Store of the keys in the Redis server of KEY_STORE_REDIS_URL.
+    The records are JSON strings, and the key lists of the owners are Redis sets.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            if redis is None:
+                raise ImproperlyConfigured('RedisKeyStore requires the redis package.')
+
+            self._client = redis.Redis.from_url(api_settings.KEY_STORE_REDIS_URL)
+
+        return self._client
+
+    def load(self, model, keys):
+        if not keys:
+            return []
+
+        values = self.client.mget([self.make_key(model, key) for key in keys])
+        return [None if value is None else json.loads(value) for value in values]
+
+    def save(self, model, record, timeout):
+        name = self.make_key(model, normalize_key(record['key']))
+        self.client.set(name, json.dumps(record), ex=None if timeout is None else int(timeout))
+
+    def remove(self, model, key):
+        return self.client.delete(self.make_key(model, key)) == 1
+
+    def get_owner_keys(self, model, owner_id):
+        return sorted(key.decode() for key in self.client.smembers(self.make_key(model, 'owner', owner_id)))
+
+    def add_owner_key(self, model, owner_id, key):
+        self.client.sadd(self.make_key(model, 'owner', owner_id), key)
+
+    def remove_owner_key(self, model, owner_id, key):
+        self.client.srem(self.make_key(model, 'owner', owner_id), key)
+
+    def next_id(self, model):
+        return self.client.incr(self.make_key(model, 'id'))
+
+
+key_stores = {}
+
+
+def get_key_store():
+    """
+    Return the instance of the KEY_STORE class.
+    """
+    store_class = api_settings.KEY_STORE
+    store = key_stores.get(store_class)
+
+    if store is None:
+        store = key_stores[store_class] = store_class()
+
+    return store
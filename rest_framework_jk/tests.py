@@ -1,18 +1,72 @@
+import os
 from uuid import uuid4
-from time import sleep
-from datetime import timedelta
+from io import StringIO
+from time import sleep, time
 from functools import reduce
+from base64 import b64encode
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+from types import SimpleNamespace
+from importlib import import_module
+from threading import Barrier, Thread
+from tempfile import TemporaryDirectory
 
+import django
+from django.apps import apps
+from django.conf import settings
 from django.urls import reverse
+from django.db import connection
+from django.db.models import Model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.timezone import now
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import CaptureQueriesContext, override_settings
 
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.test import APITestCase, APIRequestFactory
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
+from rest_framework.status import HTTP_304_NOT_MODIFIED, HTTP_429_TOO_MANY_REQUESTS
 
-from rest_framework_jk import views
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.scopes import scope_registry
+from rest_framework_jk.permissions import HasKeyScope
+from rest_framework_jk.generations import key_generations
+from rest_framework_jk.snapshot import access_key_snapshot, export_snapshot
+from rest_framework_jk.usage import usage_buffer
+from rest_framework_jk.timing import current_timing
+from rest_framework_jk.routers import ReplicaRouter, recent_keys
+from rest_framework_jk.stores import CacheKeyStore, RedisKeyStore, get_key_store
+from rest_framework_jk import compat, models, serializers, views
 from rest_framework_jk.settings import api_settings
+from rest_framework_jk.throttling import obtain_throttle
+from rest_framework_jk.middleware import ServerTimingMiddleware
+from rest_framework_jk.bloom import access_key_filter, get_negative_stats
+from rest_framework_jk.signing import is_signed_key, revocation_list, sign_key
+from rest_framework_jk.authentication import JKAuthentication, AsyncJKAuthentication
+from rest_framework_jk.authentication import SnapshotAccessKeyAuthentication
+from rest_framework_jk.cache import RefreshEntry, make_tombstone
+from rest_framework_jk.cache import auth_key_cache, access_key_cache, owner_cache, refresh_cache, normalize_key
 from rest_framework_jk.authentication import AuthKeyAuthentication, AccessKeyAuthentication
+from rest_framework_jk.authentication import AsyncAuthKeyAuthentication, AsyncAccessKeyAuthentication
+
+try:
+    import adrf
+    from asgiref.sync import async_to_sync
+except ImportError:
+    adrf = None
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
 
 # Create your tests here.
 
@@ -187,7 +241,7 @@ class AccessKeyTestCase(BaseTestCase):
         valid_request.user = self.valid_user
         valid_response = view(valid_request)
         self.assertEqual(valid_response.status_code, HTTP_201_CREATED)
-        self.assertEqual(valid_response.data.keys(), {'id', 'key', 'name'})
+        self.assertEqual(valid_response.data.keys(), {'id', 'key', 'name', 'scopes'})
         self.assertTrue(self.authenticate(valid_response.data.get('key')))
 
         # Invalid case
@@ -237,3 +291,2100 @@ class AccessKeyTestCase(BaseTestCase):
         invalid_response = view(invalid_request, pk=valid_data.get('id'))
         self.assertEqual(invalid_response.status_code, HTTP_403_FORBIDDEN)
         self.assertEqual(invalid_response.data.keys(), {'detail'})
+
+
+class IntrospectionTestCase(BaseTestCase):
+    """
+    Test key introspection case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+        self.admin_user = UserModel.objects.create_user('admin', is_staff=True)
+
+    def introspect(self, keys, user=None):
+        request = factory.post(reverse('introspect-list'), {'keys': keys}, format='json')
+        request.user = user or self.admin_user
+        return views.IntrospectionViewSet.as_view({'post': 'create'})(request)
+
+    def test_introspect(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        expired_key = models.AuthKey.objects.create(owner=self.admin_user)
+        models.AuthKey.objects.filter(pk=expired_key.pk).update(expires_at=now() - timedelta(minutes=1))
+        disabled_user = UserModel.objects.create_user('disabled', is_active=False)
+        disabled_key = models.AccessKey.objects.create(owner=disabled_user)
+
+        auth, access = api_settings.AUTH_HEADER_PREFIX, api_settings.ACCESS_HEADER_PREFIX
+        keys = [
+            '%s %s' % (auth, auth_key.key),
+            '%s %s' % (access.upper(), access_key.key.hex),
+            '%s %s' % (auth, expired_key.key),
+            '%s %s' % (access, disabled_key.key),
+            '%s %s' % (access, uuid4()),
+            '%s key' % access,
+            'Basic dXNlcg==',
+        ]
+
+        # One query per key type.
+        with self.assertNumQueries(2):
+            response = self.introspect(keys)
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        states = response.data['keys']
+        self.assertEqual([(state['key_type'], state['status']) for state in states], [
+            ('auth', 'active'),
+            ('access', 'active'),
+            ('auth', 'expired'),
+            ('access', 'disabled'),
+            ('access', 'unknown'),
+            ('access', 'unknown'),
+            (None, 'unknown'),
+        ])
+        self.assertEqual([state['active'] for state in states], [True, True] + [False] * 5)
+        self.assertEqual(states[0]['owner_id'], self.valid_user.pk)
+        self.assertAlmostEqual(states[0]['expires_in'], api_settings.AUTH_EXPIRATION_DELTA.total_seconds(), delta=5)
+        self.assertIsNone(states[1]['expires_in'])
+        self.assertEqual(states[2]['expires_in'], 0)
+        self.assertEqual(states[0]['max_age'], api_settings.INTROSPECTION_MAX_AGE.total_seconds())
+        self.assertIn('max-age=%d' % api_settings.NEGATIVE_KEY_CACHE_TIMEOUT.total_seconds(), response['Cache-Control'])
+
+    def test_missing_expires_at(self):
+        # The rows saved before expires_at was stored expire by updated_at.
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        models.AuthKey.objects.filter(pk=auth_key.pk).update(expires_at=None)
+        expired_key = models.AuthKey.objects.create(owner=self.admin_user)
+        updated_at = now() - api_settings.AUTH_EXPIRATION_DELTA - timedelta(minutes=1)
+        models.AuthKey.objects.filter(pk=expired_key.pk).update(expires_at=None, updated_at=updated_at)
+
+        auth = api_settings.AUTH_HEADER_PREFIX
+        response = self.introspect(['%s %s' % (auth, auth_key.key), '%s %s' % (auth, expired_key.key)])
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        states = response.data['keys']
+        self.assertEqual([state['status'] for state in states], ['active', 'expired'])
+        self.assertAlmostEqual(states[0]['expires_in'], api_settings.AUTH_EXPIRATION_DELTA.total_seconds(), delta=5)
+
+    def test_invalid(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        key = '%s %s' % (api_settings.ACCESS_HEADER_PREFIX, access_key.key)
+
+        # Only the admin users can introspect the keys.
+        self.assertEqual(self.introspect([key], user=self.valid_user).status_code, HTTP_403_FORBIDDEN)
+        self.assertEqual(self.introspect([]).status_code, HTTP_400_BAD_REQUEST)
+
+        api_settings.BULK_MAX_SIZE = 1
+
+        try:
+            self.assertEqual(self.introspect([key, key]).status_code, HTTP_400_BAD_REQUEST)
+        finally:
+            api_settings.BULK_MAX_SIZE = api_settings.defaults['BULK_MAX_SIZE']
+
+
+class AccessKeyListTestCase(BaseTestCase):
+    """
+    Test access key list case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.access_keys = [models.AccessKey.objects.create(owner=self.valid_user, name='key-%d' % i) for i in range(5)]
+        models.AccessKey.objects.create(owner=UserModel.objects.create_user('other'))
+
+    def tearDown(self):
+        api_settings.ACCESS_KEY_PAGE_SIZE = api_settings.defaults['ACCESS_KEY_PAGE_SIZE']
+        api_settings.ACCESS_KEY_MAX_PAGE_SIZE = api_settings.defaults['ACCESS_KEY_MAX_PAGE_SIZE']
+
+    def list(self, url, **headers):
+        request = factory.get(url, **headers)
+        request.user = self.valid_user
+        return views.AccessKeyViewSet.as_view({'get': 'list'})(request)
+
+    def test_pagination(self):
+        ids, url = [], reverse('access-list') + '?page_size=2'
+
+        while url:
+            response = self.list(url)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids += [data['id'] for data in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(ids, [access_key.pk for access_key in self.access_keys])
+
+        # The previous links go back to the first page.
+        ids, url = [], response.data['previous']
+
+        while url:
+            response = self.list(url)
+            ids = [data['id'] for data in response.data['results']] + ids
+            url = response.data['previous']
+
+        self.assertEqual(ids, [access_key.pk for access_key in self.access_keys[:4]])
+
+        cursor = b64encode(b'p=invalid').decode()
+        self.assertEqual(self.list(reverse('access-list') + '?cursor=invalid').status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual(self.list(reverse('access-list') + '?cursor=' + cursor).status_code, HTTP_404_NOT_FOUND)
+
+        # The page size is limited by ACCESS_KEY_MAX_PAGE_SIZE.
+        api_settings.ACCESS_KEY_MAX_PAGE_SIZE = 3
+        self.assertEqual(len(self.list(reverse('access-list') + '?page_size=10').data['results']), 3)
+
+        # The keys are not paginated without ACCESS_KEY_PAGE_SIZE.
+        api_settings.ACCESS_KEY_PAGE_SIZE = None
+        self.assertEqual(len(self.list(reverse('access-list')).data), 5)
+
+    def test_lean_list(self):
+        # The rows are the same as the ones of the serializer.
+        response = self.list(reverse('access-list'))
+        data = serializers.AccessKeySerializer(self.access_keys, many=True).data
+        self.assertEqual(response.data['results'], [dict(item) for item in data])
+
+    def test_etag(self):
+        response = self.list(reverse('access-list'))
+        etag = response['ETag']
+        self.assertEqual(self.list(reverse('access-list'), HTTP_IF_NONE_MATCH=etag).status_code, HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(self.list(reverse('access-list') + '?page_size=2')['ETag'], etag)
+
+        # Changing, creating or deleting a key changes the entity tag.
+        sleep(0.01)
+        self.access_keys[0].name = 'other'
+        self.access_keys[0].save()
+        response = self.list(reverse('access-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.access_keys[1].delete()
+        self.assertEqual(self.list(reverse('access-list'), HTTP_IF_NONE_MATCH=etag).status_code, HTTP_200_OK)
+
+
+class KeyCacheTestCase(BaseTestCase):
+    """
+    Test verified key cache case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+
+    def authenticate(self, authentication, key):
+        try:
+            authentication.authenticate_credentials(key)
+        except AuthenticationFailed:
+            return False
+
+        return True
+
+    def test_cache_hit(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        # The Django cache tier serves the other processes.
+        auth_key_cache.clear()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+
+    def test_cache_expiration(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+
+        entry = auth_key_cache.local.get(auth_key.key.hex)
+        auth_key_cache.local.set(auth_key.key.hex, entry._replace(expires_at=0), 60)
+        self.assertFalse(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+
+    def test_cache_entry(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user, name='name', scopes=3)
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        # Only the fields of the key and the is_active flag of the owner are cached.
+        entry = cache.get(access_key_cache.make_key(access_key.key.hex))
+        self.assertNotIn(self.valid_user.password, repr(entry))
+        self.assertEqual((entry.owner_id, entry.is_active), (self.valid_user.pk, True))
+
+        cached = access_key_cache.get(access_key.key)
+        self.assertEqual((cached.key.pk, cached.key.scopes), (access_key.pk, 3))
+        self.assertEqual(cached.key.owner.pk, self.valid_user.pk)
+
+        # The other fields are queried on access.
+        with self.assertNumQueries(2):
+            self.assertEqual(cached.key.name, 'name')
+            self.assertEqual(cached.key.owner.username, self.valid_user.username)
+
+    def test_invalidate_other_processes(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+        entry = access_key_cache.local.get(access_key.key.hex)
+
+        # The entry of another process is rejected by the tombstone in the Django cache.
+        models.AccessKey.objects.filter(pk=access_key.pk).delete()
+        access_key_cache.local.set(access_key.key.hex, entry, 60)
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+        entry = access_key_cache.local.get(access_key.key.hex)
+
+        self.valid_user.is_active = False
+        self.valid_user.save()
+        access_key_cache.local.set(access_key.key.hex, entry, 60)
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+    def test_invalidate_during_read(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        old_key, cache_set = access_key.key, access_key_cache.set
+
+        def rotate_and_set(*args, **kwargs):
+            # Another process rotates the key between the query and the write of the entry.
+            rotated = models.AccessKey.objects.get(pk=access_key.pk)
+            rotated.key = rotated.generate_key
+            rotated.save()
+            cache_set(*args, **kwargs)
+
+        with patch.object(access_key_cache, 'set', rotate_and_set):
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), old_key))
+
+        # The entry read before the rotation is rejected, in this process and from the Django cache.
+        self.assertIsNotNone(cache.get(access_key_cache.make_key(old_key.hex)))
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), old_key))
+        access_key_cache.set(access_key, cached_at=time() - 1)
+        access_key_cache.local.clear()
+        self.assertIsNone(access_key_cache.get(old_key))
+        self.assertIsNone(cache.get(access_key_cache.make_key(old_key.hex)))
+
+    def test_cache_size(self):
+        api_settings.KEY_CACHE_SIZE = 1
+        access_keys = [models.AccessKey.objects.create(owner=self.valid_user) for i in range(2)]
+
+        for access_key in access_keys:
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        self.assertEqual(list(access_key_cache.local.entries), [access_keys[-1].key.hex])
+
+        # Restore cache size to default
+        api_settings.KEY_CACHE_SIZE = api_settings.defaults['KEY_CACHE_SIZE']
+
+    def test_invalidate_refreshed_key(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        old_auth_key, old_access_key = auth_key.key, access_key.key
+
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), old_auth_key))
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), old_access_key))
+
+        auth_key.key = auth_key.generate_key
+        auth_key.save()
+        access_key = models.AccessKey.objects.get(pk=access_key.pk)
+        access_key.key = access_key.generate_key
+        access_key.save()
+
+        self.assertFalse(self.authenticate(AuthKeyAuthentication(), old_auth_key))
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), old_access_key))
+
+    def test_invalidate_deleted_key(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        models.AccessKey.objects.filter(pk=access_key.pk).delete()
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+    def test_invalidate_deactivated_owner(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        self.valid_user.is_active = False
+        self.valid_user.save()
+
+        self.assertFalse(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+    def test_owner_changes(self):
+        # Only the changes of is_active invalidate the keys of the owner.
+        with self.assertNumQueries(1):
+            self.valid_user.last_login = now()
+            self.valid_user.save(update_fields=['last_login'])
+
+        with self.assertNumQueries(1):
+            self.valid_user.first_name = 'name'
+            self.valid_user.save()
+
+
+class QueryBudgetTestCase(BaseTestCase):
+    """
+    Test the number of queries of the authentication and the endpoints.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+        self.auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        self.refresh_key = models.RefreshKey.objects.create(owner=self.valid_user)
+        self.access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+    def get_view(self, viewset, actions):
+        return viewset.as_view(actions, authentication_classes=(AuthKeyAuthentication,))
+
+    def get_header(self):
+        return {'HTTP_AUTHORIZATION': '%s %s' % (api_settings.AUTH_HEADER_PREFIX, self.auth_key.key.hex)}
+
+    def test_auth_key_authentication(self):
+        request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (api_settings.AUTH_HEADER_PREFIX, self.auth_key.key))
+
+        with self.assertNumQueries(1):
+            user, auth_key = AuthKeyAuthentication().authenticate(request)
+            self.assertEqual(user.username, self.valid_user.username)
+
+    def test_access_key_authentication(self):
+        request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (api_settings.ACCESS_HEADER_PREFIX, self.access_key.key))
+
+        with self.assertNumQueries(1):
+            user, access_key = AccessKeyAuthentication().authenticate(request)
+            self.assertEqual(user.username, self.valid_user.username)
+
+    def test_auth_obtain(self):
+        view = self.get_view(views.AuthKeyViewSet, {'post': 'create'})
+        request = factory.post(reverse('auth-list'), self.get_valid_user_pass())
+
+        # The keys are upserted in one transaction where the database supports it.
+        with self.assertNumQueries(6 if compat.supports_upsert(models.AuthKey) else 9):
+            response = view(request)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_auth_refresh(self):
+        view = self.get_view(views.AuthKeyViewSet, {'put': 'refresh'})
+        data = {'auth_key': self.auth_key.key, 'refresh_key': self.refresh_key.key}
+        request = factory.put(reverse('auth-refresh'), data)
+
+        # One conditional UPDATE per key in one transaction.
+        with CaptureQueriesContext(connection) as context:
+            response = view(request)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+        # The transaction is a savepoint in the test case.
+        statements = [query['sql'] for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual([statement.split()[0] for statement in statements], ['UPDATE', 'UPDATE'])
+        self.assertEqual(len(context.captured_queries), 4)
+
+    def test_auth_obtain_keeps_keys(self):
+        expires_at = now() - timedelta(seconds=1)
+        models.AuthKey.objects.filter(pk=self.auth_key.pk).update(expires_at=expires_at)
+
+        for obtain_keys in (compat.update_or_create_keys, compat.upsert_keys, compat.obtain_keys):
+            if obtain_keys is compat.upsert_keys and not compat.supports_upsert(models.AuthKey):
+                continue
+
+            auth_key, refresh_key = obtain_keys(self.valid_user)
+            self.assertEqual(auth_key.key, self.auth_key.key)
+            self.assertEqual(refresh_key.key, self.refresh_key.key)
+            self.assertGreater(models.AuthKey.objects.get(pk=self.auth_key.pk).expires_at, now())
+            self.assertGreater(auth_key.get_expiration(), now())
+
+        # The keys of a new owner are created.
+        other_user = UserModel.objects.create_user('other')
+        auth_key, refresh_key = compat.obtain_keys(other_user)
+        self.assertEqual(models.AuthKey.objects.get(owner=other_user).key, auth_key.key)
+        self.assertEqual(models.RefreshKey.objects.get(owner=other_user).key, refresh_key.key)
+
+    def test_auth_refresh_with_other_owner(self):
+        view = self.get_view(views.AuthKeyViewSet, {'put': 'refresh'})
+        other_user = UserModel.objects.create_user('other')
+        other_refresh_key = models.RefreshKey.objects.create(owner=other_user)
+        data = {'auth_key': self.auth_key.key, 'refresh_key': other_refresh_key.key}
+
+        response = view(factory.put(reverse('auth-refresh'), data))
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
+
+        # The refresh key of the other owner is rolled back.
+        self.assertTrue(models.RefreshKey.objects.filter(key=other_refresh_key.key).exists())
+        self.assertTrue(models.AuthKey.objects.filter(key=self.auth_key.key).exists())
+
+    def test_access_list(self):
+        view = self.get_view(views.AccessKeyViewSet, {'get': 'list'})
+        request = factory.get(reverse('access-list'), **self.get_header())
+
+        # The key lookup, the aggregate of the entity tag and the page.
+        with self.assertNumQueries(3):
+            response = view(request)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+        # The unchanged list is not read.
+        request = factory.get(reverse('access-list'), HTTP_IF_NONE_MATCH=response['ETag'], **self.get_header())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(view(request).status_code, HTTP_304_NOT_MODIFIED)
+
+    def test_access_obtain(self):
+        view = self.get_view(views.AccessKeyViewSet, {'post': 'create'})
+        request = factory.post(reverse('access-list'), {'name': 'name'}, **self.get_header())
+
+        with self.assertNumQueries(2):
+            response = view(request)
+            self.assertEqual(response.status_code, HTTP_201_CREATED)
+
+    def test_access_retrieve(self):
+        view = self.get_view(views.AccessKeyViewSet, {'get': 'retrieve'})
+        request = factory.get(reverse('access-detail', kwargs={'pk': self.access_key.pk}), **self.get_header())
+
+        with self.assertNumQueries(2):
+            response = view(request, pk=self.access_key.pk)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_access_update(self):
+        view = self.get_view(views.AccessKeyViewSet, {'patch': 'partial_update'})
+        url = reverse('access-detail', kwargs={'pk': self.access_key.pk})
+        request = factory.patch(url, {'name': 'name'}, **self.get_header())
+
+        with self.assertNumQueries(3):
+            response = view(request, pk=self.access_key.pk)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_access_refresh(self):
+        view = self.get_view(views.AccessKeyViewSet, {'put': 'refresh'})
+        url = reverse('access-refresh', kwargs={'pk': self.access_key.pk})
+        request = factory.put(url, **self.get_header())
+
+        with self.assertNumQueries(3):
+            response = view(request, pk=self.access_key.pk)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_access_destroy(self):
+        view = self.get_view(views.AccessKeyViewSet, {'delete': 'destroy'})
+        url = reverse('access-detail', kwargs={'pk': self.access_key.pk})
+        request = factory.delete(url, **self.get_header())
+
+        with self.assertNumQueries(3):
+            response = view(request, pk=self.access_key.pk)
+            self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
+
+
+class NegativeLookupTestCase(BaseTestCase):
+    """
+    Test unknown key rejection case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        access_key_filter.clear()
+        cache.clear()
+
+    def tearDown(self):
+        # Restore filter interval to default
+        api_settings.ACCESS_KEY_FILTER_INTERVAL = api_settings.defaults['ACCESS_KEY_FILTER_INTERVAL']
+        access_key_filter.clear()
+
+    def authenticate(self, authentication, key):
+        try:
+            authentication.authenticate_credentials(key)
+        except AuthenticationFailed:
+            return False
+
+        return True
+
+    def test_negative_cache(self):
+        key = uuid4()
+
+        with self.assertNumQueries(1):
+            self.assertFalse(self.authenticate(AuthKeyAuthentication(), key))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.authenticate(AuthKeyAuthentication(), key))
+
+        # The key becomes valid as soon as it is issued.
+        models.AuthKey.objects.create(owner=self.valid_user, key=key)
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), key))
+        self.assertEqual(get_negative_stats()['auth'], {'negative_hits': 1, 'negative_misses': 1})
+
+    def test_negative_cache_with_lapsed_auth_key(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        models.AuthKey.objects.filter(pk=auth_key.pk).update(updated_at=now() - timedelta(days=2))
+        self.assertFalse(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+
+        # Obtaining the key again renews it.
+        models.AuthKey.objects.update_or_create(owner=self.valid_user)
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), auth_key.key))
+
+    def test_access_key_filter(self):
+        api_settings.ACCESS_KEY_FILTER_INTERVAL = timedelta(minutes=5)
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+        # The first lookup starts the rebuild in a thread, and queries the key meanwhile.
+        with patch('rest_framework_jk.bloom.Thread') as thread, self.assertNumQueries(1):
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        self.assertEqual(thread.call_count, 1)
+
+        with patch('rest_framework_jk.bloom.connections'), self.assertNumQueries(2):
+            thread.call_args[1]['target']()
+
+        with self.assertNumQueries(0):
+            for i in range(10):
+                self.assertFalse(self.authenticate(AccessKeyAuthentication(), uuid4()))
+
+        # Keys issued after the rebuild pass the filter.
+        new_access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), new_access_key.key))
+
+        stats = get_negative_stats()['access_filter']
+        self.assertEqual(stats['rebuilds'], 1)
+        self.assertEqual(stats['hits'], 10)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_access_key_filter_false_positive(self):
+        api_settings.ACCESS_KEY_FILTER_INTERVAL = timedelta(minutes=5)
+        access_key_filter.rebuild()
+        key = uuid4()
+        access_key_filter.state.bloom.add(key.bytes)
+
+        with self.assertNumQueries(1):
+            self.assertFalse(self.authenticate(AccessKeyAuthentication(), key))
+
+        self.assertEqual(get_negative_stats()['access_filter']['false_positives'], 1)
+
+    def test_access_key_filter_with_stale_version(self):
+        api_settings.ACCESS_KEY_FILTER_INTERVAL = timedelta(minutes=5)
+        access_key_filter.rebuild()
+
+        # Another process issued a key.
+        cache.incr(access_key_filter.version_key)
+        access_key = models.AccessKey.objects.bulk_create([models.AccessKey(owner=self.valid_user)])[0]
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        # The unknown keys that passed the stale filter are not false positives.
+        key = uuid4()
+        access_key_filter.state.bloom.add(key.bytes)
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), key))
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), uuid4()))
+        self.assertNotIn('false_positives', get_negative_stats()['access_filter'])
+
+    def test_access_key_filter_without_shared_cache(self):
+        # The filters of the other processes would not know the issued keys.
+        api_settings.ACCESS_KEY_FILTER_INTERVAL = timedelta(minutes=5)
+        api_settings.KEY_CACHE_ALIAS = None
+
+        try:
+            with self.assertRaises(ImproperlyConfigured):
+                access_key_filter.might_contain(uuid4())
+
+            with self.assertRaises(ImproperlyConfigured):
+                apps.get_app_config('rest_framework_jk').ready()
+        finally:
+            api_settings.KEY_CACHE_ALIAS = api_settings.defaults['KEY_CACHE_ALIAS']
+
+
+class JKAuthenticationTestCase(BaseTestCase):
+    """
+    Test unified authentication case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+
+    def tearDown(self):
+        api_settings.METRICS_ENABLED = api_settings.defaults['METRICS_ENABLED']
+        metrics.clear()
+
+    def get_codes(self, authentication, header):
+        request = factory.get('/', HTTP_AUTHORIZATION=header)
+
+        try:
+            authentication.authenticate(request)
+        except AuthenticationFailed as exc:
+            return exc.get_codes()
+
+    def test_normalize_key(self):
+        key = uuid4()
+
+        for value in (key, key.hex, key.hex.upper(), str(key), str(key).upper(), '{%s}' % key, key.urn):
+            self.assertEqual(normalize_key(value), key.hex)
+
+        for value in ('', 'key', key.hex[:-1] + 'g', str(key).replace('-', 'x'), '-' * 36, key.hex + 'a'):
+            self.assertIsNone(normalize_key(value))
+
+    def test_authenticate(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        authentication = JKAuthentication()
+
+        cases = (
+            (api_settings.AUTH_HEADER_PREFIX, auth_key),
+            (api_settings.ACCESS_HEADER_PREFIX, access_key),
+            (api_settings.AUTH_HEADER_PREFIX.upper(), auth_key),
+        )
+
+        for prefix, key in cases:
+            # Valid case
+            request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (prefix, key.key))
+            self.assertEqual(authentication.authenticate(request), (self.valid_user, key))
+
+        # Other schemes are left to the other authentications.
+        self.assertIsNone(authentication.authenticate(factory.get('/')))
+        self.assertIsNone(authentication.authenticate(factory.get('/', HTTP_AUTHORIZATION='Basic dXNlcg==')))
+
+    def test_same_failures(self):
+        models.AuthKey.objects.create(owner=self.valid_user)
+        headers = ('%s', '%s a b', '%s key', '%s ' + str(uuid4()), '%s \xe9' + uuid4().hex)
+
+        for separate, prefix in ((AuthKeyAuthentication(), api_settings.AUTH_HEADER_PREFIX),
+                                 (AccessKeyAuthentication(), api_settings.ACCESS_HEADER_PREFIX)):
+            for header in headers:
+                self.assertEqual(self.get_codes(JKAuthentication(), header % prefix),
+                                 self.get_codes(separate, header % prefix))
+
+        self.assertEqual(self.get_codes(JKAuthentication(), '%s key' % api_settings.AUTH_HEADER_PREFIX), 'invalid_key')
+
+        # The header that is not valid UTF-8 is rejected as an invalid key.
+        for authentication, prefix in ((AuthKeyAuthentication(), api_settings.AUTH_HEADER_PREFIX),
+                                       (AccessKeyAuthentication(), api_settings.ACCESS_HEADER_PREFIX)):
+            self.assertEqual(self.get_codes(authentication, '%s \xe9' % prefix), 'invalid_key')
+
+    def test_metrics_scheme(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        api_settings.METRICS_ENABLED = True
+
+        request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (api_settings.ACCESS_HEADER_PREFIX, access_key.key))
+        JKAuthentication().authenticate(request)
+        labels = (('result', 'success'), ('scheme', api_settings.ACCESS_HEADER_PREFIX))
+        self.assertEqual(metrics.counters[('jk_authentication_total', labels)], 1)
+
+    @skipUnless(adrf and django.VERSION >= (4, 2), 'The async views require Django 4.2+ and adrf.')
+    def test_async_authenticate(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (api_settings.ACCESS_HEADER_PREFIX, access_key.key))
+        self.assertEqual(async_to_sync(AsyncJKAuthentication().authenticate)(request), (self.valid_user, access_key))
+
+
+class ScopedView(APIView):
+    authentication_classes = (AuthKeyAuthentication, AccessKeyAuthentication)
+    permission_classes = (HasKeyScope,)
+    required_scopes = {'GET': ('read',), 'POST': ('read', 'write')}
+
+    def get(self, request):
+        return Response()
+
+    def post(self, request):
+        return Response()
+
+
+class ScopeTestCase(BaseTestCase):
+    """
+    Test access key scope case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        api_settings.ACCESS_KEY_SCOPES = {'read': 0, 'write': 1}
+        scope_registry.clear()
+        access_key_cache.clear()
+        cache.clear()
+
+    def tearDown(self):
+        api_settings.ACCESS_KEY_SCOPES = api_settings.defaults['ACCESS_KEY_SCOPES']
+        scope_registry.clear()
+
+    def request(self, method, access_key):
+        header = '%s %s' % (api_settings.ACCESS_HEADER_PREFIX, access_key.key)
+        return ScopedView.as_view()(getattr(factory, method)('/', HTTP_AUTHORIZATION=header))
+
+    def test_registry(self):
+        self.assertEqual(scope_registry.get_mask(['read', 'write']), 3)
+        self.assertEqual(scope_registry.get_names(2), ['write'])
+
+        with self.assertRaises(KeyError):
+            scope_registry.get_mask(['admin'])
+
+        scope_registry.register('admin', 62)
+        self.assertEqual(scope_registry.get_names(-1 & ~1), ['write', 'admin'])
+
+        with self.assertRaises(ImproperlyConfigured):
+            scope_registry.register('delete', 1)
+
+        with self.assertRaises(ImproperlyConfigured):
+            scope_registry.register('delete', 63)
+
+    def test_serializer(self):
+        view = views.AccessKeyViewSet.as_view({'post': 'create'})
+
+        # Valid case
+        valid_request = factory.post(reverse('access-list'), {'scopes': ['read']}, format='json')
+        valid_request.user = self.valid_user
+        valid_response = view(valid_request)
+        self.assertEqual(valid_response.status_code, HTTP_201_CREATED)
+        self.assertEqual(valid_response.data.get('scopes'), ['read'])
+        self.assertEqual(models.AccessKey.objects.get(pk=valid_response.data.get('id')).scopes, 1)
+
+        # Invalid case
+        invalid_request = factory.post(reverse('access-list'), {'scopes': ['admin']}, format='json')
+        invalid_request.user = self.valid_user
+        invalid_response = view(invalid_request)
+        self.assertEqual(invalid_response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(invalid_response.data.keys(), {'scopes'})
+
+    def test_permission(self):
+        read_key = models.AccessKey.objects.create(owner=self.valid_user, scopes=1)
+        write_key = models.AccessKey.objects.create(owner=self.valid_user, scopes=3)
+
+        self.assertEqual(self.request('get', read_key).status_code, HTTP_200_OK)
+        self.assertEqual(self.request('post', read_key).status_code, HTTP_403_FORBIDDEN)
+        self.assertEqual(self.request('post', write_key).status_code, HTTP_200_OK)
+
+        # The scopes of the cached key are checked without queries.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.request('post', write_key).status_code, HTTP_200_OK)
+            self.assertEqual(self.request('post', read_key).status_code, HTTP_403_FORBIDDEN)
+
+        # Authentication keys are left to the other permission classes.
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        header = '%s %s' % (api_settings.AUTH_HEADER_PREFIX, auth_key.key)
+        response = ScopedView.as_view()(factory.post('/', HTTP_AUTHORIZATION=header))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+
+@skipUnless('replica' in settings.DATABASES, 'The replica routing requires the "replica" database.')
+@override_settings(DATABASE_ROUTERS=['rest_framework_jk.routers.ReplicaRouter'])
+class ReplicaTestCase(BaseTestCase):
+    """
+    Test read replica routing case.
+    The replica is a separate database, so the writes to the primary database are never replicated.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+        api_settings.REPLICA_DATABASE_ALIAS = 'replica'
+        self.replica_user = UserModel.objects.db_manager('replica').create_user(**self.valid_credentials)
+
+    def tearDown(self):
+        api_settings.REPLICA_DATABASE_ALIAS = api_settings.defaults['REPLICA_DATABASE_ALIAS']
+
+    def forget(self):
+        # The replication lag window and the cached keys have passed.
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+
+    def test_recent_key(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+        # The new key is read from the primary database.
+        self.assertEqual(compat.verify_access_key(access_key.key), access_key)
+        self.assertEqual(recent_keys.get_database(models.AccessKey, access_key.key), 'default')
+
+        # The key is read from the replica, which does not have it.
+        self.forget()
+        self.assertEqual(recent_keys.get_database(models.AccessKey, access_key.key), 'replica')
+        self.assertIsNone(compat.verify_access_key(access_key.key))
+
+    def test_replica_key(self):
+        access_key = models.AccessKey.objects.using('replica').create(owner=self.replica_user)
+        auth_key = models.AuthKey.objects.using('replica').create(owner=self.replica_user)
+        refresh_key = models.RefreshKey.objects.using('replica').create(owner=self.replica_user)
+        self.forget()
+
+        verified_keys = (
+            compat.verify_access_key(access_key.key),
+            compat.verify_auth_key(auth_key.key),
+            compat.verify_refresh_key(refresh_key.key),
+        )
+
+        for verified_key in verified_keys:
+            self.assertEqual(verified_key._state.db, 'replica')
+
+        # The other reads and the writes are not routed to the replica.
+        self.assertFalse(models.AccessKey.objects.filter(key=access_key.key).exists())
+        self.assertEqual(ReplicaRouter().db_for_write(models.AccessKey, instance=verified_keys[0]), 'default')
+
+    @skipUnless(adrf and django.VERSION >= (4, 2), 'The async views require Django 4.2+ and adrf.')
+    def test_async_replica_key(self):
+        access_key = models.AccessKey.objects.using('replica').create(owner=self.replica_user)
+        self.forget()
+        self.assertEqual(async_to_sync(compat.averify_access_key)(access_key.key)._state.db, 'replica')
+
+    def test_refreshed_keys(self):
+        response = self.client.post(reverse('auth-list'), self.get_valid_user_pass())
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.forget()
+
+        # The refreshed keys are read from the primary database.
+        response = self.client.put(reverse('auth-refresh'), response.data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(compat.verify_auth_key(response.data['auth_key']).owner, self.valid_user)
+        self.assertEqual(compat.verify_refresh_key(response.data['refresh_key']).owner, self.valid_user)
+
+    def test_disabled(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.forget()
+        api_settings.REPLICA_DATABASE_ALIAS = None
+
+        self.assertIsNone(recent_keys.get_database(models.AccessKey, access_key.key))
+        self.assertEqual(compat.verify_access_key(access_key.key), access_key)
+
+
+class KeyStoreTests:
+    """
+    Test cases of the stores that keep the keys outside of the database.
+    """
+    store_class = None
+
+    def setUp(self):
+        super().setUp()
+        owner_cache.clear()
+        cache.clear()
+        api_settings.KEY_STORE = self.store_class
+        self.store = get_key_store()
+
+    def tearDown(self):
+        # Import the store class of the settings again.
+        del api_settings.KEY_STORE
+
+    def get_view(self, viewset, actions):
+        return viewset.as_view(actions, authentication_classes=(AuthKeyAuthentication, AccessKeyAuthentication))
+
+    def test_access_keys(self):
+        access_key = self.store.issue(models.AccessKey, self.valid_user, name='name')
+        self.assertEqual(self.store.verify(models.AccessKey, access_key.key).owner, self.valid_user)
+        self.assertEqual(self.store.verify(models.AccessKey, access_key.key.hex).name, 'name')
+
+        # Rotate case
+        loaded_key = access_key.key
+        self.store.rotate(access_key)
+        self.assertIsNone(self.store.verify(models.AccessKey, loaded_key))
+        self.assertEqual(self.store.verify(models.AccessKey, access_key.key).pk, access_key.pk)
+
+        # Update case
+        self.store.update(access_key, name='other')
+        self.assertEqual(self.store.get(models.AccessKey, self.valid_user, str(access_key.pk)).name, 'other')
+
+        # List case
+        other_key = self.store.issue(models.AccessKey, self.valid_user)
+        other_user = UserModel.objects.create_user('other')
+        self.store.issue(models.AccessKey, other_user)
+        self.assertEqual([key.pk for key in self.store.list_by_owner(models.AccessKey, self.valid_user)],
+                         [access_key.pk, other_key.pk])
+
+        # Revoke case
+        self.store.revoke(access_key)
+        self.assertIsNone(self.store.verify(models.AccessKey, access_key.key))
+        self.assertIsNone(self.store.get(models.AccessKey, self.valid_user, access_key.pk))
+
+        # The keys are never written to the database.
+        self.assertFalse(models.AccessKey.objects.exists())
+
+    def test_auth_keys(self):
+        auth_key, refresh_key = self.store.obtain(self.valid_user)
+        self.assertEqual(self.store.verify(models.AuthKey, auth_key.key).owner, self.valid_user)
+        self.assertEqual(self.store.verify(models.RefreshKey, refresh_key.key).owner, self.valid_user)
+
+        # The keys are kept by the next obtain.
+        self.assertEqual(tuple(key.key for key in self.store.obtain(self.valid_user)), (auth_key.key, refresh_key.key))
+
+        # The keys of the other owner are not refreshed.
+        other_user = UserModel.objects.create_user('other')
+        other_auth_key, other_refresh_key = self.store.obtain(other_user)
+        self.assertIsNone(self.store.refresh(auth_key.key, other_refresh_key.key))
+
+        new_auth_key, new_refresh_key = self.store.refresh(auth_key.key, refresh_key.key)
+        self.assertIsNone(self.store.verify(models.AuthKey, auth_key.key))
+        self.assertIsNone(self.store.verify(models.RefreshKey, refresh_key.key))
+        self.assertEqual(self.store.verify(models.AuthKey, new_auth_key.key).owner, self.valid_user)
+        self.assertIsNone(self.store.refresh(auth_key.key, refresh_key.key))
+        self.assertFalse(models.AuthKey.objects.exists())
+
+    def test_remove_once(self):
+        auth_key, refresh_key = self.store.obtain(self.valid_user)
+
+        # Only one of the concurrent refreshes of the same keys removes the refresh key.
+        self.assertTrue(self.store.remove(models.RefreshKey, refresh_key.key.hex))
+        self.assertFalse(self.store.remove(models.RefreshKey, refresh_key.key.hex))
+
+    def test_concurrent_issues(self):
+        barrier, access_keys, get_owner_keys = Barrier(10), [], self.store.get_owner_keys
+
+        def slow_get_owner_keys(*args):
+            # The other issues run between the read of the list and its write.
+            keys = get_owner_keys(*args)
+            sleep(0.01)
+            return keys
+
+        def issue():
+            barrier.wait()
+            access_keys.append(self.store.issue(models.AccessKey, self.valid_user))
+
+        threads = [Thread(target=issue) for i in range(10)]
+
+        with patch.object(self.store, 'get_owner_keys', slow_get_owner_keys):
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        # No concurrent issue drops the key of another from the list of the owner.
+        self.assertEqual([key.pk for key in self.store.list_by_owner(models.AccessKey, self.valid_user)],
+                         sorted(access_key.pk for access_key in access_keys))
+
+    def test_find_many(self):
+        access_keys = [self.store.issue(models.AccessKey, self.valid_user) for i in range(2)]
+        keys = [access_key.key.hex for access_key in access_keys] + [uuid4().hex]
+        found = self.store.find_many(models.AccessKey, keys)
+        self.assertEqual({key: instance.pk for key, instance in found.items()},
+                         {access_key.key.hex: access_key.pk for access_key in access_keys})
+        self.assertEqual(found[keys[0]].owner, self.valid_user)
+
+    def test_expired_key(self):
+        auth_key, refresh_key = self.store.obtain(self.valid_user)
+        api_settings.AUTH_EXPIRATION_DELTA = timedelta(0)
+
+        try:
+            self.assertIsNone(self.store.verify(models.AuthKey, auth_key.key))
+            # The expired authentication key can still be refreshed.
+            self.assertIsNotNone(self.store.refresh(auth_key.key, refresh_key.key))
+        finally:
+            api_settings.AUTH_EXPIRATION_DELTA = api_settings.defaults['AUTH_EXPIRATION_DELTA']
+
+    def test_endpoints(self):
+        obtain_view = views.AuthKeyViewSet.as_view({'post': 'create'})
+        response = obtain_view(factory.post(reverse('auth-list'), self.get_valid_user_pass()))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        header = {'HTTP_AUTHORIZATION': '%s %s' % (api_settings.AUTH_HEADER_PREFIX, response.data['auth_key'])}
+
+        view = self.get_view(views.AccessKeyViewSet, {'get': 'list', 'post': 'create'})
+        response = view(factory.post(reverse('access-list'), {'name': 'name'}, **header))
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        pk = response.data['id']
+
+        # The access key authenticates.
+        access_header = {'HTTP_AUTHORIZATION': '%s %s' % (api_settings.ACCESS_HEADER_PREFIX, response.data['key'])}
+        response = view(factory.get(reverse('access-list'), **access_header))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual([(data['id'], data['name']) for data in response.data['results']], [(pk, 'name')])
+
+        view = self.get_view(views.AccessKeyViewSet, {'patch': 'partial_update', 'delete': 'destroy'})
+        response = view(factory.patch(reverse('access-detail', kwargs={'pk': pk}), {'name': 'other'}, **header), pk=pk)
+        self.assertEqual(response.data['name'], 'other')
+        response = view(factory.delete(reverse('access-detail', kwargs={'pk': pk}), **header), pk=pk)
+        self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
+        response = view(factory.delete(reverse('access-detail', kwargs={'pk': pk}), **header), pk=pk)
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+        view = self.get_view(views.AccessKeyViewSet, {'post': 'bulk_create', 'delete': 'bulk_destroy'})
+        response = view(factory.post(reverse('access-bulk'), {'names': ['a', 'b']}, format='json', **header))
+        self.assertEqual([data['name'] for data in response.data], ['a', 'b'])
+        ids = [data['id'] for data in response.data]
+
+        # The keys are paginated by ID in both directions.
+        list_view = self.get_view(views.AccessKeyViewSet, {'get': 'list'})
+        response = list_view(factory.get(reverse('access-list') + '?page_size=1', **header))
+        self.assertEqual([data['id'] for data in response.data['results']], ids[:1])
+        response = list_view(factory.get(response.data['next'], **header))
+        self.assertEqual([data['id'] for data in response.data['results']], ids[1:])
+        response = list_view(factory.get(response.data['previous'], **header))
+        self.assertEqual([data['id'] for data in response.data['results']], ids[:1])
+
+        response = view(factory.delete(reverse('access-bulk'), {'ids': ids + [0]}, format='json', **header))
+        self.assertEqual(response.data, {'ids': ids})
+        self.assertFalse(models.AccessKey.objects.exists())
+
+    def test_generation(self):
+        api_settings.KEY_GENERATIONS = True
+
+        try:
+            auth_key, refresh_key = self.store.obtain(self.valid_user)
+            access_key = self.store.issue(models.AccessKey, self.valid_user)
+            key_generations.bump(self.valid_user.pk)
+
+            self.assertIsNone(self.store.verify(models.AuthKey, auth_key.key))
+            self.assertIsNone(self.store.verify(models.AccessKey, access_key.key))
+            self.assertIsNone(self.store.refresh(auth_key.key, refresh_key.key))
+
+            # The next obtain moves the keys to the current generation.
+            auth_key, refresh_key = self.store.obtain(self.valid_user)
+            self.assertEqual(self.store.verify(models.AuthKey, auth_key.key).owner, self.valid_user)
+        finally:
+            api_settings.KEY_GENERATIONS = api_settings.defaults['KEY_GENERATIONS']
+
+
+class CacheKeyStoreTestCase(KeyStoreTests, BaseTestCase):
+    """
+    Test Django cache key store case.
+    """
+    store_class = CacheKeyStore
+
+
+class FakeRedisKeyStore(RedisKeyStore):
+
+    def __init__(self):
+        super().__init__(client=fakeredis.FakeRedis())
+
+
+@skipUnless(fakeredis, 'The Redis key store tests require fakeredis.')
+class RedisKeyStoreTestCase(KeyStoreTests, BaseTestCase):
+    """
+    Test Redis key store case.
+    """
+    store_class = FakeRedisKeyStore
+
+    def setUp(self):
+        super().setUp()
+        self.store.client.flushall()
+
+
+@skipUnless(adrf and django.VERSION >= (4, 2), 'The async views require Django 4.2+ and adrf.')
+class AsyncTestCase(BaseTestCase):
+    """
+    Test asynchronous authentication case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+
+    async def test_async_verify(self):
+        auth_key = await models.AuthKey.objects.acreate(owner=self.valid_user)
+        access_key = await models.AccessKey.objects.acreate(owner=self.valid_user)
+        refresh_key = await models.RefreshKey.objects.acreate(owner=self.valid_user)
+
+        self.assertEqual(await compat.averify_auth_key(auth_key.key), auth_key)
+        self.assertEqual(await compat.averify_access_key(access_key.key), access_key)
+        self.assertEqual(await compat.averify_refresh_key(refresh_key.key), refresh_key)
+        self.assertIsNone(await compat.averify_auth_key(uuid4()))
+        self.assertIsNone(await compat.averify_access_key(uuid4()))
+        self.assertIsNone(await compat.averify_refresh_key(uuid4()))
+
+    async def test_async_authentication(self):
+        auth_key = await models.AuthKey.objects.acreate(owner=self.valid_user)
+        access_key = await models.AccessKey.objects.acreate(owner=self.valid_user)
+
+        cases = (
+            (AsyncAuthKeyAuthentication(), api_settings.AUTH_HEADER_PREFIX, auth_key.key),
+            (AsyncAccessKeyAuthentication(), api_settings.ACCESS_HEADER_PREFIX, access_key.key),
+        )
+
+        for authentication, prefix, key in cases:
+            # Valid case
+            request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (prefix, key))
+            user, verified_key = await authentication.authenticate(request)
+            self.assertEqual(user, self.valid_user)
+            self.assertEqual(verified_key.key, key)
+
+            # Invalid case
+            request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (prefix, uuid4()))
+
+            with self.assertRaises(AuthenticationFailed):
+                await authentication.authenticate(request)
+
+    def test_async_validation(self):
+        class FailingSerializer(serializers.RefreshAuthKeySerializer):
+            async def avalidate(self, attrs):
+                raise ValidationError('Invalid keys.')
+
+        data = {'auth_key': 'invalid'}
+        serializer, async_serializer = serializers.RefreshAuthKeySerializer(data=data), FailingSerializer(data=data)
+        serializer.is_valid()
+
+        # The field errors are the same as the ones of is_valid.
+        self.assertFalse(async_to_sync(async_serializer.ais_valid)())
+        self.assertEqual(async_serializer.errors, serializer.errors)
+
+        data = {'auth_key': uuid4().hex, 'refresh_key': uuid4().hex}
+        async_serializer = FailingSerializer(data=data)
+        self.assertFalse(async_to_sync(async_serializer.ais_valid)())
+        self.assertEqual(async_serializer.errors, {'non_field_errors': ['Invalid keys.']})
+
+    def test_async_auth_obtain_and_refresh(self):
+        from rest_framework_jk import async_views
+
+        view = async_views.AsyncAuthKeyViewSet.as_view({'post': 'acreate'})
+
+        # Valid case
+        valid_response = async_to_sync(view)(factory.post(reverse('auth-list'), self.get_valid_user_pass()))
+        self.assertEqual(valid_response.status_code, HTTP_200_OK)
+        self.assertEqual(valid_response.data.keys(), {'auth_key', 'refresh_key'})
+
+        # Invalid case
+        invalid_response = async_to_sync(view)(factory.post(reverse('auth-list'), self.get_invalid_user_pass()))
+        self.assertEqual(invalid_response.status_code, HTTP_403_FORBIDDEN)
+
+        view = async_views.AsyncAuthKeyViewSet.as_view({'put': 'arefresh'})
+        data = Dict(**valid_response.data)
+
+        # Valid case
+        refresh_response = async_to_sync(view)(factory.put(reverse('auth-refresh'), data))
+        self.assertEqual(refresh_response.status_code, HTTP_200_OK)
+        self.assertNotEqual(refresh_response.data.get('auth_key'), data.get('auth_key'))
+        self.assertIsNone(compat.verify_auth_key(data.get('auth_key')))
+
+        # Invalid case
+        invalid_response = async_to_sync(view)(factory.put(reverse('auth-refresh'), data))
+        self.assertEqual(invalid_response.status_code, HTTP_403_FORBIDDEN)
+
+
+class SignedKeyTestCase(BaseTestCase):
+    """
+    Test signed authentication key case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        api_settings.SIGNED_AUTH_KEYS = True
+        auth_key_cache.clear()
+        owner_cache.clear()
+        revocation_list.clear()
+        cache.clear()
+
+    def tearDown(self):
+        # Restore signed mode to default
+        api_settings.SIGNED_AUTH_KEYS = api_settings.defaults['SIGNED_AUTH_KEYS']
+        revocation_list.clear()
+
+    def authenticate(self, key):
+        request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (api_settings.AUTH_HEADER_PREFIX, key))
+
+        try:
+            return AuthKeyAuthentication().authenticate(request) is not None
+        except AuthenticationFailed:
+            return False
+
+    def obtain(self):
+        view = views.AuthKeyViewSet.as_view({'post': 'create'})
+        response = view(factory.post(reverse('auth-list'), self.get_valid_user_pass()))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return Dict(**response.data)
+
+    def test_signed_auth_obtain(self):
+        data = self.obtain()
+        self.assertTrue(is_signed_key(data.get('auth_key')))
+        self.assertTrue(self.authenticate(data.get('auth_key')))
+
+        # The keys are verified without a query once the revocation list and the owner are loaded.
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate(data.get('auth_key')))
+
+        # UUID keys keep working side by side.
+        auth_key = models.AuthKey.objects.get(owner=self.valid_user)
+        self.assertTrue(self.authenticate(auth_key.key))
+
+    def test_signed_auth_refresh(self):
+        data = self.obtain()
+        view = views.AuthKeyViewSet.as_view({'put': 'refresh', 'patch': 'refresh'})
+        response = view(factory.patch(reverse('auth-refresh'), data.fkeys({'auth_key', 'refresh_key'})))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertTrue(self.authenticate(response.data.get('auth_key')))
+        self.assertFalse(self.authenticate(data.get('auth_key')))
+
+        # The other processes load the revoked key from the database.
+        revocation_list.clear()
+        self.assertFalse(self.authenticate(data.get('auth_key')))
+
+    def test_signed_auth_key_tampered(self):
+        data = self.obtain()
+        key, owner_id, expires_at, signature = data.get('auth_key').split('.')
+
+        self.assertFalse(self.authenticate('.'.join((key, str(self.valid_user.pk + 1), expires_at, signature))))
+        self.assertFalse(self.authenticate('.'.join((key, owner_id, str(int(expires_at) + 1), signature))))
+        self.assertFalse(self.authenticate('.'.join((key, owner_id, expires_at, signature[::-1]))))
+
+    def test_signed_auth_key_expired(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        self.assertFalse(self.authenticate(sign_key(auth_key.key, self.valid_user.pk, time() - 1)))
+
+    def test_signed_auth_key_disabled_owner(self):
+        data = self.obtain()
+        self.assertTrue(self.authenticate(data.get('auth_key')))
+
+        self.valid_user.is_active = False
+        self.valid_user.save()
+        self.assertFalse(self.authenticate(data.get('auth_key')))
+
+
+class UsageTestCase(BaseTestCase):
+    """
+    Test write-behind key usage case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        usage_buffer.clear()
+        cache.clear()
+
+    def tearDown(self):
+        # Restore sliding expiration to default
+        api_settings.AUTH_SLIDING_EXPIRATION = api_settings.defaults['AUTH_SLIDING_EXPIRATION']
+        usage_buffer.clear()
+
+    def test_access_key_last_used_at(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+
+        # The usages are coalesced into one write per key.
+        for i in range(3):
+            AccessKeyAuthentication().authenticate_credentials(access_key.key)
+
+        self.assertEqual(len(usage_buffer.pending), 1)
+        access_key.refresh_from_db()
+        self.assertIsNone(access_key.last_used_at)
+
+        with self.assertNumQueries(1):
+            usage_buffer.flush()
+
+        access_key.refresh_from_db()
+        self.assertIsNotNone(access_key.last_used_at)
+
+        # The key is not written again within the interval.
+        AccessKeyAuthentication().authenticate_credentials(access_key.key)
+        self.assertFalse(usage_buffer.flush_due())
+
+    def test_access_key_last_used_at_batch(self):
+        access_keys = [models.AccessKey.objects.create(owner=self.valid_user) for i in range(5)]
+
+        for access_key in access_keys:
+            AccessKeyAuthentication().authenticate_credentials(access_key.key)
+
+        with self.assertNumQueries(1):
+            usage_buffer.flush()
+
+        self.assertFalse(models.AccessKey.objects.filter(last_used_at__isnull=True).exists())
+
+    def test_auth_sliding_expiration(self):
+        api_settings.AUTH_SLIDING_EXPIRATION = True
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        updated_at = now() - api_settings.AUTH_EXPIRATION_DELTA + timedelta(minutes=1)
+        models.AuthKey.objects.filter(pk=auth_key.pk).update(updated_at=updated_at)
+
+        AuthKeyAuthentication().authenticate_credentials(auth_key.key)
+        usage_buffer.flush()
+
+        auth_key.refresh_from_db()
+        self.assertGreater(auth_key.updated_at, updated_at + timedelta(minutes=1))
+
+    def test_flush_on_request_finished(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        AccessKeyAuthentication().authenticate_credentials(access_key.key)
+        usage_buffer.flushed_at -= api_settings.USAGE_FLUSH_INTERVAL.total_seconds()
+
+        request_finished.send(sender=self.__class__)
+        access_key.refresh_from_db()
+        self.assertIsNotNone(access_key.last_used_at)
+
+
+class PurgeExpiredTestCase(BaseTestCase):
+    """
+    Test expired key purge command case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.users = [UserModel.objects.create_user('user-%d' % i) for i in range(5)]
+        lapsed = now() - api_settings.REFRESH_EXPIRATION_DELTA - timedelta(minutes=1)
+
+        for user in self.users:
+            models.AuthKey.objects.create(owner=user)
+            models.RefreshKey.objects.create(owner=user)
+
+        # The first three users have lapsed keys.
+        lapsed_users = self.users[:3]
+        models.AuthKey.objects.filter(owner__in=lapsed_users).update(updated_at=lapsed)
+        models.RefreshKey.objects.filter(owner__in=lapsed_users).update(updated_at=lapsed)
+
+    def test_purge_dry_run(self):
+        out = StringIO()
+        call_command('jk_purge_expired', dry_run=True, stdout=out)
+        self.assertIn('jk_auth_keys: 3 expired keys would be deleted.', out.getvalue())
+        self.assertIn('jk_refresh_keys: 3 expired keys would be deleted.', out.getvalue())
+        self.assertEqual(models.AuthKey.objects.count(), 5)
+
+    def test_purge(self):
+        # The purged keys are invalidated in the key cache.
+        auth_key = models.AuthKey.objects.get(owner=self.users[0])
+        auth_key_cache.set(auth_key, now().timestamp() + 60)
+
+        out = StringIO()
+        call_command('jk_purge_expired', batch_size=2, stdout=out)
+        self.assertIsNone(auth_key_cache.get(auth_key.key))
+        self.assertIn('jk_auth_keys: 3 expired keys were deleted.', out.getvalue())
+        self.assertIn('jk_refresh_keys: 3 expired keys were deleted.', out.getvalue())
+        self.assertEqual(set(models.AuthKey.objects.values_list('owner', flat=True)), {u.pk for u in self.users[3:]})
+        self.assertEqual(set(models.RefreshKey.objects.values_list('owner', flat=True)), {u.pk for u in self.users[3:]})
+
+    def test_purge_keeps_refreshable_auth_key(self):
+        # The authentication key has lapsed, but it can still be refreshed.
+        lapsed = now() - api_settings.AUTH_EXPIRATION_DELTA - timedelta(minutes=1)
+        models.AuthKey.objects.filter(owner=self.users[3]).update(updated_at=lapsed)
+
+        call_command('jk_purge_expired', stdout=StringIO())
+        self.assertTrue(models.AuthKey.objects.filter(owner=self.users[3]).exists())
+
+
+class KeyGenerationTestCase(BaseTestCase):
+    """
+    Test owner key generation case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        api_settings.KEY_GENERATIONS = True
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        key_generations.clear()
+        cache.clear()
+
+    def tearDown(self):
+        api_settings.KEY_GENERATIONS = api_settings.defaults['KEY_GENERATIONS']
+
+    def obtain(self):
+        view = views.AuthKeyViewSet.as_view({'post': 'create'})
+        return Dict(**view(factory.post(reverse('auth-list'), self.get_valid_user_pass())).data)
+
+    def authenticate(self, authentication, key):
+        try:
+            authentication.authenticate_credentials(key)
+        except AuthenticationFailed:
+            return False
+
+        return True
+
+    def test_bump(self):
+        data = self.obtain()
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), data['auth_key']))
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        # The generation is read from the Django cache.
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate(AuthKeyAuthentication(), data['auth_key']))
+            self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        self.assertEqual(key_generations.bump(self.valid_user.pk), 1)
+
+        # The cached keys of every process are revoked, and the rows are kept.
+        self.assertFalse(self.authenticate(AuthKeyAuthentication(), data['auth_key']))
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), access_key.key))
+        self.assertTrue(models.AccessKey.objects.filter(pk=access_key.pk).exists())
+
+        # The generation is persisted when the cache has lost it.
+        cache.clear()
+        self.assertEqual(key_generations.get(self.valid_user.pk), 1)
+        self.assertFalse(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+    def test_new_keys(self):
+        data = self.obtain()
+        key_generations.bump(self.valid_user.pk)
+
+        # Invalid case
+        view = views.AuthKeyViewSet.as_view({'put': 'refresh', 'patch': 'refresh'})
+        response = view(factory.patch(reverse('auth-refresh'), data.fkeys({'auth_key', 'refresh_key'})))
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
+
+        # Valid case
+        data = self.obtain()
+        self.assertTrue(self.authenticate(AuthKeyAuthentication(), data['auth_key']))
+        response = view(factory.patch(reverse('auth-refresh'), data.fkeys({'auth_key', 'refresh_key'})))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.assertEqual(access_key.generation, 1)
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+    def test_purge(self):
+        other_user = UserModel.objects.create_user('other')
+        models.AccessKey.objects.create(owner=self.valid_user)
+        kept_key = models.AccessKey.objects.create(owner=other_user)
+        key_generations.bump(self.valid_user.pk)
+        models.AccessKey.objects.create(owner=self.valid_user)
+
+        out = StringIO()
+        call_command('jk_purge_expired', stdout=out)
+        self.assertIn('jk_access_keys: 1 revoked keys were deleted.', out.getvalue())
+        self.assertEqual(models.AccessKey.objects.filter(owner=self.valid_user, generation=1).count(), 1)
+        self.assertTrue(models.AccessKey.objects.filter(pk=kept_key.pk).exists())
+
+    def test_disabled(self):
+        key_generations.bump(self.valid_user.pk)
+        api_settings.KEY_GENERATIONS = False
+
+        with self.assertRaises(ImproperlyConfigured):
+            key_generations.bump(self.valid_user.pk)
+
+        # The keys issued without KEY_GENERATIONS are valid, and not purged as revoked.
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        self.assertEqual(access_key.generation, 0)
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+        out = StringIO()
+        call_command('jk_purge_expired', stdout=out)
+        self.assertNotIn('revoked', out.getvalue())
+        self.assertTrue(self.authenticate(AccessKeyAuthentication(), access_key.key))
+
+
+class SnapshotTestCase(BaseTestCase):
+    """
+    Test access key snapshot case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'keys.snapshot')
+        api_settings.SNAPSHOT_PATH = self.path
+        api_settings.SNAPSHOT_CHECK_INTERVAL = timedelta(0)
+        access_key_snapshot.clear()
+
+    def tearDown(self):
+        api_settings.SNAPSHOT_PATH = api_settings.defaults['SNAPSHOT_PATH']
+        api_settings.SNAPSHOT_CHECK_INTERVAL = api_settings.defaults['SNAPSHOT_CHECK_INTERVAL']
+        access_key_snapshot.clear()
+
+    def authenticate(self, key):
+        try:
+            return SnapshotAccessKeyAuthentication().authenticate_credentials(key)
+        except AuthenticationFailed:
+            return None
+
+    def test_export(self):
+        access_keys = [models.AccessKey.objects.create(owner=self.valid_user, scopes=i) for i in range(20)]
+        disabled_user = UserModel.objects.create_user('disabled', is_active=False)
+        disabled_key = models.AccessKey.objects.create(owner=disabled_user)
+
+        out = StringIO()
+        call_command('jk_export_snapshot', stdout=out)
+        self.assertIn('20 keys were exported.', out.getvalue())
+
+        # The keys are verified without the database.
+        with self.assertNumQueries(0):
+            for access_key in access_keys:
+                user, auth = self.authenticate(access_key.key.hex)
+                self.assertEqual(user.pk, self.valid_user.pk)
+                self.assertEqual(auth.scopes, access_key.scopes)
+
+            self.assertIsNone(self.authenticate(disabled_key.key))
+            self.assertIsNone(self.authenticate(uuid4()))
+
+        # The other fields of the owner are loaded on access.
+        user, auth = self.authenticate(access_keys[0].key)
+        self.assertEqual(user.username, self.valid_user.username)
+
+    def test_reload(self):
+        access_key = models.AccessKey.objects.create(owner=self.valid_user)
+        with self.assertLogs('rest_framework_jk.snapshot', 'WARNING') as logs:
+            self.assertIsNone(self.authenticate(access_key.key))
+        self.assertIn('The key snapshot was not loaded.', logs.output[0])
+
+        export_snapshot(self.path)
+        self.assertIsNotNone(self.authenticate(access_key.key))
+        snapshot = access_key_snapshot.snapshot
+
+        # The new snapshot is renamed into place.
+        access_key.delete()
+        export_snapshot(self.path)
+        self.assertIsNone(self.authenticate(access_key.key))
+        self.assertIsNot(access_key_snapshot.snapshot, snapshot)
+        self.assertEqual(access_key_snapshot.snapshot.count, 0)
+
+        # A broken file does not replace the loaded snapshot.
+        with open(self.path + '.tmp', 'wb') as file:
+            file.write(b'broken')
+
+        os.replace(self.path + '.tmp', self.path)
+        snapshot = access_key_snapshot.snapshot
+        with self.assertLogs('rest_framework_jk.snapshot', 'WARNING') as logs:
+            self.assertIsNone(self.authenticate(access_key.key))
+        self.assertIn('The key snapshot was not loaded.', logs.output[0])
+        self.assertIs(access_key_snapshot.snapshot, snapshot)
+
+
+class WarmCacheTestCase(BaseTestCase):
+    """
+    Test key cache warm-up case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+        self.users = [UserModel.objects.create_user('user-%d' % i) for i in range(3)]
+        self.access_keys = [models.AccessKey.objects.create(owner=user) for user in self.users]
+        self.auth_keys = [models.AuthKey.objects.create(owner=user) for user in self.users]
+
+        # The keys of the disabled owner are not cached.
+        self.users[2].is_active = False
+        self.users[2].save()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+
+    def tearDown(self):
+        api_settings.WARM_CACHE_ON_STARTUP = api_settings.defaults['WARM_CACHE_ON_STARTUP']
+
+    def test_warm_cache(self):
+        out = StringIO()
+        call_command('jk_warm_cache', batch_size=1, stdout=out)
+        self.assertIn('access: 2 keys were cached.', out.getvalue())
+        self.assertIn('auth: 2 keys were cached.', out.getvalue())
+
+        # The keys are verified without a query, also by the other processes.
+        auth_key_cache.local.clear()
+        access_key_cache.local.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(compat.verify_access_key(self.access_keys[0].key), self.access_keys[0])
+            self.assertEqual(compat.verify_auth_key(self.auth_keys[1].key), self.auth_keys[1])
+
+        self.assertIsNone(access_key_cache.get(self.access_keys[2].key))
+
+    def test_warm_cache_limits(self):
+        # The recently used access key is cached first.
+        models.AccessKey.objects.filter(pk=self.access_keys[1].pk).update(last_used_at=now())
+        self.assertEqual(compat.warm_key_caches(1), {'access': 1, 'auth': 0})
+        self.assertIsNotNone(access_key_cache.get(self.access_keys[1].key))
+        self.assertIsNone(access_key_cache.get(self.access_keys[0].key))
+
+        # No batch is cached after the time limit.
+        cache.clear()
+        access_key_cache.clear()
+        self.assertEqual(compat.warm_key_caches(10, time_limit=0, batch_size=1), {'access': 0, 'auth': 0})
+        self.assertIsNone(access_key_cache.get(self.access_keys[1].key))
+
+    def test_warm_cache_on_startup(self):
+        api_settings.WARM_CACHE_ON_STARTUP = True
+        apps.get_app_config('rest_framework_jk').ready()
+        self.assertIsNotNone(access_key_cache.get(self.access_keys[0].key))
+        self.assertIsNotNone(auth_key_cache.get(self.auth_keys[0].key))
+
+    def test_expired_auth_key(self):
+        models.AuthKey.objects.filter(pk=self.auth_keys[0].pk).update(expires_at=now() - timedelta(minutes=1))
+        self.assertEqual(compat.warm_key_caches(10), {'access': 2, 'auth': 1})
+        self.assertIsNone(auth_key_cache.get(self.auth_keys[0].key))
+
+
+class ExpiresAtTestCase(BaseTestCase):
+    """
+    Test stored expiration date case.
+    """
+
+    def test_expires_at_on_save(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        refresh_key = models.RefreshKey.objects.create(owner=self.valid_user)
+        self.assertAlmostEqual(auth_key.expires_at, auth_key.updated_at + api_settings.AUTH_EXPIRATION_DELTA,
+                               delta=timedelta(seconds=1))
+        self.assertAlmostEqual(refresh_key.expires_at, refresh_key.updated_at + api_settings.REFRESH_EXPIRATION_DELTA,
+                               delta=timedelta(seconds=1))
+
+        # Saving with the update fields also renews the expiration date.
+        expires_at = auth_key.expires_at
+        auth_key.key = auth_key.generate_key
+        auth_key.save(update_fields=['key', 'updated_at'])
+        auth_key.refresh_from_db()
+        self.assertGreater(auth_key.expires_at, expires_at)
+
+    def test_lapsed_expires_at(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        refresh_key = models.RefreshKey.objects.create(owner=self.valid_user)
+        models.AuthKey.objects.update(expires_at=now() - timedelta(seconds=1))
+        models.RefreshKey.objects.update(expires_at=now() - timedelta(seconds=1))
+
+        self.assertIsNone(compat.verify_auth_key(auth_key.key))
+        self.assertIsNone(compat.verify_refresh_key(refresh_key.key))
+        self.assertIsNotNone(compat.verify_auth_key(auth_key.key, precise=False))
+
+    def test_backfill_expires_at(self):
+        migration = import_module('rest_framework_jk.migrations.0008_backfill_expires_at')
+        users = [UserModel.objects.create_user('user-%d' % i) for i in range(3)]
+
+        for user in users:
+            models.AuthKey.objects.create(owner=user)
+            models.RefreshKey.objects.create(owner=user)
+
+        models.AuthKey.objects.update(expires_at=None)
+        models.RefreshKey.objects.update(expires_at=None)
+
+        # The backfill only needs the connection of the schema editor.
+        migration.backfill_expires_at(apps, SimpleNamespace(connection=connection))
+
+        for auth_key in models.AuthKey.objects.all():
+            self.assertEqual(auth_key.expires_at, auth_key.updated_at + api_settings.AUTH_EXPIRATION_DELTA)
+
+        for refresh_key in models.RefreshKey.objects.all():
+            self.assertEqual(refresh_key.expires_at, refresh_key.updated_at + api_settings.REFRESH_EXPIRATION_DELTA)
+
+
+class BulkAccessKeyTestCase(BaseTestCase):
+    """
+    Test bulk access key case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        access_key_cache.clear()
+        cache.clear()
+
+    def tearDown(self):
+        # Restore bulk max size to default
+        api_settings.BULK_MAX_SIZE = api_settings.defaults['BULK_MAX_SIZE']
+
+    def authenticate(self, key):
+        try:
+            AccessKeyAuthentication().authenticate_credentials(key)
+        except AuthenticationFailed:
+            return False
+
+        return True
+
+    def request(self, method, action, data, user=None):
+        url = reverse('access-bulk-refresh' if action == 'bulk_refresh' else 'access-bulk')
+        view = views.AccessKeyViewSet.as_view({method: action})
+        request = getattr(factory, method)(url, data, format='json')
+        request.user = user or self.valid_user
+        return view(request)
+
+    def test_bulk_create(self):
+        names = ['key-%d' % i for i in range(10)]
+
+        with self.assertNumQueries(2):
+            response = self.request('post', 'bulk_create', {'names': names})
+
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual([item.get('name') for item in response.data], names)
+        self.assertEqual(models.AccessKey.objects.filter(owner=self.valid_user).count(), 10)
+        self.assertTrue(all(self.authenticate(item.get('key')) for item in response.data))
+
+    def test_bulk_max_size(self):
+        api_settings.BULK_MAX_SIZE = 2
+
+        response = self.request('post', 'bulk_create', {'names': ['a', 'b', 'c']})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data.keys(), {'names'})
+
+        response = self.request('delete', 'bulk_destroy', {'ids': [1, 2, 3]})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+        response = self.request('post', 'bulk_create', {'names': []})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.AccessKey.objects.exists())
+
+    def test_bulk_destroy(self):
+        other_user = UserModel.objects.create_user('other')
+        access_keys = [models.AccessKey.objects.create(owner=self.valid_user) for i in range(3)]
+        other_key = models.AccessKey.objects.create(owner=other_user)
+        self.assertTrue(self.authenticate(access_keys[0].key))
+
+        ids = [access_keys[0].id, access_keys[1].id, other_key.id]
+        response = self.request('delete', 'bulk_destroy', {'ids': ids})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data, {'ids': [access_keys[0].id, access_keys[1].id]})
+
+        # The IDs are selected, then the keys are deleted by QuerySet.delete(), which loads them to send post_delete.
+        with self.assertNumQueries(3):
+            deleted = get_key_store().revoke_access_keys(self.valid_user, [access_keys[2].id])
+
+        self.assertEqual(deleted, [access_keys[2].id])
+
+        # The keys of the other users are not deleted, and the cached keys are invalidated.
+        self.assertEqual(set(models.AccessKey.objects.values_list('id', flat=True)), {other_key.id})
+        self.assertFalse(self.authenticate(access_keys[0].key))
+        self.assertIsNotNone(cache.get(make_tombstone('access', access_keys[0].key.hex)))
+
+    def test_bulk_refresh(self):
+        access_keys = [models.AccessKey.objects.create(owner=self.valid_user, name=str(i)) for i in range(3)]
+        self.assertTrue(self.authenticate(access_keys[0].key))
+
+        with self.assertNumQueries(4):
+            response = self.request('patch', 'bulk_refresh', {'ids': [access_key.id for access_key in access_keys]})
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual([item.get('id') for item in response.data], [access_key.id for access_key in access_keys])
+
+        for access_key, item in zip(access_keys, response.data):
+            self.assertNotEqual(str(access_key.key), item.get('key'))
+            self.assertFalse(self.authenticate(access_key.key))
+            self.assertTrue(self.authenticate(item.get('key')))
+
+
+class MetricsTestCase(BaseTestCase):
+    """
+    Test authentication metrics case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        access_key_cache.clear()
+        cache.clear()
+        metrics.clear()
+        api_settings.METRICS_ENABLED = True
+        self.samples = []
+        metrics.add_hook(self.hook)
+
+    def tearDown(self):
+        # Restore metrics to default
+        api_settings.METRICS_ENABLED = api_settings.defaults['METRICS_ENABLED']
+        metrics.hooks.remove(self.hook)
+        metrics.clear()
+
+    def hook(self, kind, name, value, labels):
+        self.samples.append((kind, name, labels))
+
+    def authenticate(self, header):
+        request = factory.get('/', HTTP_AUTHORIZATION=header)
+
+        try:
+            AuthKeyAuthentication().authenticate(request)
+        except AuthenticationFailed as exc:
+            return exc.get_codes()
+
+        return 'success'
+
+    def get_count(self, name, **labels):
+        return metrics.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def test_authentication_results(self):
+        prefix = api_settings.AUTH_HEADER_PREFIX
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+
+        self.assertEqual(self.authenticate('%s %s' % (prefix, auth_key.key)), 'success')
+        self.assertEqual(self.authenticate('%s %s' % (prefix, auth_key.key)), 'success')
+        self.assertEqual(self.authenticate(prefix), 'no_credentials')
+        self.assertEqual(self.authenticate('%s a b' % prefix), 'invalid_header')
+        self.assertEqual(self.authenticate('%s invalid' % prefix), 'invalid_key')
+        self.assertEqual(self.authenticate('%s %s' % (prefix, uuid4())), 'unknown_key')
+
+        self.valid_user.is_active = False
+        self.valid_user.save()
+        self.assertEqual(self.authenticate('%s %s' % (prefix, auth_key.key)), 'disabled_owner')
+
+        for result, count in (('success', 2), ('no_credentials', 1), ('invalid_header', 1), ('invalid_key', 1),
+                              ('unknown_key', 1), ('disabled_owner', 1)):
+            self.assertEqual(self.get_count('jk_authentication_total', scheme=prefix, result=result), count)
+
+        self.assertEqual(self.get_count('jk_key_lookups_total', key_type='auth', result='hit'), 2)
+        self.assertEqual(self.get_count('jk_key_lookups_total', key_type='auth', result='cache_hit'), 1)
+        self.assertEqual(self.get_count('jk_key_lookups_total', key_type='auth', result='miss'), 1)
+        self.assertIn(('histogram', 'jk_verify_seconds', {'key_type': 'auth'}), self.samples)
+
+    def test_expired_lookup(self):
+        refresh_key = models.RefreshKey.objects.create(owner=self.valid_user)
+        updated_at = now() - api_settings.REFRESH_EXPIRATION_DELTA - timedelta(seconds=1)
+        models.RefreshKey.objects.filter(pk=refresh_key.pk).update(updated_at=updated_at)
+
+        self.assertIsNone(compat.verify_refresh_key(refresh_key.key))
+        self.assertEqual(self.get_count('jk_key_lookups_total', key_type='refresh', result='expired'), 1)
+
+    def test_endpoint(self):
+        view = views.AuthKeyViewSet.as_view({'post': 'create'})
+        view(factory.post(reverse('auth-list'), self.get_valid_user_pass()))
+        view(factory.post(reverse('auth-list'), self.get_invalid_user_pass()))
+
+        self.assertEqual(self.get_count('jk_endpoint_requests_total', endpoint='obtain', status=200), 1)
+        self.assertEqual(self.get_count('jk_endpoint_requests_total', endpoint='obtain', status=403), 1)
+
+        text = metrics.render()
+        self.assertIn('# TYPE jk_endpoint_seconds histogram', text)
+        self.assertIn('jk_endpoint_requests_total{endpoint="obtain",status="200"} 1', text)
+        self.assertIn('jk_endpoint_seconds_bucket{endpoint="obtain",le="+Inf"} 2', text)
+        self.assertIn('jk_endpoint_seconds_count{endpoint="obtain"} 2', text)
+
+    def test_disabled(self):
+        api_settings.METRICS_ENABLED = False
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        self.authenticate('%s %s' % (api_settings.AUTH_HEADER_PREFIX, auth_key.key))
+
+        self.assertFalse(metrics.counters)
+        self.assertFalse(metrics.histograms)
+        self.assertFalse(self.samples)
+
+    def test_metrics_view(self):
+        view = views.MetricsView.as_view()
+        request = factory.get('/')
+        request.user = self.valid_user
+        self.assertEqual(view(request).status_code, HTTP_403_FORBIDDEN)
+
+        self.valid_user.is_staff = True
+        metrics.inc('jk_authentication_total', scheme='JK-Auth', result='success')
+        response = view(request)
+        response.render()
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'jk_authentication_total{result="success",scheme="JK-Auth"} 1', response.content)
+
+
+class ServerTimingTestCase(BaseTestCase):
+    """
+    Test Server-Timing middleware case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        cache.clear()
+
+    def get_metrics(self, response):
+        return dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+
+    def test_authentication(self):
+        auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+
+        def get_response(request):
+            user, key = AuthKeyAuthentication().authenticate(request)
+            return HttpResponse(user.username)
+
+        middleware = ServerTimingMiddleware(get_response)
+        request = factory.get('/', HTTP_AUTHORIZATION='%s %s' % (api_settings.AUTH_HEADER_PREFIX, auth_key.key))
+        response = middleware(request)
+        self.assertEqual(self.get_metrics(response).keys(), {'jk-parse', 'jk-lookup', 'jk-queries'})
+        self.assertEqual(self.get_metrics(response)['jk-queries'], 'desc="1"')
+
+        # The cached key is verified without a query.
+        response = middleware(request)
+        self.assertEqual(self.get_metrics(response)['jk-queries'], 'desc="0"')
+
+    def test_endpoint(self):
+        with self.modify_settings(MIDDLEWARE={'append': 'rest_framework_jk.middleware.ServerTimingMiddleware'}):
+            response = self.client.post(reverse('auth-list'), self.get_valid_user_pass())
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        timings = self.get_metrics(response)
+        self.assertTrue(timings['jk-obtain'].startswith('dur='))
+        self.assertNotEqual(timings['jk-queries'], 'desc="0"')
+
+    def test_disabled(self):
+        self.assertIsNone(current_timing.get())
+        response = self.client.post(reverse('auth-list'), self.get_valid_user_pass())
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class ObtainThrottleTestCase(BaseTestCase):
+    """
+    Test obtain throttle case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        obtain_throttle.clear()
+        cache.clear()
+        api_settings.OBTAIN_USERNAME_THROTTLE = '3/min'
+        api_settings.OBTAIN_IP_THROTTLE = '5/min'
+
+    def tearDown(self):
+        # Restore throttles to default
+        for name in ('OBTAIN_USERNAME_THROTTLE', 'OBTAIN_IP_THROTTLE', 'THROTTLE_CACHE_ALIAS'):
+            setattr(api_settings, name, api_settings.defaults[name])
+        obtain_throttle.clear()
+
+    def obtain(self, data, ip='127.0.0.1'):
+        view = views.AuthKeyViewSet.as_view({'post': 'create'})
+        return view(factory.post(reverse('auth-list'), data, REMOTE_ADDR=ip))
+
+    def test_username(self):
+        for i in range(3):
+            self.assertEqual(self.obtain(self.get_invalid_user_pass()).status_code, HTTP_403_FORBIDDEN)
+
+        # The throttled attempt does not hash the password.
+        with self.assertNumQueries(0):
+            response = self.obtain(self.get_invalid_user_pass(), ip='127.0.0.2')
+
+        self.assertEqual(response.status_code, HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # The other usernames have their own buckets.
+        self.assertEqual(self.obtain(self.get_valid_user_pass()).status_code, HTTP_200_OK)
+
+    def test_ip(self):
+        for i in range(5):
+            data = {'username': 'user-%d' % i, 'password': 'password'}
+            self.assertEqual(self.obtain(data).status_code, HTTP_403_FORBIDDEN)
+
+        self.assertEqual(self.obtain(self.get_valid_user_pass()).status_code, HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.obtain(self.get_valid_user_pass(), ip='127.0.0.2').status_code, HTTP_200_OK)
+
+    @patch('rest_framework_jk.throttling.time', return_value=6010)
+    def test_window(self, time):
+        api_settings.THROTTLE_CACHE_ALIAS = 'default'
+
+        for i in range(3):
+            self.assertEqual(obtain_throttle.check(None, self.valid_user.username), 0)
+
+        # The attempts are allowed again when the window of the minute ends.
+        self.assertEqual(obtain_throttle.check(None, self.valid_user.username), 50)
+        time.return_value = 6060
+        self.assertEqual(obtain_throttle.check(None, self.valid_user.username), 0)
+
+    @patch('rest_framework_jk.throttling.time', return_value=6010)
+    def test_concurrent(self, time):
+        for alias in (None, 'default'):
+            api_settings.THROTTLE_CACHE_ALIAS = alias
+            obtain_throttle.clear()
+            cache.clear()
+            barrier, waits = Barrier(10), []
+
+            def attempt():
+                barrier.wait()
+                waits.append(obtain_throttle.check(None, self.valid_user.username))
+
+            threads = [Thread(target=attempt) for i in range(10)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            # Only the attempts of the rate are allowed, however they interleave.
+            self.assertEqual(waits.count(0), 3)
+
+    def test_disabled(self):
+        api_settings.OBTAIN_USERNAME_THROTTLE = None
+        api_settings.OBTAIN_IP_THROTTLE = None
+
+        for i in range(10):
+            self.assertEqual(self.obtain(self.get_valid_user_pass()).status_code, HTTP_200_OK)
+
+
+class CoalescedRefreshTestCase(BaseTestCase):
+    """
+    Test coalesced refresh and grace period case.
+    """
+
+    def setUp(self):
+        super().setUp()
+        auth_key_cache.clear()
+        refresh_cache.clear()
+        cache.clear()
+        self.auth_key = models.AuthKey.objects.create(owner=self.valid_user)
+        self.refresh_key = models.RefreshKey.objects.create(owner=self.valid_user)
+        self.data = {'auth_key': self.auth_key.key.hex, 'refresh_key': self.refresh_key.key.hex}
+
+    def tearDown(self):
+        # Restore refresh settings to default
+        for name in ('REFRESH_COALESCE_WINDOW', 'REFRESH_GRACE_PERIOD'):
+            setattr(api_settings, name, api_settings.defaults[name])
+        refresh_cache.clear()
+
+    def authenticate(self, key):
+        try:
+            AuthKeyAuthentication().authenticate_credentials(key)
+        except AuthenticationFailed:
+            return False
+
+        return True
+
+    def refresh(self, data):
+        view = views.AuthKeyViewSet.as_view({'put': 'refresh'})
+        return view(factory.put(reverse('auth-refresh'), data))
+
+    def test_coalesce(self):
+        api_settings.REFRESH_COALESCE_WINDOW = timedelta(seconds=10)
+        response = self.refresh(self.data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        # The same keys are returned without writing.
+        with self.assertNumQueries(0):
+            coalesced_response = self.refresh(self.data)
+
+        self.assertEqual(coalesced_response.status_code, HTTP_200_OK)
+        self.assertEqual(coalesced_response.data, response.data)
+
+        # The other processes find the keys in the Django cache.
+        refresh_cache.local.clear()
+        self.assertEqual(self.refresh(self.data).data, response.data)
+        self.assertTrue(self.authenticate(response.data.get('auth_key')))
+
+        # The new keys are refreshed as usual.
+        next_response = self.refresh(response.data)
+        self.assertEqual(next_response.status_code, HTTP_200_OK)
+        self.assertNotEqual(next_response.data, response.data)
+
+    def test_coalesce_entry(self):
+        api_settings.REFRESH_COALESCE_WINDOW = timedelta(seconds=10)
+        api_settings.REFRESH_GRACE_PERIOD = timedelta(seconds=10)
+        response = self.refresh(self.data)
+
+        # Only the keys are cached, not their owner.
+        entry = cache.get(refresh_cache.make_key(**self.data))
+        self.assertIsInstance(entry, RefreshEntry)
+        self.assertFalse(any(isinstance(value, Model) for value in entry))
+        self.assertNotIn(self.valid_user.password, repr(entry))
+        self.assertEqual(entry.owner_id, self.valid_user.pk)
+
+        refresh_cache.local.clear()
+        auth_key, refresh_key = refresh_cache.get(**self.data)
+        self.assertEqual((auth_key.key, refresh_key.key), (response.data['auth_key'], response.data['refresh_key']))
+        self.assertEqual(auth_key.get_expiration(), models.AuthKey.objects.get(key=auth_key.key).get_expiration())
+
+    def test_coalesce_concurrent(self):
+        api_settings.REFRESH_COALESCE_WINDOW = timedelta(seconds=10)
+        response = self.refresh(self.data)
+        get = refresh_cache.get
+
+        # The refresh that waited for the first one finds the keys once its update matched nothing.
+        with patch.object(refresh_cache, 'get', side_effect=[None, get(**self.data)]):
+            auth_key, refresh_key = compat.refresh_keys(**self.data)
+
+        self.assertEqual(auth_key.key, response.data.get('auth_key'))
+        self.assertEqual(refresh_key.key, response.data.get('refresh_key'))
+        self.assertTrue(models.AuthKey.objects.filter(key=auth_key.key).exists())
+
+    def test_grace_period(self):
+        api_settings.REFRESH_GRACE_PERIOD = timedelta(seconds=1)
+        response = self.refresh(self.data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        # The replaced key is valid until the grace period ends.
+        self.assertTrue(self.authenticate(self.auth_key.key))
+        self.assertTrue(self.authenticate(response.data.get('auth_key')))
+        sleep(1)
+        self.assertFalse(self.authenticate(self.auth_key.key))
+        self.assertTrue(self.authenticate(response.data.get('auth_key')))
+
+    def test_grace_period_longer_than_cache(self):
+        api_settings.REFRESH_GRACE_PERIOD = timedelta(minutes=5)
+        api_settings.KEY_CACHE_TIMEOUT = timedelta(seconds=1)
+
+        try:
+            self.assertEqual(self.refresh(self.data).status_code, HTTP_200_OK)
+            sleep(1)
+            # The replaced key is kept for the grace period, not for KEY_CACHE_TIMEOUT.
+            self.assertTrue(self.authenticate(self.auth_key.key))
+
+            api_settings.KEY_CACHE_TIMEOUT = None
+
+            with self.assertRaises(ImproperlyConfigured):
+                compat.refresh_keys(self.auth_key.key, self.refresh_key.key)
+        finally:
+            api_settings.KEY_CACHE_TIMEOUT = api_settings.defaults['KEY_CACHE_TIMEOUT']
+
+    def test_without_grace_period(self):
+        response = self.refresh(self.data)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertFalse(self.authenticate(self.auth_key.key))
+        self.assertEqual(self.refresh(self.data).status_code, HTTP_403_FORBIDDEN)
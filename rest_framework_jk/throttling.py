@@ -0,0 +1,136 @@
+from time import time
+from hashlib import sha1
+from threading import Lock
+
+from django.core.cache import caches
+
+from rest_framework.throttling import BaseThrottle
+
+from rest_framework_jk.cache import LocalCache
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.settings import api_settings
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+# Create your throttlings here.
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Return the number of the attempts and the period in seconds of the rate, or None if it is disabled.
+
+    :param str rate: Rate such as '10/min', the number of the attempts allowed in each period.
+    """
+    if not rate:
+        return None
+
+    capacity, period = rate.split('/')
+    return int(capacity), PERIODS[period[0]]
+
+
+class ObtainThrottle:
+    """
+    Fixed window counters in front of the password hashing of the obtain endpoint,
+    keyed by the username and the client IP.
+    The counters are kept per process, or in the Django cache if THROTTLE_CACHE_ALIAS is set.
+    They are incremented atomically, under a lock or with cache.incr(), so that concurrent attempts
+    are not allowed beyond the rate.
+    """
+    scopes = (
+        ('username', 'OBTAIN_USERNAME_THROTTLE'),
+        ('ip', 'OBTAIN_IP_THROTTLE'),
+    )
+
+    def __init__(self):
+        self.local = LocalCache('THROTTLE_CACHE_SIZE')
+        self.lock = Lock()
+
+    @property
+    def shared(self):
+        alias = api_settings.THROTTLE_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def make_key(self, scope, ident, window):
+        # The username may contain characters that are not valid in the cache keys.
+        return 'jk:throttle:%s:%s:%d' % (scope, sha1(ident.encode()).hexdigest(), window)
+
+    def incr(self, key, delta, timeout):
+        """
+        Add delta to the counter and return the new count.
+
+        :param str key: Cache key of the counter.
+        :param int delta: Number added to the counter, negative to give the attempt back.
+        :param float timeout: Seconds until the window of the counter ends.
+        """
+        if self.shared is None:
+            with self.lock:
+                count = (self.local.get(key) or 0) + delta
+                self.local.set(key, count, timeout)
+                return count
+
+        # The counter is created once per window, then only incremented.
+        self.shared.add(key, 0, timeout)
+
+        try:
+            return self.shared.incr(key, delta)
+        except ValueError:
+            # The counter was evicted between add() and incr().
+            self.shared.add(key, 0, timeout)
+            return self.shared.incr(key, delta)
+
+    def check(self, request, username):
+        """
+        Count the attempt in the window of each scope.
+        Return 0 if the attempt is allowed, otherwise the seconds to wait, and the attempt is not counted.
+
+        :param request: Request of the attempt.
+        :param str username: Username of the attempt.
+        """
+        current = time()
+        counted = []
+
+        for scope, name in self.scopes:
+            rate = parse_rate(getattr(api_settings, name))
+
+            if rate is None or (scope == 'ip' and request is None):
+                continue
+
+            capacity, period = rate
+            ident = str(username) if scope == 'username' else BaseThrottle().get_ident(request)
+            window = int(current // period)
+            key = self.make_key(scope, ident, window)
+            # A counter left alone for its window expires, as if it did not exist.
+            timeout = (window + 1) * period - current
+            counted.append((key, timeout))
+
+            if self.incr(key, 1, timeout) > capacity:
+                for counted_key, counted_timeout in counted:
+                    self.incr(counted_key, -1, counted_timeout)
+
+                metrics.inc('jk_throttled_total', scope=scope)
+                return timeout
+
+        return 0
+
+    async def acheck(self, request, username):
+        """
+        Asynchronous version of check().
+
+        :param request: Request of the attempt.
+        :param str username: Username of the attempt.
+        """
+        if self.shared is None:
+            return self.check(request, username)
+
+        return await sync_to_async(self.check)(request, username)
+
+    def clear(self):
+        self.local.clear()
+
+
+obtain_throttle = ObtainThrottle()
@@ -0,0 +1,91 @@
+from time import perf_counter
+from functools import wraps
+from inspect import iscoroutinefunction
+from contextvars import ContextVar
+from collections import OrderedDict
+
+from django.db import connection
+
+# Create your timings here.
+
+# The timing of the current request, None unless ServerTimingMiddleware is installed.
+current_timing = ContextVar('rest_framework_jk_timing', default=None)
+
+
+class RequestTiming:
+    """
+    Time spent in rest_framework_jk and the queries it issued during one request.
+    """
+
+    def __init__(self):
+        self.durations = OrderedDict()
+        self.queries = 0
+        self.depth = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def start(self):
+        self.depth += 1
+        return perf_counter()
+
+    def stop(self, name, started):
+        self.durations[name] = self.durations.get(name, 0.0) + perf_counter() - started
+        self.depth -= 1
+
+    def get_header(self):
+        """
+        Return the value of the Server-Timing header, the durations are in milliseconds.
+        """
+        metrics = ['%s;dur=%.3f' % (name, duration * 1000) for name, duration in self.durations.items()]
+        metrics.append('jk-queries;desc="%d"' % self.queries)
+        return ', '.join(metrics)
+
+
+def timed(name):
+    """
+    Decorator adding the duration of the function or the coroutine function to the timing of the current request.
+    The queries are counted in the outermost timed call only, and not in the threads of the async ORM.
+
+    :param str name: Server-Timing metric name.
+    """
+
+    def decorator(function):
+        if iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                timing = current_timing.get()
+
+                if timing is None:
+                    return await function(*args, **kwargs)
+
+                started = timing.start()
+
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    timing.stop(name, started)
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                timing = current_timing.get()
+
+                if timing is None:
+                    return function(*args, **kwargs)
+
+                nested = timing.depth > 0
+                started = timing.start()
+
+                try:
+                    if nested:
+                        return function(*args, **kwargs)
+
+                    with connection.execute_wrapper(timing.count_query):
+                        return function(*args, **kwargs)
+                finally:
+                    timing.stop(name, started)
+
+        return wrapper
+
+    return decorator
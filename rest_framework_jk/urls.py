@@ -7,4 +7,5 @@ from rest_framework_jk import views
 router = routers.DefaultRouter(trailing_slash=False)
 router.register('auth', views.AuthKeyViewSet, basename='auth')
 router.register('access', views.AccessKeyViewSet, basename='access')
+router.register('introspect', views.IntrospectionViewSet, basename='introspect')
 urlpatterns = router.urls
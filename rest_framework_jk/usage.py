@@ -0,0 +1,94 @@
+from time import monotonic
+from datetime import timedelta
+from threading import Lock
+from collections import defaultdict
+
+from django.utils.timezone import now
+
+from rest_framework_jk import models
+from rest_framework_jk.settings import api_settings
+
+# Create your usages here.
+
+
+class UsageBuffer:
+    """
+    Write-behind buffer of key usages.
+    The usages are recorded in memory and written in batches,
+    at most once per key per USAGE_WRITE_INTERVAL.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.written = {}
+        self.flushed_at = monotonic()
+        self.lock = Lock()
+
+    def touch(self, instance, field):
+        """
+        Record the usage of the key in the field.
+
+        :param instance: Key model instance.
+        :param str field: Name of the timestamp field to update.
+        """
+        interval = api_settings.USAGE_WRITE_INTERVAL
+
+        if not interval or not isinstance(instance, models.AbstractKey):
+            return
+
+        current = now()
+        threshold = current - interval
+        item = (type(instance), instance.pk, field)
+        used_at = getattr(instance, field)
+        written_at = self.written.get(item)
+
+        # The key has been written recently enough.
+        if (used_at and used_at > threshold) or (written_at and written_at > threshold):
+            return
+
+        with self.lock:
+            self.pending[item] = current
+            self.written[item] = current
+
+    def flush_due(self):
+        if not self.pending:
+            return False
+
+        interval = api_settings.USAGE_FLUSH_INTERVAL.total_seconds()
+        return len(self.pending) >= api_settings.USAGE_FLUSH_SIZE or monotonic() - self.flushed_at >= interval
+
+    def flush(self):
+        """
+        Write the recorded usages with one bulk update per model and field.
+        """
+        threshold = now() - (api_settings.USAGE_WRITE_INTERVAL or timedelta(0))
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = monotonic()
+            # Forget the keys that may be written again.
+            self.written = {item: written_at for item, written_at in self.written.items() if written_at > threshold}
+
+        batches = defaultdict(list)
+
+        for (model, pk, field), used_at in pending.items():
+            batches[(model, field)].append(model(pk=pk, **{field: used_at}))
+
+        for (model, field), instances in batches.items():
+            fields = [field]
+
+            # The stored expiration date slides along with the key.
+            if field == 'updated_at' and issubclass(model, models.AbstractExpiringKey):
+                for instance in instances:
+                    instance.expires_at = instance.updated_at + instance.get_expiration_delta()
+                fields.append('expires_at')
+
+            model.objects.bulk_update(instances, fields, batch_size=api_settings.USAGE_FLUSH_SIZE)
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+            self.written = {}
+
+
+usage_buffer = UsageBuffer()
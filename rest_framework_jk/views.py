@@ -1,9 +1,31 @@
-from rest_framework import viewsets, mixins
+from time import time
+from hashlib import sha256
+
+from django.http import Http404
+from django.db.models import Count, Max, QuerySet
+from django.utils.http import quote_etag
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.translation import gettext as _
+
+from rest_framework import viewsets, mixins, status
+from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.renderers import BaseRenderer
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 
 from rest_framework_jk import models, serializers
+from rest_framework_jk.cache import get_timeout, normalize_key
+from rest_framework_jk.scopes import scope_registry
+from rest_framework_jk.timing import timed
+from rest_framework_jk.compat import verify_signed_auth_key
+from rest_framework_jk.stores import KEY_TYPES, get_key_store
+from rest_framework_jk.metrics import metrics
+from rest_framework_jk.signing import is_signed_key, issue_auth_key
+from rest_framework_jk.settings import api_settings
+from rest_framework_jk.pagination import IdCursorPagination
+from rest_framework_jk.generations import key_generations
 
 # Create your views here.
 
@@ -21,25 +43,31 @@ class AuthKeyViewSet(viewsets.GenericViewSet):
             return serializers.RefreshAuthKeySerializer
         return serializers.AuthKeySerializer
 
+    @metrics.endpoint('obtain')
+    @timed('jk-obtain')
     def create(self, request):
         serializer = self.get_serializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data.get('user')
-        auth_key, void = models.AuthKey.objects.update_or_create(owner=user)
-        refresh_key, void = models.RefreshKey.objects.update_or_create(owner=user)
-        return Response({'auth_key': auth_key.key, 'refresh_key': refresh_key.key})
+        auth_key, refresh_key = get_key_store().obtain(user)
+        return Response({'auth_key': issue_auth_key(auth_key), 'refresh_key': refresh_key.key})
 
     @action(detail=False, methods=['put', 'patch'])
+    @metrics.endpoint('refresh')
+    @timed('jk-refresh')
     def refresh(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         auth_key = serializer.validated_data.get('auth_key')
         refresh_key = serializer.validated_data.get('refresh_key')
-        auth_key.key = auth_key.generate_key
-        auth_key.save()
-        refresh_key.key = refresh_key.generate_key
-        refresh_key.save()
-        return Response({'auth_key': auth_key.key, 'refresh_key': refresh_key.key})
+        refreshed = get_key_store().refresh(auth_key, refresh_key)
+
+        if refreshed is None:
+            message = _('Invalid in with provided credentials.')
+            raise PermissionDenied(message, code='verify_refresh_key')
+
+        auth_key, refresh_key = refreshed
+        return Response({'auth_key': issue_auth_key(auth_key), 'refresh_key': refresh_key.key})
 
 
 class AccessKeyViewSet(mixins.ListModelMixin,
@@ -52,21 +80,246 @@ class AccessKeyViewSet(mixins.ListModelMixin,
     Viewset of access key.
     """
     permission_classes = (IsAuthenticated,)
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
-        return models.AccessKey.objects.filter(owner=self.request.user)
+        return get_key_store().list_by_owner(models.AccessKey, self.request.user)
+
+    def get_object(self):
+        access_key = get_key_store().get(models.AccessKey, self.request.user, self.kwargs[self.lookup_field])
+
+        if access_key is None:
+            raise Http404
+
+        self.check_object_permissions(self.request, access_key)
+        return access_key
 
     def get_serializer_class(self):
         if self.action == 'refresh':
             return serializers.RefreshAccessKeySerializer
+        elif self.action == 'bulk_create':
+            return serializers.BulkCreateAccessKeySerializer
+        elif self.action in ('bulk_destroy', 'bulk_refresh'):
+            return serializers.BulkAccessKeySerializer
         return serializers.AccessKeySerializer
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # The stores other than the database return lists, they are serialized as they are.
+        if not isinstance(queryset, QuerySet):
+            page = self.paginate_queryset(queryset)
+
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        etag = self.get_etag(queryset)
+        response = get_conditional_response(request, etag=etag)
+
+        if response is not None:
+            return response
+
+        # Only the fields of the serializer are read, without building the instances.
+        rows = queryset.values('id', 'key', 'name', 'scopes')
+        page = self.paginate_queryset(rows)
+        data = self.serialize_rows(rows.order_by('id') if page is None else page)
+        response = Response(data) if page is None else self.get_paginated_response(data)
+        response['ETag'] = etag
+        return response
+
+    def get_etag(self, queryset):
+        """
+        Return the entity tag of the list, from the number of the keys and their last update.
+        Saving, refreshing, creating or deleting a key changes one of them.
+        """
+        aggregate = queryset.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+        # The page depends on the query parameters, and the scope names on the settings.
+        value = repr((
+            self.request.user.pk,
+            aggregate['count'],
+            aggregate['updated_at'] and aggregate['updated_at'].isoformat(),
+            self.request.get_full_path(),
+            sorted(scope_registry.get_bits().items()),
+        ))
+        return quote_etag(sha256(value.encode()).hexdigest()[:32])
+
+    def serialize_rows(self, rows):
+        """
+        Return the representations of the values rows, the same as the ones of AccessKeySerializer.
+        """
+        for row in rows:
+            row['key'] = str(row['key'])
+            row['scopes'] = scope_registry.get_names(row['scopes'])
+
+        return list(rows)
+
     @action(detail=True, methods=['put', 'patch'])
     def refresh(self, request, pk=None):
-        access_key = self.get_object()
-        access_key.key = access_key.generate_key
-        access_key.save()
+        access_key = get_key_store().rotate(self.get_object())
         return Response({'access_key': access_key.key})
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
+
+    def perform_destroy(self, instance):
+        get_key_store().revoke(instance)
+
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk')
+    def bulk_create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        access_keys = get_key_store().issue_access_keys(request.user, serializer.validated_data.get('names'))
+        data = serializers.AccessKeySerializer(access_keys, many=True).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = get_key_store().revoke_access_keys(request.user, serializer.validated_data.get('ids'))
+        return Response({'ids': deleted})
+
+    @action(detail=False, methods=['put', 'patch'], url_path='bulk/refresh', url_name='bulk-refresh')
+    def bulk_refresh(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        access_keys = get_key_store().rotate_access_keys(request.user, serializer.validated_data.get('ids'))
+        data = serializers.AccessKeySerializer(access_keys, many=True).data
+        return Response(data)
+
+
+class IntrospectionViewSet(viewsets.GenericViewSet):
+    """
+    Viewset of key introspection, for the API gateways that verify the keys themselves.
+    The keys of each type are found with one query, and their states are returned in the order of the request.
+    Only the admin users can introspect the keys.
+    """
+    permission_classes = (IsAdminUser,)
+    serializer_class = serializers.IntrospectKeySerializer
+
+    @metrics.endpoint('introspect')
+    @timed('jk-introspect')
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        credentials = [self.parse(value) for value in serializer.validated_data.get('keys')]
+        store = get_key_store()
+        instances = {}
+
+        for model in (models.AuthKey, models.AccessKey):
+            keys = {key for key_model, key in credentials if key_model is model and key and not is_signed_key(key)}
+            instances[model] = store.find_many(model, sorted(keys)) if keys else {}
+
+        current = time()
+        results = []
+
+        for model, key in credentials:
+            if key is None:
+                instance = None
+            elif is_signed_key(key):
+                instance = verify_signed_auth_key(key)
+            else:
+                instance = instances[model].get(key)
+
+            results.append(self.describe(model, instance, current))
+
+        response = Response({'keys': results})
+        # The gateways may cache the states until the first of them may change.
+        patch_cache_control(response, private=True, max_age=min(result['max_age'] for result in results))
+        return response
+
+    def parse(self, value):
+        """
+        Return the key model and the key string of the authorization header value.
+        The model is None for the other schemes, and the key is None if it is not valid.
+
+        :param str value: Authorization header value, such as "JK-Access <access_key>".
+        """
+        prefixes = {
+            api_settings.AUTH_HEADER_PREFIX.lower(): models.AuthKey,
+            api_settings.ACCESS_HEADER_PREFIX.lower(): models.AccessKey,
+        }
+        auth = value.split()
+        model = prefixes.get(auth[0].lower()) if auth else None
+
+        if model is None or len(auth) != 2:
+            return model, None
+
+        # Signed keys are verified as they are.
+        if model is models.AuthKey and api_settings.SIGNED_AUTH_KEYS and is_signed_key(auth[1]):
+            return model, auth[1]
+
+        return model, normalize_key(auth[1])
+
+    def describe(self, model, instance, current):
+        """
+        Return the state of the key instance, or of the unknown key if it is None.
+
+        :param model: Key model class, or None for the other schemes.
+        :param instance: Key instance or SignedKey, with its owner loaded.
+        :param float current: Current timestamp.
+        """
+        state = {
+            'key_type': KEY_TYPES.get(model),
+            'active': False,
+            'status': 'unknown',
+            'owner_id': None,
+            'expires_in': None,
+        }
+
+        if instance is not None:
+            if isinstance(instance, models.AbstractExpiringKey):
+                expires_at = instance.get_expiration().timestamp()
+            else:
+                # SignedKey carries its expiration timestamp, and access keys do not expire.
+                expires_at = getattr(instance, 'expires_at', None)
+
+            state['owner_id'] = instance.owner_id
+            state['expires_in'] = None if expires_at is None else max(int(expires_at - current), 0)
+
+            if not instance.owner.is_active:
+                state['status'] = 'disabled'
+            elif isinstance(instance, models.AbstractKey) and not key_generations.is_current(instance):
+                state['status'] = 'revoked'
+            elif expires_at is not None and expires_at < current:
+                state['status'] = 'expired'
+            else:
+                state['status'] = 'active'
+                state['active'] = True
+
+        if state['active']:
+            max_age = get_timeout('INTROSPECTION_MAX_AGE') or 0
+
+            if state['expires_in'] is not None:
+                max_age = min(max_age, state['expires_in'])
+        else:
+            max_age = get_timeout('NEGATIVE_KEY_CACHE_TIMEOUT') or 0
+
+        state['max_age'] = int(max_age)
+        return state
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+    Renderer of the Prometheus text exposition format.
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data.encode(self.charset) if isinstance(data, str) else str(data).encode(self.charset)
+
+
+class MetricsView(APIView):
+    """
+    View of the metrics in the Prometheus text format.
+    It is not routed by default, and only the admin users can read it.
+    """
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        return Response(metrics.render())
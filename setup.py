@@ -17,7 +17,7 @@ setup(
     author='pandy1988',
     author_email='github@pandy1988.sakura.ne.jp',
     license='MIT',
-    packages=find_packages(exclude=['contrib', 'docs', 'tests']),
+    packages=find_packages(exclude=['contrib', 'docs', 'tests', 'benchmarks', 'benchmarks.*']),
     # https://pypi.python.org/pypi?%3Aaction=list_classifiers
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -31,6 +31,8 @@ setup(
     extras_require={
         'dev': [],
         'test': [],
+        # The async views and authentications.
+        'async': ['Django>=4.2', 'adrf'],
     },
     package_data={
         'sample': [],